@@ -0,0 +1,236 @@
+"""Сравнение синхронного (WSGI) и асинхронного (ASGI) обработчиков под
+конкурентной нагрузкой.
+
+Запуск из каталога проекта:
+    python -m benchmarks.bench_async --output bench_async.json
+
+Бенчмарк создает тестовую БД, заполняет ее курьерами и заказами и для
+каждого режима выполняет опросы POST /orders/assign и GET /couriers/<id>
+от заданного числа одновременных клиентов:
+
+* wsgi -- клиенты в отдельных потоках обслуживает один синхронный воркер,
+  который одновременно выполняет не более --wsgi-threads запросов;
+* asgi -- клиенты-корутины обслуживает один цикл событий через
+  асинхронные обработчики.
+
+Перед каждым замером назначения сбрасываются. Результаты сохраняются в
+JSON с упорядоченными ключами.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import threading
+import time
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'candy_delivery.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.db import connection, connections  # noqa: E402
+from django.test import AsyncClient, Client  # noqa: E402
+from django.test.utils import (setup_test_environment,  # noqa: E402
+                               teardown_test_environment)
+from django.urls import reverse  # noqa: E402
+
+from delivery import services  # noqa: E402
+from delivery.models import (Courier, Invoice, Order, Region,  # noqa: E402
+                             TimeInterval)
+
+CONCURRENCY = [1, 8, 32]
+COURIERS = 64
+ORDERS_PER_COURIER = 20
+SEED = 2021
+
+
+def seed_database(couriers, orders_per_courier):
+    """Заполнить БД курьерами и заказами района 1 и вернуть идентификаторы
+    курьеров."""
+
+    rnd = random.Random(SEED)
+    Region.objects.create(code=1)
+    interval = TimeInterval.objects.create(name='00:00-23:59')
+    courier_ids = list(range(1, couriers + 1))
+    for courier_id in courier_ids:
+        courier = Courier.objects.create(
+            courier_id=courier_id,
+            courier_type=rnd.choice(Courier.CourierType.values))
+        courier.regions.add(1)
+        courier.working_hours.add(interval)
+    for order_id in range(1, couriers * orders_per_courier + 1):
+        Order.objects.create(order_id=order_id,
+                             weight=rnd.randint(1, 500) / 100,
+                             region_id=1).delivery_hours.add(interval)
+    return courier_ids
+
+
+def reset_assignments():
+    """Удалить все развозы и вернуть заказы в неназначенные."""
+
+    Invoice.objects.all().delete()
+    services.set_orders_status(
+        list(Order.objects.values_list('order_id', flat=True)),
+        Order.Status.UNASSIGNED)
+    services.packing_cache.clear()
+
+
+def summarize(mode, concurrency, latencies, elapsed):
+    """Вернуть результаты замера."""
+
+    latencies = sorted(latencies)
+    return {
+        'mode': mode,
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'rps': round(len(latencies) / elapsed, 1),
+        'p50': round(statistics.median(latencies), 6),
+        'p95': round(latencies[int(len(latencies) * 0.95) - 1], 6),
+    }
+
+
+def run_wsgi(courier_ids, concurrency, wsgi_threads):
+    """Выполнить опросы через синхронный обработчик и вернуть латентности
+    запросов и общее время."""
+
+    worker = threading.Semaphore(wsgi_threads)
+    latencies = []
+
+    def poll(courier_ids):
+        client = Client()
+        try:
+            for courier_id in courier_ids:
+                for method, url, data in requests_for(courier_id):
+                    started = time.perf_counter()
+                    with worker:
+                        if method == 'post':
+                            client.post(url, data,
+                                        content_type='application/json')
+                        else:
+                            client.get(url)
+                    latencies.append(time.perf_counter() - started)
+        finally:
+            connections.close_all()
+
+    threads = [threading.Thread(target=poll,
+                                args=(courier_ids[i::concurrency],))
+               for i in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, time.perf_counter() - started
+
+
+def run_asgi(courier_ids, concurrency):
+    """Выполнить опросы через асинхронные обработчики в одном цикле событий
+    и вернуть латентности запросов и общее время."""
+
+    latencies = []
+
+    async def poll(courier_ids):
+        client = AsyncClient()
+        for courier_id in courier_ids:
+            for method, url, data in requests_for(courier_id):
+                started = time.perf_counter()
+                if method == 'post':
+                    await client.post(url, data,
+                                      content_type='application/json')
+                else:
+                    await client.get(url)
+                latencies.append(time.perf_counter() - started)
+
+    async def run_all():
+        await asyncio.gather(*[poll(courier_ids[i::concurrency])
+                               for i in range(concurrency)])
+
+    started = time.perf_counter()
+    asyncio.run(run_all())
+    return latencies, time.perf_counter() - started
+
+
+def requests_for(courier_id):
+    """Вернуть запросы одного опроса курьера: назначение и его данные."""
+
+    return [
+        ('post', reverse('orders-assign'), {'courier_id': courier_id}),
+        ('get', reverse('couriers-detail', args=[courier_id]), None),
+    ]
+
+
+def run(concurrency_levels, modes, couriers, orders_per_courier,
+        wsgi_threads):
+    """Выполнить все замеры и вернуть список результатов."""
+
+    courier_ids = seed_database(couriers, orders_per_courier)
+    results = []
+    for concurrency in concurrency_levels:
+        for mode in modes:
+            reset_assignments()
+            connections.close_all()
+            if mode == 'wsgi':
+                latencies, elapsed = run_wsgi(courier_ids, concurrency,
+                                              wsgi_threads)
+            else:
+                latencies, elapsed = run_asgi(courier_ids, concurrency)
+            result = summarize(mode, concurrency, latencies, elapsed)
+            results.append(result)
+            print(f'{mode:5} {concurrency:4} {result["rps"]:10.1f} rps '
+                  f'p50 {result["p50"]:.4f}s p95 {result["p95"]:.4f}s',
+                  file=sys.stderr)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--output', default='bench_async.json',
+                        help='файл для сохранения результатов')
+    parser.add_argument('--concurrency', type=int, nargs='+',
+                        default=CONCURRENCY,
+                        help='числа одновременных клиентов')
+    parser.add_argument('--modes', nargs='+', choices=['wsgi', 'asgi'],
+                        default=['wsgi', 'asgi'],
+                        help='режимы обработки запросов')
+    parser.add_argument('--couriers', type=int, default=COURIERS,
+                        help='число курьеров, опрашивающих сервис')
+    parser.add_argument('--orders-per-courier', type=int,
+                        default=ORDERS_PER_COURIER,
+                        help='число заказов на одного курьера')
+    parser.add_argument('--wsgi-threads', type=int, default=1,
+                        help='число потоков синхронного воркера')
+    args = parser.parse_args(argv)
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        results = run(args.concurrency, args.modes, args.couriers,
+                      args.orders_per_courier, args.wsgi_threads)
+    finally:
+        connections.close_all()
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+    report = {
+        'meta': {
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'couriers': args.couriers,
+            'orders_per_courier': args.orders_per_courier,
+            'wsgi_threads': args.wsgi_threads,
+            'seed': SEED,
+        },
+        'results': sorted(results, key=lambda x: (x['concurrency'],
+                                                  x['mode'])),
+    }
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=2, sort_keys=True)
+        file.write('\n')
+
+
+if __name__ == '__main__':
+    main()
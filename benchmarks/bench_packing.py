@@ -0,0 +1,180 @@
+"""Микробенчмарк подбора заказов в развоз.
+
+Запуск из каталога проекта:
+    python -m benchmarks.bench_packing --output bench_packing.json
+
+Для каждого распределения весов, размера пула и типа курьера замеряются
+время подбора, пиковое потребление памяти и заполненность рюкзака.
+Результаты сохраняются в JSON с упорядоченными ключами, поэтому файлы двух
+запусков можно сравнивать обычным diff.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from decimal import Decimal
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'candy_delivery.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from delivery import packing  # noqa: E402
+from delivery.services import (COURIER_LOAD_CAPACITY,  # noqa: E402
+                               get_orders_for_delivery, packing_cache)
+from delivery.tests.test_fixtures import (COURIER_REGIONS,  # noqa: E402
+                                          DELIVERY_HOURS_IN,
+                                          DELIVERY_HOURS_OUT, HEAVY_WEIGHTS,
+                                          OTHER_REGIONS)
+
+POOL_SIZES = [10, 100, 1000, 3000]
+SEED = 2021
+
+
+def uniform_weights(rnd, size):
+    """Вернуть веса, равномерно распределенные от 0.01 до 50 кг."""
+
+    return [Decimal(rnd.randint(1, 5000)) / 100 for _ in range(size)]
+
+
+def light_weights(rnd, size):
+    """Вернуть пул из заказов по 0.01 кг."""
+
+    return [Decimal('0.01')] * size
+
+
+def heavy_tailed_weights(rnd, size):
+    """Вернуть веса с распределением Парето, ограниченные 50 кг."""
+
+    return [min(Decimal(int(rnd.paretovariate(1.2) * 50)) / 100,
+                Decimal(50)) for _ in range(size)]
+
+
+def fixture_weights(rnd, size):
+    """Вернуть веса тест-кейса create_test_case_full, повторенные до размера
+    пула."""
+
+    light = len(COURIER_REGIONS + OTHER_REGIONS) * len(
+        DELIVERY_HOURS_IN + DELIVERY_HOURS_OUT)
+    base = [Decimal('0.01')] * light + [Decimal(str(weight))
+                                        for weight in HEAVY_WEIGHTS]
+    return [base[i % len(base)] for i in range(size)]
+
+
+DISTRIBUTIONS = {
+    'uniform': uniform_weights,
+    'light': light_weights,
+    'heavy_tailed': heavy_tailed_weights,
+    'fixtures': fixture_weights,
+}
+
+
+def measure(func):
+    """Выполнить func и вернуть результат, время в секундах и пиковое
+    потребление памяти в байтах."""
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def run_case(weights, capacity, strategy, repeat):
+    """Замерить подбор заказов для пула весов в сотых долях килограмма и
+    вернуть результат."""
+
+    order_ids = list(range(len(weights)))
+
+    def pack_orders():
+        packing_cache.clear()
+        if strategy == 'auto':
+            return get_orders_for_delivery(order_ids, weights, capacity)
+        return packing.solve(capacity * 100, weights, strategy=strategy)
+
+    times = []
+    peaks = []
+    for _ in range(repeat):
+        pack, elapsed, peak = measure(pack_orders)
+        times.append(elapsed)
+        peaks.append(peak)
+    load = sum(weights[i] for i in pack)
+    return {
+        'wall_time': round(min(times), 6),
+        'peak_memory': max(peaks),
+        'fill_ratio': round(load / (capacity * 100), 4),
+    }
+
+
+def run(pool_sizes, distributions, strategies, repeat):
+    """Выполнить все замеры и вернуть список результатов."""
+
+    results = []
+    for name in distributions:
+        for size in pool_sizes:
+            rnd = random.Random(f'{SEED}-{name}-{size}')
+            weights = [int(weight * 100)
+                       for weight in DISTRIBUTIONS[name](rnd, size)]
+            for courier_type, capacity in COURIER_LOAD_CAPACITY.items():
+                for strategy in strategies:
+                    result = run_case(weights, capacity, strategy, repeat)
+                    result.update({
+                        'distribution': name,
+                        'pool_size': size,
+                        'courier_type': str(courier_type),
+                        'strategy': strategy,
+                    })
+                    results.append(result)
+                    print(f'{name:13} {size:6} {courier_type:5} '
+                          f'{strategy:20} {result["wall_time"]:10.4f}s '
+                          f'{result["peak_memory"]:10}B '
+                          f'{result["fill_ratio"]:.4f}', file=sys.stderr)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--output', default='bench_packing.json',
+                        help='файл для сохранения результатов')
+    parser.add_argument('--sizes', type=int, nargs='+', default=POOL_SIZES,
+                        help='размеры пулов кандидатов')
+    parser.add_argument('--distributions', nargs='+',
+                        choices=sorted(DISTRIBUTIONS),
+                        default=sorted(DISTRIBUTIONS),
+                        help='распределения весов заказов')
+    parser.add_argument('--strategies', nargs='+', default=['auto'],
+                        choices=['auto'] + sorted(packing.PACKING_STRATEGIES),
+                        help='стратегии подбора, auto -- как в '
+                             'get_orders_for_delivery')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='число повторов каждого замера')
+    args = parser.parse_args(argv)
+
+    results = run(args.sizes, args.distributions, args.strategies,
+                  args.repeat)
+    report = {
+        'meta': {
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'repeat': args.repeat,
+            'seed': SEED,
+        },
+        'results': sorted(results, key=lambda x: (
+            x['distribution'], x['pool_size'], x['courier_type'],
+            x['strategy'])),
+    }
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=2, sort_keys=True)
+        file.write('\n')
+    packing.shutdown_executor()
+
+
+if __name__ == '__main__':
+    main()
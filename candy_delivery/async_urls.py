@@ -0,0 +1,9 @@
+from django.urls import include, path
+
+from candy_delivery.urls import urlpatterns as sync_urlpatterns
+
+# Конфигурация URL для запросов через ASGI: асинхронные обработчики горячих
+# эндпоинтов, затем все синхронные маршруты проекта
+urlpatterns = [
+    path('', include('delivery.async_urls')),
+] + sync_urlpatterns
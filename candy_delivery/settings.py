@@ -41,10 +41,11 @@ INSTALLED_APPS = [
     'rest_framework',
     'corsheaders',
 
-    'delivery'
+    'delivery.apps.DeliveryConfig'
 ]
 
 MIDDLEWARE = [
+    'delivery.middleware.async_urlconf_middleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -128,6 +129,48 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 # Настройки бизнес-логики
 IS_NEW_REGIONS_AND_TIME_INTERVALS_AVAILABLE = (
     dynaconf.settings.IS_NEW_REGIONS_AND_TIME_INTERVALS_AVAILABLE)
+# Бюджет памяти (в байтах) на таблицу достижимых весов при подборе заказов
+PACKING_MEMORY_BUDGET = dynaconf.settings.PACKING_MEMORY_BUDGET
+# Бюджет времени (в секундах) на точный подбор заказов в развоз
+PACKING_TIME_BUDGET = dynaconf.settings.PACKING_TIME_BUDGET
+# Стратегия подбора заказов (null -- выбирается автоматически) и точность
+# приближенной стратегии fptas
+PACKING_STRATEGY = dynaconf.settings.PACKING_STRATEGY
+PACKING_FPTAS_EPSILON = dynaconf.settings.PACKING_FPTAS_EPSILON
+# Размер (0 -- кэш отключен) и время жизни в секундах кэша результатов подбора
+# заказов
+PACKING_CACHE_SIZE = dynaconf.settings.PACKING_CACHE_SIZE
+PACKING_CACHE_TTL = dynaconf.settings.PACKING_CACHE_TTL
+# Инкрементальный подбор заказов по профилям курьеров и время жизни его
+# состояния в секундах
+PACKING_INCREMENTAL = dynaconf.settings.PACKING_INCREMENTAL
+PACKING_INCREMENTAL_TTL = dynaconf.settings.PACKING_INCREMENTAL_TTL
+# Общий бюджет памяти (в байтах) на состояния инкрементального подбора
+PACKING_INCREMENTAL_MEMORY_BUDGET = (
+    dynaconf.settings.PACKING_INCREMENTAL_MEMORY_BUDGET)
+# Число заказов, начиная с которого подбор выполняется в пуле процессов (0 --
+# параллельный подбор отключен), и число процессов пула (null -- по числу ядер)
+PACKING_PARALLEL_THRESHOLD = dynaconf.settings.PACKING_PARALLEL_THRESHOLD
+PACKING_PARALLEL_WORKERS = dynaconf.settings.PACKING_PARALLEL_WORKERS
+# Назначение новых заказов свободным курьерам сразу после их создания
+EAGER_ASSIGNMENT = dynaconf.settings.EAGER_ASSIGNMENT
+# Кэш Django. При запуске нескольких воркеров нужен общий для них кэш,
+# например memcached, иначе смена версии курьера не видна другим воркерам
+CACHES = {
+    'default': {
+        'BACKEND': dynaconf.settings.CACHE_BACKEND,
+        'LOCATION': dynaconf.settings.CACHE_LOCATION,
+    }
+}
+# Время жизни в секундах кэшированного ответа GET /couriers/<id> и версий
+# курьеров (0 -- кэш и ETag отключены). Включается только с общим кэшем
+# CACHE_BACKEND
+COURIER_CACHE_TIMEOUT = dynaconf.settings.COURIER_CACHE_TIMEOUT
+# Наибольшее число идентификаторов курьеров в запросе GET /couriers/stats
+COURIER_STATS_MAX_IDS = dynaconf.settings.COURIER_STATS_MAX_IDS
+# Число строк, читаемых из БД и отдаваемых одним блоком при выгрузке истории
+# доставок
+EXPORT_CHUNK_SIZE = dynaconf.settings.EXPORT_CHUNK_SIZE
 
 settings = dynaconf.DjangoDynaconf(__name__)  # noqa
 # HERE ENDS DYNACONF EXTENSION LOAD (No more code below this line)
@@ -3,3 +3,8 @@ from django.apps import AppConfig
 
 class DeliveryConfig(AppConfig):
     name = 'delivery'
+
+    def ready(self):
+        import delivery.checks  # noqa: F401
+        from delivery.signals import connect_signals
+        connect_signals()
@@ -0,0 +1,29 @@
+"""Запуск синхронной работы с БД из асинхронных обработчиков.
+
+ORM Django 3.1 синхронный, поэтому работа с БД одного запроса выполняется
+целиком в отдельном потоке пула (sync_to_async с thread_sensitive=False) со
+своим соединением с БД. Транзакция не выходит за пределы одного вызова, а
+ожидание БД не блокирует цикл событий, поэтому один ASGI-воркер обслуживает
+много одновременных запросов.
+"""
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+
+
+def database_sync_to_async(func):
+    """Вернуть асинхронную обертку синхронной функции, работающей с БД.
+
+    Функция выполняется в потоке пула, устаревшие соединения потока
+    закрываются до и после вызова, как в начале и конце обычного запроса.
+    """
+
+    def inner(*args, **kwargs):
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+    inner.__name__ = func.__name__
+    inner.__doc__ = func.__doc__
+    return sync_to_async(inner, thread_sensitive=False)
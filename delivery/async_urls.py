@@ -0,0 +1,17 @@
+from django.urls import path
+
+from delivery import async_views
+
+# Асинхронные обработчики подключаются перед синхронными маршрутами DRF и
+# носят те же имена, поэтому reverse() работает одинаково под WSGI и ASGI
+urlpatterns = [
+    path('couriers/<int:pk>/', async_views.courier_detail,
+         name='couriers-detail'),
+    path('orders/assign/', async_views.orders_assign, name='orders-assign'),
+    path('orders/assign-batch/', async_views.orders_assign_batch,
+         name='orders-assign-batch'),
+    path('orders/complete/', async_views.orders_complete,
+         name='orders-complete'),
+    path('orders/complete-batch/', async_views.orders_complete_batch,
+         name='orders-complete-batch'),
+]
@@ -0,0 +1,113 @@
+"""Асинхронные обработчики горячих эндпоинтов для запуска под ASGI.
+
+Обработчики повторяют ответы CourierViewSet и OrderViewSet, но вся работа
+с БД одного запроса выполняется в потоке пула через database_sync_to_async,
+поэтому медленный подбор развоза не блокирует цикл событий воркера.
+Остальные методы делегируются синхронным представлениям DRF в потоке пула.
+"""
+import json
+
+from django.http import HttpResponse
+from rest_framework import status
+from rest_framework.exceptions import MethodNotAllowed
+from rest_framework.renderers import JSONRenderer
+
+from delivery.async_services import database_sync_to_async
+from delivery.serializers import (serialize_assign_order,
+                                  serialize_assign_orders_batch,
+                                  serialize_complete_order,
+                                  serialize_complete_orders_batch)
+from delivery.views import CourierViewSet
+
+courier_detail_view = CourierViewSet.as_view(
+    {'get': 'retrieve', 'put': 'update', 'patch': 'partial_update'})
+
+
+def csrf_exempt(view):
+    """Освободить асинхронный обработчик от проверки CSRF, как и
+    представления DRF.
+
+    Декоратор django.views.decorators.csrf.csrf_exempt в Django 3.1
+    превращает корутину в синхронную функцию.
+    """
+
+    view.csrf_exempt = True
+    return view
+
+
+def json_response(data, status_code=status.HTTP_200_OK):
+    """Вернуть ответ с данными, отрисованными так же, как в DRF."""
+
+    return HttpResponse(JSONRenderer().render(data), status=status_code,
+                        content_type='application/json')
+
+
+def render_context(serialize, data):
+    """Подготовить контекст ответа функцией serialize и отрисовать его.
+
+    Выполняется в потоке пула целиком, включая вычисление ленивых
+    QuerySet контекста.
+    """
+
+    context = serialize(data)
+    status_code = (status.HTTP_400_BAD_REQUEST if context.get('error')
+                   else status.HTTP_200_OK)
+    return JSONRenderer().render(context), status_code
+
+
+render_context_async = database_sync_to_async(render_context)
+courier_detail_view_async = database_sync_to_async(courier_detail_view)
+
+
+async def post_context(request, serialize):
+    """Обработать POST-запрос с JSON-телом функцией serialize."""
+
+    if request.method != 'POST':
+        error = MethodNotAllowed(request.method)
+        return json_response({'validation errors': {'detail': error.detail}},
+                             error.status_code)
+    try:
+        data = json.loads(request.body or b'{}')
+    except ValueError as error:
+        return json_response(
+            {'validation errors': {'detail': f'JSON parse error - {error}'}},
+            status.HTTP_400_BAD_REQUEST)
+    content, status_code = await render_context_async(serialize, data)
+    return HttpResponse(content, status=status_code,
+                        content_type='application/json')
+
+
+@csrf_exempt
+async def courier_detail(request, pk):
+    """Обработать запрос к данным курьера в CourierViewSet, который
+    кэширует ответы GET по версии данных курьера."""
+
+    return await courier_detail_view_async(request, pk=pk)
+
+
+@csrf_exempt
+async def orders_assign(request):
+    """Назначить заказы курьеру и вернуть его активный развоз."""
+
+    return await post_context(request, serialize_assign_order)
+
+
+@csrf_exempt
+async def orders_assign_batch(request):
+    """Назначить заказы группе курьеров и вернуть их активные развозы."""
+
+    return await post_context(request, serialize_assign_orders_batch)
+
+
+@csrf_exempt
+async def orders_complete(request):
+    """Отметить заказ выполненным."""
+
+    return await post_context(request, serialize_complete_order)
+
+
+@csrf_exempt
+async def orders_complete_batch(request):
+    """Отметить выполненными группу заказов."""
+
+    return await post_context(request, serialize_complete_orders_batch)
@@ -0,0 +1,76 @@
+"""Версии данных курьеров для кэша ответов GET /couriers/<id>.
+
+Версия курьера -- случайный токен в кэше Django. Ответ хранится в кэше под
+ключом с версией и отдается клиенту с ETag, равным версии. Любое изменение
+данных курьера меняет версию, поэтому устаревшие ответы больше не читаются
+и вытесняются по времени жизни.
+
+Версии и ответы живут COURIER_CACHE_TIMEOUT секунд. Версии должны быть
+общими для всех воркеров, поэтому кэш в памяти процесса для них не
+подходит (см. delivery.checks).
+"""
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.http import parse_etags
+
+
+def courier_version_key(courier_id):
+    """Вернуть ключ версии данных курьера."""
+
+    return f'courier-version:{courier_id}'
+
+
+def courier_response_key(courier_id, version):
+    """Вернуть ключ ответа с данными курьера для версии version."""
+
+    return f'courier-response:{courier_id}:{version}'
+
+
+def get_courier_version(courier_id):
+    """Вернуть текущую версию данных курьера, создав ее при отсутствии."""
+
+    key = courier_version_key(courier_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid.uuid4().hex, settings.COURIER_CACHE_TIMEOUT)
+        version = cache.get(key)
+    return version
+
+
+def bump_courier_versions(courier_ids):
+    """Сменить версии данных курьеров courier_ids.
+
+    Версии меняются сразу и повторно после фиксации транзакции, чтобы ответ,
+    прочитанный до фиксации, не остался в кэше под новой версией.
+    """
+
+    if not settings.COURIER_CACHE_TIMEOUT:
+        return
+    keys = [courier_version_key(courier_id) for courier_id in courier_ids]
+    if not keys:
+        return
+
+    def bump():
+        cache.set_many({key: uuid.uuid4().hex for key in keys},
+                       settings.COURIER_CACHE_TIMEOUT)
+
+    bump()
+    transaction.on_commit(bump)
+
+
+def etag_matches(request, etag, exists=True):
+    """Проверить, передал ли клиент в заголовке If-None-Match тег etag.
+
+    Тег '*' совпадает с любой версией, только если известно, что ресурс
+    существует (exists).
+    """
+
+    header = request.META.get('HTTP_IF_NONE_MATCH')
+    if not header:
+        return False
+    etags = parse_etags(header)
+    return exists and '*' in etags or etag in [
+        x[2:] if x.startswith('W/') else x for x in etags]
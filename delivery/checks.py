@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.core.checks import Error, register
+
+# Кэши, данные которых видны только одному процессу
+PROCESS_LOCAL_CACHE_BACKENDS = [
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+]
+
+
+@register()
+def check_courier_cache(app_configs, **kwargs):
+    """Запретить кэш ответов GET /couriers/<id> на кэше в памяти процесса.
+
+    Версия курьера, смененная в одном воркере, не видна другим, и они
+    продолжают отвечать 304 на устаревший ETag.
+    """
+
+    backend = settings.CACHES['default']['BACKEND']
+    if (settings.COURIER_CACHE_TIMEOUT
+            and backend in PROCESS_LOCAL_CACHE_BACKENDS):
+        return [Error(
+            f'COURIER_CACHE_TIMEOUT включает кэш ответов, но кэш {backend} '
+            f'не общий для воркеров',
+            hint='Укажите в CACHE_BACKEND общий кэш, например memcached, '
+                 'или установите COURIER_CACHE_TIMEOUT: 0',
+            id='delivery.E001',
+        )]
+    return []
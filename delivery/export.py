@@ -0,0 +1,122 @@
+"""Выгрузка истории доставок для расчета заработной платы и аналитики.
+
+Строки развозов вместе с данными развоза, курьера и заказа читаются
+курсором на стороне сервера БД (QuerySet.iterator), форматируются в NDJSON
+или CSV генератором и отдаются блоками не более чем по chunk_size строк,
+поэтому потребляемая память не зависит от числа выгружаемых строк.
+"""
+import csv
+import json
+from datetime import datetime, time, timedelta
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+from delivery.models import InvoiceOrder
+
+# Колонки выгрузки и соответствующие им поля строки развоза
+EXPORT_FIELDS = [
+    ('invoice_id', 'invoice_id'),
+    ('assign_time', 'invoice__assign_time'),
+    ('courier_id', 'invoice__courier_id'),
+    ('courier_type', 'invoice__courier__courier_type'),
+    ('expected_reward', 'invoice__expected_reward'),
+    ('order_id', 'order_id'),
+    ('region', 'order__region_id'),
+    ('weight', 'order__weight'),
+    ('complete_time', 'complete_time'),
+    ('delivery_time', 'delivery_time'),
+]
+EXPORT_COLUMNS = [name for name, _ in EXPORT_FIELDS]
+
+# Типы содержимого форматов выгрузки
+EXPORT_CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+def day_start(date):
+    """Вернуть начало дня date в текущем часовом поясе."""
+
+    return timezone.make_aware(datetime.combine(date, time.min))
+
+
+def get_delivery_history(date_from=None, date_to=None, region=None):
+    """Вернуть QuerySet строк истории доставок в порядке EXPORT_COLUMNS.
+
+    date_from и date_to -- первый и последний день выдачи развозов
+    включительно, region -- район доставки заказов.
+    """
+
+    invoice_orders = InvoiceOrder.objects.all()
+    if date_from is not None:
+        invoice_orders = invoice_orders.filter(
+            invoice__assign_time__gte=day_start(date_from))
+    if date_to is not None:
+        invoice_orders = invoice_orders.filter(
+            invoice__assign_time__lt=day_start(date_to + timedelta(days=1)))
+    if region is not None:
+        invoice_orders = invoice_orders.filter(order__region_id=region)
+    return invoice_orders.order_by('id').values_list(
+        *[field for _, field in EXPORT_FIELDS])
+
+
+def format_ndjson(rows):
+    """Вернуть генератор строк NDJSON по строкам истории доставок."""
+
+    for row in rows:
+        yield json.dumps(dict(zip(EXPORT_COLUMNS, row)),
+                         cls=DjangoJSONEncoder) + '\n'
+
+
+class Echo:
+    """Класс Echo используется как файл для csv.writer, который возвращает
+    записанную строку вместо ее сохранения.
+
+    Методы класса
+    --------
+    write() -- возвращает переданную строку.
+    """
+
+    def write(self, value):
+        """Вернуть переданную строку."""
+
+        return value
+
+
+def format_csv(rows):
+    """Вернуть генератор строк CSV с заголовком по строкам истории
+    доставок."""
+
+    writer = csv.writer(Echo())
+    yield writer.writerow(EXPORT_COLUMNS)
+    for row in rows:
+        yield writer.writerow([
+            value.isoformat() if isinstance(value, datetime) else value
+            for value in row])
+
+
+EXPORT_FORMATTERS = {
+    'ndjson': format_ndjson,
+    'csv': format_csv,
+}
+
+
+def stream_delivery_history(export_format, chunk_size, **filters):
+    """Вернуть генератор блоков выгрузки истории доставок в формате
+    export_format.
+
+    Строки читаются из БД и объединяются в блоки по chunk_size строк.
+    filters -- параметры get_delivery_history.
+    """
+
+    rows = get_delivery_history(**filters).iterator(chunk_size=chunk_size)
+    block = []
+    for line in EXPORT_FORMATTERS[export_format](rows):
+        block.append(line)
+        if len(block) >= chunk_size:
+            yield ''.join(block)
+            block = []
+    if block:
+        yield ''.join(block)
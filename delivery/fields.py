@@ -0,0 +1,72 @@
+from django.db import models
+
+MINUTES_IN_DAY = 24 * 60
+
+
+def interval_mask(begin, end):
+    """Вернуть битовую маску минут интервала [begin, end).
+
+    Бит i маски соответствует минуте i суток. Интервал, у которого начало
+    позже конца, переходит через полночь.
+    """
+
+    if begin <= end:
+        return ((1 << end) - 1) ^ ((1 << begin) - 1)
+    return interval_mask(begin, MINUTES_IN_DAY) | interval_mask(0, end)
+
+
+def intervals_mask(intervals):
+    """Вернуть битовую маску минут, покрытых списком пар (начало, конец)."""
+
+    mask = 0
+    for begin, end in intervals:
+        mask |= interval_mask(begin, end)
+    return mask
+
+
+class TimeMaskField(models.Field):
+    """Класс TimeMaskField описывает поле битовой маски минут суток.
+
+    Родительский класс -- models.Field.
+
+    В БД значение хранится в столбце типа bit(1440), первый бит строки
+    соответствует минуте 00:00. В Python значение представлено целым числом,
+    бит i которого соответствует минуте i.
+    """
+
+    description = 'Битовая маска минут суток'
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('default', 0)
+        super().__init__(*args, **kwargs)
+
+    def db_type(self, connection):
+        return f'bit({MINUTES_IN_DAY})'
+
+    def from_db_value(self, value, expression, connection):
+        return self.to_python(value)
+
+    def to_python(self, value):
+        if value is None or isinstance(value, int):
+            return value
+        return int(value[::-1], 2)
+
+    def get_prep_value(self, value):
+        value = super().get_prep_value(value)
+        if value is None or isinstance(value, str):
+            return value
+        return format(value, f'0{MINUTES_IN_DAY}b')[::-1]
+
+
+@TimeMaskField.register_lookup
+class Overlaps(models.Lookup):
+    """Класс Overlaps описывает проверку пересечения масок минут суток одним
+    побитовым И."""
+
+    lookup_name = 'overlaps'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return (f"({lhs} & {rhs}::bit({MINUTES_IN_DAY})) "
+                f"<> B'0'::bit({MINUTES_IN_DAY})"), lhs_params + rhs_params
@@ -0,0 +1,56 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from delivery.export import EXPORT_FORMATTERS, stream_delivery_history
+from delivery.serializers import DeliveryExportQuerySerializer
+
+
+class Command(BaseCommand):
+    """Класс Command описывает команду выгрузки истории доставок в NDJSON
+    или CSV.
+
+    Родительский класс -- BaseCommand.
+
+    Строки читаются курсором на стороне сервера БД и записываются в файл или
+    в стандартный вывод блоками по --chunk-size строк.
+    """
+
+    help = 'Выгрузить историю доставок для расчета зарплаты и аналитики'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--format', choices=list(EXPORT_FORMATTERS), default='ndjson',
+            help='формат выгрузки')
+        parser.add_argument(
+            '--output', default='-',
+            help='файл выгрузки, по умолчанию стандартный вывод')
+        parser.add_argument(
+            '--date-from', help='первый день выдачи развозов, YYYY-MM-DD')
+        parser.add_argument(
+            '--date-to', help='последний день выдачи развозов, YYYY-MM-DD')
+        parser.add_argument('--region', help='район доставки заказов')
+        parser.add_argument(
+            '--chunk-size', type=int, default=settings.EXPORT_CHUNK_SIZE,
+            help='число строк, читаемых из БД за один раз')
+
+    def handle(self, *args, **options):
+        query = {key: options[key]
+                 for key in ('date_from', 'date_to', 'region')
+                 if options[key] is not None}
+        serializer = DeliveryExportQuerySerializer(
+            data={**query, 'output': options['format']})
+        if not serializer.is_valid():
+            raise CommandError(f'Неверные параметры: {serializer.errors}')
+        filters = dict(serializer.validated_data)
+        blocks = stream_delivery_history(filters.pop('output'),
+                                         options['chunk_size'], **filters)
+        if options['output'] == '-':
+            for block in blocks:
+                self.stdout.write(block, ending='')
+            return
+        with open(options['output'], 'w', newline='',
+                  encoding='utf-8') as file:
+            for block in blocks:
+                file.write(block)
+        self.stderr.write(self.style.SUCCESS(
+            f'История доставок выгружена в {options["output"]}'))
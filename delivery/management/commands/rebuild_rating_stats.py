@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from delivery import services
+
+
+class Command(BaseCommand):
+    """Класс Command описывает команду пересчета агрегатов времени доставки
+    курьеров по районам.
+
+    Родительский класс -- BaseCommand.
+
+    С флагом --check агрегаты не меняются, а сравниваются с историей
+    доставок, при расхождениях команда завершается с ошибкой.
+    """
+
+    help = ('Пересчитать агрегаты времени доставки курьеров по районам, '
+            'по которым считается рейтинг')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='только сравнить агрегаты с историей доставок')
+
+    def handle(self, *args, **options):
+        if not options['check']:
+            count = services.rebuild_region_stats()
+            self.stdout.write(self.style.SUCCESS(
+                f'Агрегаты пересчитаны, строк: {count}'))
+            return
+        mismatches = services.check_region_stats()
+        for (courier_id, region_id, expected_sum, expected_count,
+             actual_sum, actual_count) in mismatches:
+            self.stderr.write(
+                f'Курьер {courier_id}, район {region_id}: ожидается '
+                f'{expected_sum} с за {expected_count} доставок, сохранено '
+                f'{actual_sum} с за {actual_count} доставок')
+        if mismatches:
+            raise CommandError(
+                f'Найдено расхождений агрегатов: {len(mismatches)}')
+        self.stdout.write(self.style.SUCCESS('Агрегаты совпадают с историей '
+                                             'доставок'))
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from delivery import services
+
+
+class Command(BaseCommand):
+    """Класс Command описывает команду сверки заработка курьеров с расчетом
+    по завершенным развозам.
+
+    Родительский класс -- BaseCommand.
+
+    При расхождениях команда завершается с ошибкой, а с флагом --fix
+    исправляет заработок курьеров.
+    """
+
+    help = 'Сверить заработок курьеров с расчетом по завершенным развозам'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--fix', action='store_true',
+            help='исправить заработок курьеров с расхождениями')
+
+    def handle(self, *args, **options):
+        mismatches = services.reconcile_earnings(fix=options['fix'])
+        for courier_id, expected, actual in mismatches:
+            self.stderr.write(f'Курьер {courier_id}: ожидается {expected}, '
+                              f'сохранено {actual}')
+        if mismatches and not options['fix']:
+            raise CommandError(
+                f'Найдено расхождений заработка: {len(mismatches)}')
+        if mismatches:
+            self.stdout.write(self.style.SUCCESS(
+                f'Исправлен заработок курьеров: {len(mismatches)}'))
+            return
+        self.stdout.write(self.style.SUCCESS(
+            'Заработок курьеров совпадает с расчетом'))
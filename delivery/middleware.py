@@ -0,0 +1,30 @@
+import asyncio
+
+from django.core.handlers.asgi import ASGIRequest
+from django.utils.decorators import sync_and_async_middleware
+
+# Конфигурация URL, которая используется для запросов, пришедших через ASGI
+ASYNC_URLCONF = 'candy_delivery.async_urls'
+
+
+@sync_and_async_middleware
+def async_urlconf_middleware(get_response):
+    """Направить запросы, пришедшие через ASGI, на асинхронные обработчики.
+
+    Под WSGI запросы обрабатываются синхронными представлениями без
+    изменений.
+    """
+
+    def set_urlconf(request):
+        if isinstance(request, ASGIRequest):
+            request.urlconf = ASYNC_URLCONF
+
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request):
+            set_urlconf(request)
+            return await get_response(request)
+    else:
+        def middleware(request):
+            set_urlconf(request)
+            return get_response(request)
+    return middleware
@@ -0,0 +1,49 @@
+# Generated by Django 3.1.7 on 2026-10-17 03:40
+
+import delivery.fields
+from django.db import migrations, models
+
+from delivery.fields import intervals_mask
+
+
+def fill_time_masks(apps, schema_editor):
+    """Вычислить маски минут для существующих заказов и курьеров."""
+
+    for model_name, field_name, mask_name in (
+            ('Order', 'delivery_hours', 'delivery_mask'),
+            ('Courier', 'working_hours', 'working_mask')):
+        model = apps.get_model('delivery', model_name)
+        through = getattr(model, field_name).through
+        source = model._meta.model_name
+        intervals = {}
+        for pk, begin, end in through.objects.values_list(
+                f'{source}_id', 'timeinterval__begin', 'timeinterval__end'):
+            intervals.setdefault(pk, []).append((begin, end))
+        for pk, pk_intervals in intervals.items():
+            model.objects.filter(pk=pk).update(
+                **{mask_name: intervals_mask(pk_intervals)})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='courier',
+            name='working_mask',
+            field=delivery.fields.TimeMaskField(default=0, editable=False, verbose_name='Маска минут работы'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='delivery_mask',
+            field=delivery.fields.TimeMaskField(default=0, editable=False, verbose_name='Маска минут доставки'),
+        ),
+        migrations.RunPython(fill_time_masks, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['region', 'weight'], name='order_region_weight_idx'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 3.1.7 on 2026-10-17 03:43
+
+from django.db import migrations, models
+
+
+def fill_order_status(apps, schema_editor):
+    """Вычислить состояние существующих заказов по строкам развозов."""
+
+    Order = apps.get_model('delivery', 'Order')
+    Order.objects.filter(
+        invoice_orders__complete_time__isnull=True,
+        invoice_orders__isnull=False,
+    ).update(status='assigned')
+    Order.objects.filter(
+        invoice_orders__complete_time__isnull=False,
+    ).update(status='completed')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery', '0002_time_masks'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='status',
+            field=models.CharField(choices=[('unassigned', 'Не назначен'), ('assigned', 'Назначен'), ('completed', 'Доставлен')], default='unassigned', editable=False, max_length=10, verbose_name='Состояние заказа'),
+        ),
+        migrations.RunPython(fill_order_status, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(status='unassigned'), fields=['region', 'status'], name='order_region_unassigned_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(status='assigned'), fields=['region', 'status'], name='order_region_assigned_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 3.1.7 on 2026-10-17 03:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery', '0003_order_status'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['courier', 'expected_reward'], name='invoice_courier_reward_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoiceorder',
+            index=models.Index(condition=models.Q(complete_time__isnull=True), fields=['invoice'], name='invoiceorder_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoiceorder',
+            index=models.Index(condition=models.Q(delivery_time__isnull=False), fields=['invoice', 'order', 'delivery_time'], name='invoiceorder_delivered_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(status__in=['unassigned', 'assigned']), fields=['region', 'weight'], name='order_open_region_weight_idx'),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 3.1.7 on 2026-10-17 03:48
+
+import delivery.fields
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_open_orders(apps, schema_editor):
+    """Заполнить таблицу неназначенных заказов."""
+
+    Order = apps.get_model('delivery', 'Order')
+    OpenOrder = apps.get_model('delivery', 'OpenOrder')
+    OpenOrder.objects.bulk_create(
+        OpenOrder(order_id=order_id, region_id=region_id, weight=weight,
+                  delivery_mask=delivery_mask)
+        for order_id, region_id, weight, delivery_mask
+        in Order.objects.filter(status='unassigned').values_list(
+            'order_id', 'region_id', 'weight', 'delivery_mask'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery', '0004_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OpenOrder',
+            fields=[
+                ('order', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='open_order', serialize=False, to='delivery.order', verbose_name='Заказ')),
+                ('weight', models.DecimalField(decimal_places=2, max_digits=4)),
+                ('delivery_mask', delivery.fields.TimeMaskField(default=0, verbose_name='Маска минут доставки')),
+                ('region', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='open_orders', to='delivery.region', verbose_name='Район заказа')),
+            ],
+        ),
+        migrations.RunPython(fill_open_orders, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='openorder',
+            index=models.Index(fields=['region', 'weight'], name='openorder_region_weight_idx'),
+        ),
+        migrations.RemoveIndex(
+            model_name='order',
+            name='order_region_weight_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='order',
+            name='order_region_unassigned_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='order',
+            name='order_region_assigned_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='order',
+            name='order_open_region_weight_idx',
+        ),
+    ]
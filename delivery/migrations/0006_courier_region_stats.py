@@ -0,0 +1,49 @@
+# Generated by Django 3.1.7 on 2026-10-17 04:03
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count, Sum
+
+
+def fill_courier_region_stats(apps, schema_editor):
+    """Заполнить агрегаты времени доставки курьеров по районам."""
+
+    InvoiceOrder = apps.get_model('delivery', 'InvoiceOrder')
+    CourierRegionStat = apps.get_model('delivery', 'CourierRegionStat')
+    CourierRegionStat.objects.bulk_create(
+        CourierRegionStat(courier_id=courier_id, region_id=region_id,
+                          delivery_time_sum=delivery_time_sum,
+                          delivery_count=delivery_count)
+        for courier_id, region_id, delivery_time_sum, delivery_count
+        in InvoiceOrder.objects.filter(delivery_time__isnull=False).values(
+            'invoice__courier_id', 'order__region_id').annotate(
+            delivery_time_sum=Sum('delivery_time'),
+            delivery_count=Count('id')).values_list(
+            'invoice__courier_id', 'order__region_id', 'delivery_time_sum',
+            'delivery_count'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery', '0005_open_orders'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CourierRegionStat',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('delivery_time_sum', models.BigIntegerField(default=0, verbose_name='Сумма времен доставки в секундах')),
+                ('delivery_count', models.PositiveIntegerField(default=0, verbose_name='Число доставленных заказов')),
+                ('courier', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='region_stats', to='delivery.courier', verbose_name='Курьер')),
+                ('region', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='courier_stats', to='delivery.region', verbose_name='Район')),
+            ],
+        ),
+        migrations.RunPython(fill_courier_region_stats,
+                             migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='courierregionstat',
+            constraint=models.UniqueConstraint(fields=('courier', 'region'), name='courierregionstat_unique'),
+        ),
+    ]
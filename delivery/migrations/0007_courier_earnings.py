@@ -0,0 +1,35 @@
+# Generated by Django 3.1.7 on 2026-10-17 04:05
+
+from django.db import migrations, models
+from django.db.models import Exists, OuterRef, Sum
+
+
+def fill_courier_earnings(apps, schema_editor):
+    """Заполнить заработок курьеров по завершенным развозам."""
+
+    Courier = apps.get_model('delivery', 'Courier')
+    Invoice = apps.get_model('delivery', 'Invoice')
+    InvoiceOrder = apps.get_model('delivery', 'InvoiceOrder')
+    lines = InvoiceOrder.objects.filter(invoice=OuterRef('pk'))
+    for courier_id, earnings in Invoice.objects.filter(
+            Exists(lines.filter(delivery_time__isnull=False)),
+            ~Exists(lines.filter(complete_time__isnull=True))).values(
+            'courier_id').annotate(earnings=Sum('expected_reward')).values_list(
+            'courier_id', 'earnings'):
+        Courier.objects.filter(pk=courier_id).update(earnings=earnings)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery', '0006_courier_region_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='courier',
+            name='earnings',
+            field=models.PositiveBigIntegerField(default=0, editable=False, verbose_name='Заработок'),
+        ),
+        migrations.RunPython(fill_courier_earnings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.1.7 on 2026-10-17 04:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery', '0007_courier_earnings'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='fetched',
+            field=models.BooleanField(default=True, verbose_name='Получен курьером'),
+        ),
+    ]
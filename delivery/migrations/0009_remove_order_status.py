@@ -0,0 +1,17 @@
+# Generated by Django 3.1.7 on 2026-10-17 05:07
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery', '0008_invoice_fetched'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='order',
+            name='status',
+        ),
+    ]
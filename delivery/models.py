@@ -1,6 +1,7 @@
 from django.db import models
 from django.utils.translation import gettext_lazy as _
 
+from delivery.fields import TimeMaskField
 from delivery.validators import interval_validator, weight_validator
 
 
@@ -84,9 +85,14 @@ class Courier(models.Model):
         регионы в которых работает курьер
     working_hours = models.ManyToManyField()    FK --> TimeInterval
         интервалы времени в которых работает курьер
+    working_mask : TimeMaskField()
+        битовая маска минут суток, покрытых working_hours
+    earnings : models.PositiveBigIntegerField()
+        заработок курьера, начисляется при завершении развоза.
 
     Методы класса
     --------
+    save() -- сохраняет курьера, не перезаписывая заработок.
     __str__() -- возвращает строковое представление модели.
     """
 
@@ -121,6 +127,31 @@ class Courier(models.Model):
         verbose_name='Часы работы',
         db_index=True,
     )
+    working_mask = TimeMaskField(
+        verbose_name='Маска минут работы',
+        editable=False,
+    )
+    earnings = models.PositiveBigIntegerField(
+        default=0,
+        verbose_name='Заработок',
+        editable=False,
+    )
+
+    def save(self, *args, **kwargs):
+        """Сохранить курьера.
+
+        Заработок меняется только запросом UPDATE в транзакции завершения
+        развоза, а маска минут работы -- запросом UPDATE при изменении часов
+        работы, поэтому при сохранении существующего курьера их значения из
+        памяти в БД не записываются.
+        """
+
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in ('earnings', 'working_mask')]
+        super().save(*args, **kwargs)
 
     def __str__(self) -> str:
         """Вернуть строковое представление в виде типа и идентификатора
@@ -143,7 +174,9 @@ class Order(models.Model):
     region : models.ForeignKey()                FK --> Region
         регион доставки заказа
     delivery_hours = models.ManyToManyField()   FK --> TimeInterval
-        интервалы времени в которые удобно принять заказ.
+        интервалы времени в которые удобно принять заказ
+    delivery_mask : TimeMaskField()
+        битовая маска минут суток, покрытых delivery_hours.
 
     Методы класса
     --------
@@ -171,12 +204,75 @@ class Order(models.Model):
         verbose_name='Часы работы',
         db_index=True,
     )
+    delivery_mask = TimeMaskField(
+        verbose_name='Маска минут доставки',
+        editable=False,
+    )
 
     def __str__(self) -> str:
         """Вернуть строковое представление в виде идентификатора заказа."""
         return f'order_id: {self.order_id}'
 
 
+class OpenOrder(models.Model):
+    """Класс OpenOrder используется для описания модели неназначенного заказа.
+
+    Родительский класс -- models.Model.
+
+    Таблица содержит копию полей, по которым подбираются заказы, только для
+    неназначенных заказов. Строка создается вместе с заказом, удаляется при
+    назначении заказа и создается снова, если заказ исключен из развоза.
+
+    Атрибуты класса
+    --------
+    order : models.OneToOneField()              PK, FK --> Order
+        заказ
+    region : models.ForeignKey()                FK --> Region
+        регион доставки заказа
+    weight : models.DecimalField()
+        вес заказа
+    delivery_mask : TimeMaskField()
+        битовая маска минут суток, покрытых интервалами доставки заказа.
+
+    Методы класса
+    --------
+    from_order() -- возвращает строку неназначенного заказа по заказу.
+    """
+    order = models.OneToOneField(
+        Order,
+        primary_key=True,
+        related_name='open_order',
+        verbose_name='Заказ',
+        on_delete=models.CASCADE,
+    )
+    region = models.ForeignKey(
+        Region,
+        related_name='open_orders',
+        verbose_name='Район заказа',
+        on_delete=models.PROTECT,
+        db_index=False,
+    )
+    weight = models.DecimalField(
+        max_digits=4, decimal_places=2
+    )
+    delivery_mask = TimeMaskField(
+        verbose_name='Маска минут доставки',
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['region', 'weight'],
+                         name='openorder_region_weight_idx'),
+        ]
+
+    @classmethod
+    def from_order(cls, order):
+        """Вернуть строку неназначенного заказа по заказу."""
+
+        return cls(order_id=order.order_id, region_id=order.region_id,
+                   weight=order.weight, delivery_mask=order.delivery_mask)
+
+
 class Invoice(models.Model):
     """Класс Invoice используется для описания модели задания на развоз.
 
@@ -192,7 +288,10 @@ class Invoice(models.Model):
     orders : models.ManyToManyField()       FK --> Order
         заказы включенные в развоз
     expected_reward = models.PositiveIntegerField()
-        ожидаемая вознаграждение курьеру за развоз.
+        ожидаемая вознаграждение курьеру за развоз
+    fetched : models.BooleanField()
+        развоз получен курьером; развоз, назначенный при создании заказов,
+        не получен до первого запроса курьера.
     """
     courier = models.ForeignKey(
         Courier,
@@ -216,6 +315,16 @@ class Invoice(models.Model):
         null=False,
         verbose_name='Ожидаемое вознаграждение',
     )
+    fetched = models.BooleanField(
+        default=True,
+        verbose_name='Получен курьером',
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['courier', 'expected_reward'],
+                         name='invoice_courier_reward_idx'),
+        ]
 
 
 class InvoiceOrder(models.Model):
@@ -252,3 +361,65 @@ class InvoiceOrder(models.Model):
         null=True,
         verbose_name='Время доставки в секундах',
     )
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['invoice'],
+                         name='invoiceorder_active_idx',
+                         condition=models.Q(complete_time__isnull=True)),
+            models.Index(fields=['invoice', 'order', 'delivery_time'],
+                         name='invoiceorder_delivered_idx',
+                         condition=models.Q(delivery_time__isnull=False)),
+        ]
+
+
+class CourierRegionStat(models.Model):
+    """Класс CourierRegionStat используется для описания модели агрегата
+    времени доставки курьера по району.
+
+    Родительский класс -- models.Model.
+
+    Строка хранит сумму и число времен доставки завершенных заказов курьера
+    в районе и обновляется в одной транзакции с завершением заказа, поэтому
+    рейтинг курьера считается по числу его районов, а не по всей истории
+    доставок.
+
+    Атрибуты класса
+    --------
+    courier : models.ForeignKey()           FK --> Courier
+        курьер
+    region : models.ForeignKey()            FK --> Region
+        район доставки
+    delivery_time_sum : models.BigIntegerField()
+        сумма времен доставки в секундах
+    delivery_count : models.PositiveIntegerField()
+        число доставленных заказов.
+    """
+    courier = models.ForeignKey(
+        Courier,
+        related_name='region_stats',
+        verbose_name='Курьер',
+        on_delete=models.CASCADE,
+        db_index=False,
+    )
+    region = models.ForeignKey(
+        Region,
+        related_name='courier_stats',
+        verbose_name='Район',
+        on_delete=models.CASCADE,
+        db_index=False,
+    )
+    delivery_time_sum = models.BigIntegerField(
+        default=0,
+        verbose_name='Сумма времен доставки в секундах',
+    )
+    delivery_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Число доставленных заказов',
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['courier', 'region'],
+                                    name='courierregionstat_unique'),
+        ]
@@ -0,0 +1,766 @@
+"""Движки решения задачи о рюкзаке для подбора заказов в развоз.
+
+Веса заказов и грузоподъемность передаются в целых единицах (сотых долях
+килограмма), результатом работы движков являются индексы выбранных заказов.
+"""
+import bisect
+import hashlib
+import heapq
+import math
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from functools import reduce
+
+# Через сколько строк таблицы (узлов дерева перебора) проверяется исчерпание
+# бюджета времени
+DEADLINE_CHECK_ROWS = 64
+DEADLINE_CHECK_NODES = 4096
+
+# Пороги автоматического выбора стратегии подбора заказов по замерам
+# benchmarks.bench_packing. Стоимость стратегий оценивается в битах таблицы
+# достижимых весов: битовое динамическое программирование обрабатывает около
+# 4 * 10 ** 9 бит в секунду, а каждая строка таблицы обходится еще в
+# DP_ROW_CELLS бит. Комбинация, перебираемая встречей посередине, обходится
+# в MITM_SUBSET_CELLS бит. Динамическое программирование выбирается, пока
+# таблица не превышает DP_MAX_CELLS бит (около 0.5 с), после этого для
+# не более FPTAS_MAX_ORDERS заказов выбирается FPTAS, иначе -- метод ветвей
+# и границ. Объем памяти таблицы ограничен контрольными строками и на выбор
+# стратегии не влияет.
+DP_ROW_CELLS = 2000
+DP_MAX_CELLS = 2 * 10 ** 9
+MITM_MAX_ORDERS = 40
+MITM_SUBSET_CELLS = 2000
+FPTAS_MAX_ORDERS = 50
+
+# Сколько промежуточных строк таблицы (сдвиг и побитовое ИЛИ) создается при
+# вычислении очередной строки сверх хранимых
+WORKING_ROWS = 2
+
+DEFAULT_EPSILON = 0.01
+
+PACKING_STRATEGIES = {}
+
+# Постоянный пул процессов для параллельного подбора заказов
+_executor = None
+_executor_lock = threading.Lock()
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+
+def row_size(max_weight):
+    """Вернуть размер строки таблицы достижимых весов в байтах вместе с
+    заголовком объекта длинного целого."""
+
+    return sys.getsizeof(1 << max_weight)
+
+
+def checkpoint_rows(num_orders, step):
+    """Вернуть наибольшее число строк таблицы, одновременно хранимых при
+    сохранении каждой step-й строки: контрольные строки, строки одного
+    отрезка при обратном проходе и промежуточные строки вычисления."""
+
+    if step == 1:
+        return num_orders + 1 + WORKING_ROWS
+    return math.ceil(num_orders / step) + step + WORKING_ROWS
+
+
+def checkpoint_step(num_orders, max_weight, memory_budget=None):
+    """Вернуть шаг, с которым сохраняются строки таблицы достижимых весов,
+    или None, если таблица не укладывается в бюджет памяти ни с каким шагом.
+
+    Если вся таблица укладывается в бюджет памяти, сохраняется каждая строка.
+    Иначе хранится каждая k-я строка: в памяти одновременно находятся
+    ceil(n / k) контрольных строк и k строк отрезка. Их сумма минимальна при
+    k = ceil(sqrt(n)), поэтому выбирается этот шаг, если при нем строки
+    укладываются в бюджет.
+    """
+
+    size = row_size(max_weight)
+    if (memory_budget is None
+            or checkpoint_rows(num_orders, 1) * size <= memory_budget):
+        return 1
+    step = math.ceil(math.sqrt(num_orders))
+    if checkpoint_rows(num_orders, step) * size > memory_budget:
+        return None
+    return step
+
+
+def _segment_rows(reachable, order_weight, mask):
+    """Вернуть строки таблицы, восстановленные от контрольной строки."""
+
+    rows = [reachable]
+    for weight in order_weight[:-1]:
+        reachable = (reachable | (reachable << weight)) & mask
+        rows.append(reachable)
+    return rows
+
+
+def bitset_knapsack(max_weight, order_weight, memory_budget=None,
+                    deadline=None):
+    """Вернуть индексы заказов, составляющих комбинацию с максимальным весом,
+    не превышающим вес рюкзака.
+
+    Строки таблицы достижимых весов хранятся в виде битовых масок: бит w
+    строки i установлен, если вес w набирается из первых i заказов. Переход к
+    следующей строке выполняется одним сдвигом и побитовым ИЛИ длинного
+    целого.
+
+    Если таблица не укладывается в memory_budget байт, при прямом проходе
+    сохраняются только контрольные строки, а строки очередного отрезка
+    пересчитываются при обратном проходе. Выбор заказов от этого не меняется.
+    Если в бюджет не укладываются и контрольные строки, вызывается
+    MemoryError.
+
+    Если к моменту deadline (по time.monotonic) таблица не достроена, прямой
+    проход прерывается и возвращается лучшая комбинация из уже рассмотренных
+    заказов.
+
+    Индексы возвращаются в порядке обратного прохода по таблице, поэтому
+    набор и порядок заказов совпадают с классической табличной реализацией.
+    """
+
+    step = checkpoint_step(len(order_weight), max_weight, memory_budget)
+    if step is None:
+        raise MemoryError('Таблица достижимых весов не укладывается в бюджет '
+                          'памяти')
+    mask = (1 << (max_weight + 1)) - 1
+    checkpoints = []
+    reachable = 1
+    processed = 0
+    for weight in order_weight:
+        if (deadline is not None and processed % DEADLINE_CHECK_ROWS == 0
+                and time.monotonic() > deadline):
+            break
+        if processed % step == 0:
+            checkpoints.append(reachable)
+        reachable = (reachable | (reachable << weight)) & mask
+        processed += 1
+
+    # Заказ i входит в комбинацию, если остаток веса недостижим без него.
+    result = reachable.bit_length() - 1
+    pack = []
+    i = processed
+    while i > 0 and result > 0:
+        start = (i - 1) // step * step
+        rows = _segment_rows(checkpoints[start // step],
+                             order_weight[start:i], mask)
+        while i > start and result > 0:
+            i -= 1
+            if not rows[i - start] >> result & 1:
+                pack.append(i)
+                result -= order_weight[i]
+        # Строки отрезка освобождаются до восстановления следующего
+        del rows
+    return pack
+
+
+def greedy_pack(max_weight, order_weight, indexes=None, load=0):
+    """Дополнить загрузку load заказами из indexes в порядке убывания веса и
+    вернуть список индексов добавленных заказов и итоговую загрузку."""
+
+    if indexes is None:
+        indexes = range(len(order_weight))
+    pack = []
+    for i in sorted(indexes, key=lambda x: order_weight[x], reverse=True):
+        if load + order_weight[i] <= max_weight:
+            pack.append(i)
+            load += order_weight[i]
+    return pack, load
+
+
+def register_strategy(name):
+    """Зарегистрировать функцию как стратегию подбора заказов под именем name.
+
+    Стратегия принимает грузоподъемность, список весов и именованные
+    параметры deadline, memory_budget, epsilon и возвращает индексы выбранных
+    заказов.
+    """
+
+    def decorator(func):
+        PACKING_STRATEGIES[name] = func
+        return func
+    return decorator
+
+
+def select_strategy(num_orders, max_weight, parallel_threshold=None):
+    """Вернуть имя стратегии, подходящей для числа заказов и грузоподъемности.
+
+    Встреча посередине выбирается, если перебор комбинаций половин заказов
+    дешевле таблицы достижимых весов. Иначе, пока таблица обрабатывается за
+    бюджет времени, выбирается динамическое программирование (параллельное,
+    если число заказов достигло parallel_threshold). Для таблиц большего
+    размера выбирается FPTAS при малом числе заказов, иначе -- метод ветвей и
+    границ.
+    """
+
+    dp_cells = num_orders * (max_weight + 1 + DP_ROW_CELLS)
+    if num_orders <= MITM_MAX_ORDERS:
+        subsets = min(2 ** math.ceil(num_orders / 2), max_weight + 1)
+        if 2 * subsets * MITM_SUBSET_CELLS < dp_cells:
+            return 'meet_in_the_middle'
+    if dp_cells <= DP_MAX_CELLS:
+        if parallel_threshold and num_orders >= parallel_threshold:
+            return 'parallel_dp'
+        return 'dp'
+    if num_orders <= FPTAS_MAX_ORDERS:
+        return 'fptas'
+    return 'branch_and_bound'
+
+
+def _is_expired(deadline):
+    """Вернуть True, если бюджет времени исчерпан."""
+
+    return deadline is not None and time.monotonic() > deadline
+
+
+@register_strategy('dp')
+def dp_strategy(max_weight, order_weight, deadline=None, memory_budget=None,
+                **options):
+    """Точное решение динамическим программированием на битовых масках.
+
+    Если таблица не укладывается в бюджет памяти, задача решается методом
+    ветвей и границ, которому нужна память порядка числа заказов.
+    """
+
+    if checkpoint_step(len(order_weight), max_weight, memory_budget) is None:
+        return branch_and_bound_strategy(max_weight, order_weight, deadline)
+    return bitset_knapsack(max_weight, order_weight, memory_budget, deadline)
+
+
+def get_executor(max_workers=None):
+    """Вернуть постоянный пул процессов, создав его при первом вызове.
+
+    Процессы запускаются методом spawn: дочерние процессы не наследуют
+    соединения с БД родительского процесса.
+    """
+
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=multiprocessing.get_context('spawn'))
+        return _executor
+
+
+def shutdown_executor():
+    """Остановить пул процессов, следующий вызов get_executor создаст
+    новый."""
+
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+        _executor = None
+
+
+def chunk_sums(max_weight, order_weight):
+    """Вернуть битовую маску весов, достижимых из заказов части."""
+
+    mask = (1 << (max_weight + 1)) - 1
+    reachable = 1
+    for weight in order_weight:
+        reachable = (reachable | (reachable << weight)) & mask
+    return reachable
+
+
+def chunk_pack(max_weight, order_weight, target):
+    """Вернуть индексы заказов части, веса которых в сумме дают target."""
+
+    rows = _segment_rows(1, order_weight, (1 << (max_weight + 1)) - 1)
+    pack = []
+    for i in range(len(order_weight) - 1, -1, -1):
+        if target <= 0:
+            break
+        if not rows[i] >> target & 1:
+            pack.append(i)
+            target -= order_weight[i]
+    return pack
+
+
+def _sumset(first, second, mask):
+    """Вернуть маску сумм весов, достижимых из масок first и second."""
+
+    result = 0
+    while second:
+        low = second & -second
+        result |= first << (low.bit_length() - 1)
+        second ^= low
+    return result & mask
+
+
+def _split_target(sums, prefix, target):
+    """Разложить вес target на слагаемые, достижимые в каждой из частей."""
+
+    targets = [0] * len(sums)
+    for j in range(len(sums) - 1, 0, -1):
+        bits = sums[j]
+        while bits:
+            low = bits & -bits
+            weight = low.bit_length() - 1
+            if prefix[j - 1] >> (target - weight) & 1:
+                break
+            bits ^= low
+        targets[j] = weight
+        target -= weight
+    targets[0] = target
+    return targets
+
+
+def _timeout(deadline):
+    """Вернуть время в секундах, оставшееся до deadline."""
+
+    if deadline is None:
+        return None
+    return max(deadline - time.monotonic(), 0)
+
+
+def parallel_knapsack(max_weight, order_weight, executor, chunks,
+                      deadline=None):
+    """Вернуть индексы заказов оптимальной комбинации, вычисленной в пуле
+    процессов executor.
+
+    Заказы делятся на chunks полос по весу. Процессы строят маски
+    достижимых весов своих полос, родительский процесс сворачивает их в
+    маску общих сумм и раскладывает лучший вес на слагаемые по полосам, после
+    чего процессы восстанавливают заказы своих полос.
+    """
+
+    if not order_weight:
+        return []
+    indexes = sorted(range(len(order_weight)), key=lambda x: order_weight[x])
+    size = math.ceil(len(indexes) / chunks)
+    parts = [indexes[k:k + size] for k in range(0, len(indexes), size)]
+    weights = [[order_weight[i] for i in part] for part in parts]
+
+    sums = list(executor.map(chunk_sums, [max_weight] * len(parts), weights,
+                             timeout=_timeout(deadline)))
+    mask = (1 << (max_weight + 1)) - 1
+    prefix = [sums[0]]
+    for reachable in sums[1:]:
+        prefix.append(_sumset(prefix[-1], reachable, mask))
+    targets = _split_target(sums, prefix, prefix[-1].bit_length() - 1)
+
+    packs = executor.map(chunk_pack, [max_weight] * len(parts), weights,
+                         targets, timeout=_timeout(deadline))
+    return [part[i] for part, pack in zip(parts, packs) for i in pack]
+
+
+@register_strategy('parallel_dp')
+def parallel_dp_strategy(max_weight, order_weight, deadline=None,
+                         memory_budget=None, workers=None, **options):
+    """Точное решение динамическим программированием в пуле процессов.
+
+    Если пул недоступен или не уложился в бюджет времени, задача решается в
+    текущем процессе.
+    """
+
+    try:
+        executor = get_executor(workers)
+        return parallel_knapsack(max_weight, order_weight, executor,
+                                 workers or os.cpu_count() or 1, deadline)
+    except BrokenProcessPool:
+        shutdown_executor()
+    except (FutureTimeoutError, OSError, RuntimeError):
+        pass
+    return dp_strategy(max_weight, order_weight, deadline, memory_budget)
+
+
+@register_strategy('branch_and_bound')
+def branch_and_bound_strategy(max_weight, order_weight, deadline=None,
+                              **options):
+    """Точное решение методом ветвей и границ.
+
+    Заказы перебираются в порядке убывания веса, ветвь отсекается, если даже
+    все оставшиеся заказы не улучшают рекорд. При исключении заказа
+    исключаются и следующие за ним заказы того же веса, чтобы не перебирать
+    симметричные комбинации.
+    """
+
+    indexes = sorted(range(len(order_weight)),
+                     key=lambda x: order_weight[x], reverse=True)
+    weights = [order_weight[i] for i in indexes]
+    num_orders = len(weights)
+    suffix = [0] * (num_orders + 1)
+    next_weight = [num_orders] * (num_orders + 1)
+    for k in range(num_orders - 1, -1, -1):
+        suffix[k] = suffix[k + 1] + weights[k]
+        if k + 1 < num_orders and weights[k + 1] == weights[k]:
+            next_weight[k] = next_weight[k + 1]
+        else:
+            next_weight[k] = k + 1
+
+    best_load, best_taken = 0, None
+    stack = [(0, 0, None)]
+    nodes = 0
+    while stack:
+        k, load, taken = stack.pop()
+        if load > best_load:
+            best_load, best_taken = load, taken
+            if best_load == max_weight:
+                break
+        if k == num_orders or load + suffix[k] <= best_load:
+            continue
+        nodes += 1
+        if nodes % DEADLINE_CHECK_NODES == 0 and _is_expired(deadline):
+            break
+        stack.append((next_weight[k], load, taken))
+        if load + weights[k] <= max_weight:
+            stack.append((k + 1, load + weights[k], (k, taken)))
+
+    pack = []
+    while best_taken is not None:
+        k, best_taken = best_taken
+        pack.append(indexes[k])
+    return pack
+
+
+def _subset_sums(max_weight, order_weight, indexes, deadline):
+    """Вернуть словарь достижимых из заказов indexes весов с комбинациями."""
+
+    sums = {0: ()}
+    for i in indexes:
+        if _is_expired(deadline):
+            break
+        weight = order_weight[i]
+        for load, pack in list(sums.items()):
+            load += weight
+            if load <= max_weight and load not in sums:
+                sums[load] = pack + (i,)
+    return sums
+
+
+@register_strategy('meet_in_the_middle')
+def meet_in_the_middle_strategy(max_weight, order_weight, deadline=None,
+                                **options):
+    """Точное решение встречей посередине для небольшого числа заказов.
+
+    Достижимые веса каждой половины заказов перебираются полностью, затем
+    для каждого веса первой половины двоичным поиском подбирается лучшее
+    дополнение из второй.
+    """
+
+    middle = len(order_weight) // 2
+    left = _subset_sums(max_weight, order_weight, range(middle), deadline)
+    right = _subset_sums(max_weight, order_weight,
+                         range(middle, len(order_weight)), deadline)
+    right_loads = sorted(right)
+    best_load, best_pack = -1, ()
+    for load, pack in left.items():
+        k = bisect.bisect_right(right_loads, max_weight - load) - 1
+        if load + right_loads[k] > best_load:
+            best_load = load + right_loads[k]
+            best_pack = pack + right[right_loads[k]]
+    return list(best_pack)
+
+
+@register_strategy('fptas')
+def fptas_strategy(max_weight, order_weight, deadline=None,
+                   epsilon=DEFAULT_EPSILON, **options):
+    """Приближенное решение с гарантией (1 - epsilon) от оптимума.
+
+    Список достижимых весов после добавления каждого заказа прореживается:
+    из весов, отличающихся не более чем в (1 + epsilon / 2n) раз, остается
+    наименьший.
+    """
+
+    delta = epsilon / (2 * max(len(order_weight), 1))
+    loads = [(0, None)]
+    for i, weight in enumerate(order_weight):
+        if _is_expired(deadline):
+            break
+        shifted = [(load + weight, (i, taken)) for load, taken in loads
+                   if load + weight <= max_weight]
+        trimmed = []
+        last = -1
+        for load, taken in heapq.merge(loads, shifted, key=lambda x: x[0]):
+            if load > last * (1 + delta):
+                trimmed.append((load, taken))
+                last = load
+        loads = trimmed
+
+    pack = []
+    taken = loads[-1][1]
+    while taken is not None:
+        i, taken = taken
+        pack.append(i)
+    return pack
+
+
+def solve(max_weight, order_weight, memory_budget=None, time_budget=None,
+          strategy=None, epsilon=DEFAULT_EPSILON, parallel_threshold=None,
+          workers=None, deadline=None):
+    """Вернуть индексы заказов, составляющих комбинацию с максимальным весом,
+    не превышающим вес рюкзака.
+
+    Перед решением последовательно проверяются быстрые пути:
+    * все заказы помещаются -- выбираются все заказы;
+    * веса и грузоподъемность сокращаются на общий делитель весов;
+    * жадная укладка по убыванию веса, если она заполняет рюкзак полностью.
+    Затем задача решается стратегией strategy, а если она не задана --
+    стратегией, выбранной select_strategy (при числе заказов не меньше
+    parallel_threshold -- в пуле из workers процессов). Решение ограничено
+    бюджетом времени time_budget (в секундах) или моментом deadline (по
+    time.monotonic), если он задан: по их исчерпании к лучшей найденной
+    комбинации жадно добавляются оставшиеся заказы и результат сравнивается с
+    жадной укладкой.
+    """
+
+    num_orders = len(order_weight)
+    if sum(order_weight) <= max_weight:
+        return list(range(num_orders - 1, -1, -1))
+
+    divisor = reduce(math.gcd, order_weight, 0)
+    if divisor > 1:
+        order_weight = [weight // divisor for weight in order_weight]
+        max_weight //= divisor
+
+    greedy, greedy_load = greedy_pack(max_weight, order_weight)
+    if greedy_load == max_weight:
+        return greedy
+
+    if not strategy:
+        strategy = select_strategy(num_orders, max_weight,
+                                   parallel_threshold)
+    if strategy not in PACKING_STRATEGIES:
+        raise ValueError(f'Неизвестная стратегия подбора заказов: {strategy}')
+    if deadline is None and time_budget is not None:
+        deadline = time.monotonic() + time_budget
+    pack = PACKING_STRATEGIES[strategy](
+        max_weight, order_weight, deadline=deadline,
+        memory_budget=memory_budget, epsilon=epsilon, workers=workers)
+    chosen = set(pack)
+    rest = (i for i in range(num_orders) if i not in chosen)
+    extra, load = greedy_pack(max_weight, order_weight, rest,
+                              sum(order_weight[i] for i in pack))
+    if load < greedy_load:
+        return greedy
+    return pack + extra
+
+
+def fingerprint(candidates, max_weight):
+    """Вернуть канонический отпечаток списка пар (order_id, вес) и
+    грузоподъемности, не зависящий от порядка заказов."""
+
+    digest = hashlib.sha1(repr(max_weight).encode())
+    for candidate in sorted(candidates):
+        digest.update(repr(candidate).encode())
+    return digest.hexdigest()
+
+
+class PackingCache:
+    """Класс PackingCache описывает LRU-кэш результатов подбора заказов.
+
+    Параметры экземпляра:
+    _________
+    maxsize: int
+        максимальное число записей, 0 -- кэш отключен, None -- без
+        ограничения
+    ttl: float
+        время жизни записи в секундах, None -- без ограничения
+    memory_budget: int
+        суммарный объем записей в байтах, None -- без ограничения
+    sizeof: callable
+        функция, возвращающая объем значения записи в байтах.
+
+    Методы класса
+    --------
+    get(key) -- вернуть значение из кэша или None.
+    set(key, value) -- сохранить значение в кэше.
+    delete(key) -- удалить запись из кэша.
+    trim() -- вытеснить записи сверх бюджета памяти.
+    clear() -- очистить кэш и счетчики.
+    cache_info() -- вернуть счетчики попаданий и промахов.
+    """
+
+    def __init__(self, maxsize=128, ttl=None, memory_budget=None,
+                 sizeof=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.memory_budget = memory_budget
+        self.sizeof = sizeof
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Вернуть значение из кэша или None, если записи нет или она
+        устарела."""
+
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and self.ttl is not None and (
+                    time.monotonic() - entry[1] > self.ttl):
+                del self._data[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value):
+        """Сохранить значение в кэше, вытеснив самые старые записи."""
+
+        if self.maxsize is not None and self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (value, time.monotonic())
+            self._data.move_to_end(key)
+            while (self.maxsize is not None
+                   and len(self._data) > self.maxsize):
+                self._data.popitem(last=False)
+            self._trim()
+
+    def delete(self, key):
+        """Удалить запись из кэша."""
+
+        with self._lock:
+            self._data.pop(key, None)
+
+    def _trim(self):
+        """Вытеснить самые старые записи, пока их суммарный объем превышает
+        бюджет памяти. Вызывается под блокировкой кэша."""
+
+        if self.memory_budget is None or self.sizeof is None:
+            return
+        total = sum(self.sizeof(value) for value, _ in self._data.values())
+        while self._data and total > self.memory_budget:
+            _, (value, _) = self._data.popitem(last=False)
+            total -= self.sizeof(value)
+
+    def trim(self):
+        """Вытеснить записи сверх бюджета памяти.
+
+        Вызывается после изменения объема значений, уже сохраненных в кэше.
+        """
+
+        with self._lock:
+            self._trim()
+
+    def clear(self):
+        """Очистить кэш и счетчики."""
+
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+    def cache_info(self):
+        """Вернуть счетчики попаданий и промахов и размер кэша."""
+
+        with self._lock:
+            return CacheInfo(self.hits, self.misses, self.maxsize,
+                             len(self._data))
+
+
+class IncrementalPacking:
+    """Класс IncrementalPacking описывает состояние подбора заказов, которое
+    обновляется при изменении набора кандидатов.
+
+    Хранит строки таблицы достижимых весов для заказов в порядке их
+    поступления. Новый заказ добавляет одну строку, а удаление заказа
+    пересчитывает только строки после него. Комбинация подбирается из
+    последних заказов (см. solve), поэтому удаление назначенных заказов стоит
+    времени порядка размера комбинации, а не размера набора.
+
+    Параметры экземпляра:
+    _________
+    max_weight: int
+        грузоподъемность в сотых долях килограмма.
+
+    Методы класса
+    --------
+    sync(candidates, deadline) -- привести состояние к набору кандидатов.
+    solve() -- вернуть идентификаторы заказов оптимальной комбинации.
+    """
+
+    def __init__(self, max_weight):
+        self.max_weight = max_weight
+        self.mask = (1 << (max_weight + 1)) - 1
+        self.items = []
+        self.rows = [1]
+        self.rows_computed = 0
+        self.lock = threading.Lock()
+
+    def memory_size(self):
+        """Вернуть оценку объема памяти, занятого строками таблицы, в
+        байтах."""
+
+        return len(self.rows) * row_size(self.max_weight)
+
+    def _append(self, item):
+        """Добавить заказ и строку таблицы для него."""
+
+        reachable = self.rows[-1]
+        self.items.append(item)
+        self.rows.append((reachable | (reachable << item[1])) & self.mask)
+        self.rows_computed += 1
+
+    def sync(self, candidates, deadline=None):
+        """Привести состояние к набору пар (order_id, вес) и вернуть True, если
+        состояние соответствует набору.
+
+        Строки до первого выбывшего заказа остаются без изменений, строки
+        после него пересчитываются, новые заказы добавляются в конец в
+        порядке идентификаторов. Если бюджет времени исчерпан, уже добавленные
+        строки сохраняются для следующего вызова и возвращается False.
+        """
+
+        candidates = dict(candidates)
+        keep = len(self.items)
+        for i, (order_id, weight) in enumerate(self.items):
+            if candidates.get(order_id) != weight:
+                keep = i
+                break
+        tail = [item for item in self.items[keep:]
+                if candidates.get(item[0]) == item[1]]
+        known = {order_id for order_id, _ in self.items[:keep]}
+        known.update(order_id for order_id, _ in tail)
+        new = sorted(item for item in candidates.items()
+                     if item[0] not in known)
+
+        del self.items[keep:]
+        del self.rows[keep + 1:]
+        for i, item in enumerate(tail + new):
+            if (i % DEADLINE_CHECK_ROWS == 0 and _is_expired(deadline)):
+                return False
+            self._append(item)
+        return True
+
+    def solve(self):
+        """Вернуть идентификаторы заказов, составляющих комбинацию с
+        максимальным весом, не превышающим грузоподъемность.
+
+        Максимальный вес берется из последней строки таблицы, а комбинация
+        подбирается из кратчайшего хвоста заказов, набирающего этот вес:
+        таблица достижимых весов хвоста строится от последнего заказа к
+        первому. Поэтому заказы комбинации находятся в конце состояния, и их
+        удаление после назначения пересчитывает только строки хвоста.
+        """
+
+        best = self.rows[-1].bit_length() - 1
+        # suffix[k] -- достижимые веса последних k заказов
+        suffix = [1]
+        i = len(self.items)
+        while not suffix[-1] >> best & 1:
+            i -= 1
+            reachable = suffix[-1]
+            suffix.append(
+                (reachable | (reachable << self.items[i][1])) & self.mask)
+        pack = []
+        result = best
+        for k in range(len(suffix) - 1, 0, -1):
+            if not suffix[k - 1] >> result & 1:
+                order_id, weight = self.items[len(self.items) - k]
+                pack.append(order_id)
+                result -= weight
+        return pack
@@ -1,9 +1,18 @@
 from dateutil.parser import parse
+from django.core.exceptions import ValidationError
+from django.db import transaction
 from django.db.models import F
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from rest_framework import serializers
+from rest_framework.validators import UniqueValidator
 
+from candy_delivery.settings import COURIER_STATS_MAX_IDS
 from delivery import services
-from .models import Courier, InvoiceOrder, Order, Region
+from delivery.cache import bump_courier_versions
+from delivery.export import EXPORT_FORMATTERS
+from delivery.fields import intervals_mask
+from .models import Courier, InvoiceOrder, Order, Region, TimeInterval
 from .services import delete_unavailable_orders
 from .utils import add_regions, add_time_intervals
 from .validators import check_unknown_fields, interval_list_validator
@@ -80,11 +89,145 @@ class OrderRelationsSerializer(serializers.Serializer):
         return validated_data
 
 
+def get_prefetched(field, model):
+    """Вернуть объекты модели model, загруженные списочным сериализатором
+    поля field, или None, если объекты не загружались."""
+
+    prefetched = getattr(field.root, 'prefetched', None)
+    if prefetched is None:
+        return None
+    return prefetched.get(model)
+
+
+class PrefetchedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """ Класс PrefetchedPrimaryKeyRelatedField описывает поле связи по
+    первичному ключу, которое ищет объект среди загруженных списочным
+    сериализатором.
+
+    Родительский класс -- serializers.PrimaryKeyRelatedField.
+    Переопределенные методы -- to_internal_value.
+
+    Если объект не загружен, он запрашивается из БД, поэтому ошибки
+    валидации не отличаются от родительского класса.
+    """
+
+    def to_internal_value(self, data):
+        model = self.get_queryset().model
+        objects = get_prefetched(self, model)
+        if objects is not None and not isinstance(data, bool):
+            try:
+                instance = objects.get(model._meta.pk.to_python(data))
+            except (TypeError, ValueError, ValidationError):
+                instance = None
+            if instance is not None:
+                return instance
+        return super().to_internal_value(data)
+
+
+class PrefetchedUniqueValidator(UniqueValidator):
+    """ Класс PrefetchedUniqueValidator описывает проверку уникальности
+    значения при создании объекта по первичным ключам, загруженным списочным
+    сериализатором.
+
+    Родительский класс -- UniqueValidator.
+    Переопределенные методы -- __call__.
+    """
+
+    def __call__(self, value, serializer_field):
+        existing = get_prefetched(serializer_field, self.queryset.model)
+        if existing is None or serializer_field.parent.instance is not None:
+            return super().__call__(value, serializer_field)
+        if value in existing:
+            raise serializers.ValidationError(self.message, code='unique')
+
+
+def list_values(items, key):
+    """Вернуть все значения списков key элементов items."""
+
+    return [value for item in items if isinstance(item.get(key), list)
+            for value in item[key]]
+
+
+def prefetch_courier_relations(data):
+    """Загрузить районы, интервалы и существующие идентификаторы курьеров,
+    указанные в списке данных курьеров data, тремя запросами и вернуть
+    словарь {модель: {первичный ключ: объект}}."""
+
+    items = [x for x in data if isinstance(x, dict)]
+    region_codes = {int(x) for x in list_values(items, 'regions')
+                    if str(x).isdigit()}
+    interval_names = {x for x in list_values(items, 'working_hours')
+                      if isinstance(x, str)}
+    courier_ids = {int(x['courier_id']) for x in items
+                   if str(x.get('courier_id')).isdigit()}
+    return {
+        Region: Region.objects.in_bulk(region_codes),
+        TimeInterval: TimeInterval.objects.in_bulk(interval_names),
+        Courier: Courier.objects.in_bulk(courier_ids),
+    }
+
+
+class CourierListSerializer(serializers.ListSerializer):
+    """ Класс CourierListSerializer описывает сериализатор списка курьеров,
+    создающий их пакетно.
+
+    Родительский класс -- serializers.ListSerializer.
+    Переопределенные методы -- to_internal_value, create.
+
+    Дополнительные атрибуты класса
+    --------
+    prefetched : dict
+        объекты, загруженные для валидации списка, по моделям.
+
+    Районы, интервалы и существующие курьеры загружаются для всего списка
+    перед валидацией, а курьеры и их связи создаются несколькими запросами
+    в одной транзакции.
+    """
+    prefetched = None
+
+    def to_internal_value(self, data):
+        if isinstance(data, list):
+            self.prefetched = prefetch_courier_relations(data)
+        try:
+            return super().to_internal_value(data)
+        finally:
+            self.prefetched = None
+
+    def create(self, validated_data):
+        couriers = [
+            Courier(courier_id=item['courier_id'],
+                    courier_type=item['courier_type'],
+                    working_mask=intervals_mask(
+                        (x.begin, x.end) for x in item['working_hours']))
+            for item in validated_data]
+        regions_through = Courier.regions.through
+        working_hours_through = Courier.working_hours.through
+        with transaction.atomic():
+            Courier.objects.bulk_create(couriers)
+            regions_through.objects.bulk_create(
+                regions_through(courier_id=item['courier_id'],
+                                region_id=code)
+                for item in validated_data
+                for code in dict.fromkeys(x.code for x in item['regions']))
+            working_hours_through.objects.bulk_create(
+                working_hours_through(courier_id=item['courier_id'],
+                                      timeinterval_id=name)
+                for item in validated_data
+                for name in dict.fromkeys(
+                    x.name for x in item['working_hours']))
+            # bulk_create не отправляет post_save, версии меняем сами
+            bump_courier_versions([x.courier_id for x in couriers])
+        return couriers
+
+
 class CourierSerializer(serializers.ModelSerializer):
     """ Класс CourierSerializer описывает сериализатор модели курьера.
 
     Родительский класс -- serializers.ModelSerializer.
-    Переопределенные методы -- run_validation, update, to_representation.
+    Переопределенные методы -- get_fields, run_validation, update,
+    to_representation.
+
+    Список курьеров сериализуется классом CourierListSerializer.
 
     Дополнительные атрибуты класса
     --------
@@ -102,6 +245,7 @@ class CourierSerializer(serializers.ModelSerializer):
     get_earnings
         Получает значение для поля earnings
     """
+    serializer_related_field = PrefetchedPrimaryKeyRelatedField
     rating = serializers.SerializerMethodField()
     earnings = serializers.SerializerMethodField()
 
@@ -109,6 +253,17 @@ class CourierSerializer(serializers.ModelSerializer):
         model = Courier
         fields = ['courier_id', 'courier_type', 'regions', 'working_hours',
                   'rating', 'earnings', ]
+        list_serializer_class = CourierListSerializer
+
+    def get_fields(self):
+        fields = super().get_fields()
+        # Уникальность идентификатора в списке курьеров проверяется по
+        # идентификаторам, загруженным одним запросом
+        fields['courier_id'].validators = [
+            PrefetchedUniqueValidator(x.queryset, x.message, x.lookup)
+            if isinstance(x, UniqueValidator) else x
+            for x in fields['courier_id'].validators]
+        return fields
 
     def validate_courier_id(self, value):
         if (self.context['request'].method == 'PATCH'
@@ -117,10 +272,14 @@ class CourierSerializer(serializers.ModelSerializer):
         return value
 
     def get_rating(self, instance):
+        # Рейтинги группы курьеров считаются заранее одним запросом
+        ratings = self.context.get('ratings')
+        if ratings is not None:
+            return ratings.get(instance.courier_id)
         return services.get_courier_rating(instance)
 
     def get_earnings(self, instance):
-        return services.get_courier_earning(instance)
+        return instance.earnings
 
     def run_validation(self, data=serializers.empty):
         check_unknown_fields(self.fields, data)
@@ -129,6 +288,9 @@ class CourierSerializer(serializers.ModelSerializer):
     def update(self, instance, validated_data):
         courier = super().update(instance, validated_data)
         delete_unavailable_orders(courier)
+        # Исключение заказов могло завершить развоз и начислить заработок
+        courier.refresh_from_db(fields=['earnings'])
+        bump_courier_versions([courier.courier_id])
         return courier
 
     def to_representation(self, instance):
@@ -144,6 +306,64 @@ class CourierSerializer(serializers.ModelSerializer):
         return result
 
 
+class CourierStatsQuerySerializer(serializers.Serializer):
+    """ Класс CourierStatsQuerySerializer описывает сериализатор параметров
+    запроса данных группы курьеров.
+
+    Родительский класс -- serializers.Serializer.
+    Переопределенные методы -- validate.
+
+    Дополнительные атрибуты класса
+    --------
+    ids : [int]
+        идентификаторы курьеров
+    region : int
+        район работы курьеров.
+    """
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1), required=False,
+        max_length=COURIER_STATS_MAX_IDS)
+    region = serializers.IntegerField(min_value=1, required=False)
+
+    def validate(self, attrs):
+        if not attrs.get('ids') and attrs.get('region') is None:
+            raise serializers.ValidationError(
+                'Необходимо указать идентификаторы курьеров или район')
+        return attrs
+
+
+class DeliveryExportQuerySerializer(serializers.Serializer):
+    """ Класс DeliveryExportQuerySerializer описывает сериализатор параметров
+    выгрузки истории доставок.
+
+    Родительский класс -- serializers.Serializer.
+    Переопределенные методы -- validate.
+
+    Дополнительные атрибуты класса
+    --------
+    output : str
+        формат выгрузки: ndjson или csv
+    date_from : date
+        первый день выдачи развозов
+    date_to : date
+        последний день выдачи развозов
+    region : int
+        район доставки заказов.
+    """
+    output = serializers.ChoiceField(choices=list(EXPORT_FORMATTERS),
+                                     default='ndjson')
+    date_from = serializers.DateField(required=False)
+    date_to = serializers.DateField(required=False)
+    region = serializers.IntegerField(min_value=1, required=False)
+
+    def validate(self, attrs):
+        if ('date_from' in attrs and 'date_to' in attrs
+                and attrs['date_from'] > attrs['date_to']):
+            raise serializers.ValidationError(
+                'Начало периода не может быть позже его окончания')
+        return attrs
+
+
 class OrderSerializer(serializers.ModelSerializer):
     """ Класс OrderSerializer описывает сериализатор модели заказа.
 
@@ -181,12 +401,52 @@ def serialize_assign_order(data):
     if active_invoice:
         context['orders'] = Order.objects.filter(
             invoices=active_invoice,
-            invoice_orders__complete_time__isnull=True
-        ).values(id=F('order_id'))
+            invoice_orders__complete_time__isnull=True,
+        ).order_by('order_id').values(id=F('order_id'))
         context['assign_time'] = active_invoice.assign_time
     return context
 
 
+def is_id(value):
+    """Проверить, что значение JSON является целым идентификатором, а не
+    логическим значением."""
+
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def serialize_assign_orders_batch(data):
+    """ Проверить данные группы курьеров и вернуть данные по их активным
+    развозам."""
+
+    courier_ids = data.get('courier_ids')
+    if (not isinstance(courier_ids, list)
+            or not all(is_id(x) for x in courier_ids)):
+        return {'error': 'Не передан список идентификаторов курьеров'}
+    courier_ids = list(dict.fromkeys(courier_ids))
+    couriers = Courier.objects.filter(
+        courier_id__in=courier_ids).prefetch_related('regions')
+    not_found = set(courier_ids) - {courier.courier_id for courier in couriers}
+    if not_found:
+        return {'error': f'Курьеры не найдены: {sorted(not_found)}'}
+    invoices = services.assign_orders_batch(couriers)
+
+    invoice_orders = {}
+    for invoice_id, order_id in InvoiceOrder.objects.filter(
+            invoice__in=invoices.values(),
+            complete_time__isnull=True).order_by('order_id').values_list(
+            'invoice_id', 'order_id'):
+        invoice_orders.setdefault(invoice_id, []).append({'id': order_id})
+    context = {'couriers': []}
+    for courier_id in courier_ids:
+        courier_context = {'courier_id': courier_id, 'orders': []}
+        invoice = invoices.get(courier_id)
+        if invoice:
+            courier_context['orders'] = invoice_orders.get(invoice.id, [])
+            courier_context['assign_time'] = invoice.assign_time
+        context['couriers'].append(courier_context)
+    return context
+
+
 def serialize_complete_order(data):
     """ Проверить данные завершенного заказа."""
 
@@ -202,3 +462,58 @@ def serialize_complete_order(data):
     complete_time = parse(complete_time)
     completed_order = services.complete_order(invoice_order, complete_time)
     return {'order_id': completed_order}
+
+
+def parse_complete_time(value):
+    """Вернуть время завершения заказа в формате ISO 8601 с часовым поясом
+    или None, если значение не является таким временем."""
+
+    try:
+        complete_time = parse_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if complete_time and timezone.is_naive(complete_time):
+        complete_time = timezone.make_aware(complete_time)
+    return complete_time
+
+
+def serialize_complete_orders_batch(data):
+    """ Проверить данные группы завершенных заказов, завершить их и вернуть
+    результат по каждому заказу."""
+
+    items = data.get('data')
+    if (not isinstance(items, list)
+            or not all(isinstance(x, dict) for x in items)):
+        return {'error': 'Не передан список завершенных заказов'}
+    invoice_orders = {
+        order_id: (courier_id, invoice_order_id)
+        for order_id, courier_id, invoice_order_id in
+        InvoiceOrder.objects.filter(order_id__in=[
+            x.get('order_id') for x in items
+            if is_id(x.get('order_id'))]).values_list(
+            'order_id', 'invoice__courier_id', 'id')}
+
+    results = []
+    completions = {}
+    for item in items:
+        order_id = item.get('order_id')
+        result = {'order_id': order_id}
+        courier_id, invoice_order_id = invoice_orders.get(order_id,
+                                                          (None, None))
+        complete_time = parse_complete_time(item.get('complete_time'))
+        if (courier_id is None or not is_id(item.get('courier_id'))
+                or item['courier_id'] != courier_id):
+            result['error'] = 'Заказ не найден или назначен другому курьеру'
+        elif not complete_time:
+            result['error'] = 'Не передано время доставки'
+        else:
+            completions.setdefault(invoice_order_id, complete_time)
+            result['invoice_order_id'] = invoice_order_id
+        results.append(result)
+
+    errors = services.complete_orders(completions) if completions else {}
+    for result in results:
+        error = errors.get(result.pop('invoice_order_id', None))
+        if error:
+            result['error'] = error
+    return {'orders': results}
@@ -1,7 +1,22 @@
-from django.db.models import Avg, Max, Min, Q, Sum
-from django.db.models.functions import Coalesce
-
-from delivery.models import Courier, Invoice, InvoiceOrder, Order
+import logging
+import time
+from array import array
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import (Count, DecimalField, Exists,
+                              ExpressionWrapper, F, FloatField, IntegerField,
+                              Min, OuterRef, Sum)
+from django.db.models.functions import Cast, Coalesce
+from django.utils import timezone
+
+from delivery.cache import bump_courier_versions
+from delivery.models import (Courier, CourierRegionStat, Invoice,
+                             InvoiceOrder, OpenOrder, Order)
+from delivery.packing import (IncrementalPacking, PackingCache, fingerprint,
+                              row_size, solve)
+
+logger = logging.getLogger(__name__)
 
 COURIER_LOAD_CAPACITY = {
     Courier.CourierType.FOOT: 10,
@@ -17,74 +32,184 @@ PAY_COEFFICIENTS = {
     Courier.CourierType.CAR: 9,
 }
 
+# Кэш результатов подбора заказов в рамках процесса. Ключ -- отпечаток
+# кандидатов и грузоподъемности, значение -- идентификаторы выбранных заказов
+# и время сохранения.
+packing_cache = PackingCache(settings.PACKING_CACHE_SIZE,
+                             settings.PACKING_CACHE_TTL)
 
-def knapsack(max_weight, order_weight, num_orders):
-    """Вернуть таблицу возможных комбинаций заказов по весу, ограниченную весом
-     рюкзака.
-    """
+# Состояния инкрементального подбора заказов по профилям курьеров. По
+# истечении времени жизни состояние строится заново, при превышении общего
+# бюджета памяти вытесняются давно использованные состояния.
+packing_states = PackingCache(
+    None, settings.PACKING_INCREMENTAL_TTL,
+    memory_budget=settings.PACKING_INCREMENTAL_MEMORY_BUDGET,
+    sizeof=IncrementalPacking.memory_size)
+
+# Число попыток подобрать заказы заново, если часть выбранных заказов
+# заблокирована параллельными назначениями
+ASSIGN_ATTEMPTS = 3
+
+# Число строк, получаемых за одно обращение к серверному курсору при загрузке
+# кандидатов
+CANDIDATE_CHUNK_SIZE = 2000
+
+
+def weight_in_hundredths():
+    """Вернуть выражение веса заказа в сотых долях килограмма."""
+
+    return Cast(ExpressionWrapper(F('weight') * 100,
+                                  output_field=DecimalField()),
+                IntegerField())
 
-    memorize = [[0 for _ in range(max_weight + 1)] for _ in
-                range(num_orders + 1)]
-    for i in range(num_orders + 1):
-        for w in range(max_weight + 1):
-            if i == 0 or w == 0:
-                memorize[i][w] = 0
-            elif order_weight[i - 1] <= w:
-                memorize[i][w] = max(
-                    order_weight[i - 1] + memorize[i - 1][
-                        w - order_weight[i - 1]],
-                    memorize[i - 1][w])
-            else:
-                memorize[i][w] = memorize[i - 1][w]
-    return memorize
 
+def load_candidates(orders):
+    """Вернуть идентификаторы и веса в сотых долях килограмма заказов
+    QuerySet в виде двух параллельных массивов, упорядоченных по
+    идентификатору.
 
-def get_orders_for_delivery(orders, max_weight):
-    """Вернуть список с комбинацией заказов с максимальным весом не превышающим
-    общий максимальный вес.
+    Заметки: строки выбираются без создания экземпляров модели порциями по
+    CANDIDATE_CHUNK_SIZE, повторы из-за соединений отбрасываются в БД.
     """
 
-    knapsack_weight = max_weight * 100
-    num_orders = len(orders)
-    weights = [int(order.weight * 100) for order in orders]
-    memorize = knapsack(knapsack_weight, weights, num_orders)
+    order_ids = array('q')
+    weights = array('q')
+    rows = orders.order_by('order_id').values_list(
+        'order_id', weight_in_hundredths()).distinct()
+    for order_id, weight in rows.iterator(chunk_size=CANDIDATE_CHUNK_SIZE):
+        order_ids.append(order_id)
+        weights.append(weight)
+    return order_ids, weights
+
+
+def get_incremental_orders_for_delivery(order_ids, weights, max_weight,
+                                        profile, deadline):
+    """Вернуть комбинацию заказов, подобранную по инкрементальному состоянию
+    профиля курьера, или None, если состояние использовать нельзя.
+
+    Заметки: состояние не используется, если его таблица не укладывается в
+    бюджет памяти или не успевает обновиться к моменту deadline (по
+    time.monotonic). После обновления состояния из packing_states
+    вытесняются состояния сверх общего бюджета памяти.
+    """
+
+    key = (profile, max_weight)
+    if ((len(order_ids) + 1) * row_size(max_weight * 100)
+            > min(settings.PACKING_MEMORY_BUDGET,
+                  settings.PACKING_INCREMENTAL_MEMORY_BUDGET)):
+        packing_states.delete(key)
+        return None
+    state = packing_states.get(key)
+    if state is None:
+        state = IncrementalPacking(max_weight * 100)
+        packing_states.set(key, state)
+    try:
+        with state.lock:
+            if not state.sync(zip(order_ids, weights), deadline):
+                return None
+            return state.solve()
+    finally:
+        packing_states.trim()
+
+
+def get_orders_for_delivery(order_ids, weights, max_weight, profile=None,
+                            deadline=None):
+    """Вернуть список идентификаторов заказов комбинации с максимальным весом
+    не превышающим общий максимальный вес.
+
+    Заказы передаются параллельными последовательностями идентификаторов и
+    весов в сотых долях килограмма, как их возвращает load_candidates.
+    Подбор ограничен моментом deadline (по time.monotonic), по умолчанию --
+    PACKING_TIME_BUDGET секунд от вызова.
+
+    Заметки: если передан профиль курьера, комбинация подбирается по
+    инкрементальному состоянию профиля (кроме наборов, для которых включен
+    параллельный подбор). Иначе результат берется из кэша, если
+    набор кандидатов и грузоподъемность совпадают, а ни один из выбранных
+    заказов не был назначен после сохранения записи.
+    """
 
-    pack_orders = []
-    w, i = knapsack_weight, num_orders
-    result = memorize[num_orders][knapsack_weight]
-    while i > 0 and result > 0:
-        if result != memorize[i - 1][w]:
-            pack_orders.append(orders[i - 1])
-            result -= weights[i - 1]
-            w -= weights[i - 1]
-        i -= 1
-    return pack_orders
+    if any(x > y for x, y in zip(order_ids, order_ids[1:])):
+        order_ids, weights = zip(*sorted(zip(order_ids, weights)))
+    if deadline is None:
+        deadline = time.monotonic() + settings.PACKING_TIME_BUDGET
+    parallel_threshold = settings.PACKING_PARALLEL_THRESHOLD
+    if (profile is not None and settings.PACKING_INCREMENTAL
+            and not (parallel_threshold
+                     and len(order_ids) >= parallel_threshold)):
+        delivery_order_ids = get_incremental_orders_for_delivery(
+            order_ids, weights, max_weight, profile, deadline)
+        if delivery_order_ids is not None:
+            return delivery_order_ids
+
+    key = fingerprint(zip(order_ids, weights), max_weight)
+    cached = packing_cache.get(key)
+    if cached is not None:
+        delivery_order_ids, stored_at = cached
+        if not InvoiceOrder.objects.filter(
+                order_id__in=delivery_order_ids,
+                invoice__assign_time__gt=stored_at).exists():
+            return list(delivery_order_ids)
+        packing_cache.delete(key)
+
+    pack = solve(max_weight * 100, weights,
+                 memory_budget=settings.PACKING_MEMORY_BUDGET,
+                 strategy=settings.PACKING_STRATEGY,
+                 epsilon=settings.PACKING_FPTAS_EPSILON,
+                 parallel_threshold=parallel_threshold,
+                 workers=settings.PACKING_PARALLEL_WORKERS,
+                 deadline=deadline)
+    delivery_order_ids = [order_ids[i] for i in pack]
+    packing_cache.set(key, (delivery_order_ids, timezone.now()))
+    return list(delivery_order_ids)
+
+
+def get_courier_profile(courier):
+    """Вернуть профиль курьера: тип, коды районов и интервалы работы."""
+
+    return (
+        courier.courier_type,
+        tuple(courier.regions.order_by('code').values_list('code', flat=True)),
+        tuple(courier.working_hours.order_by('name').values_list('name',
+                                                                 flat=True)),
+    )
+
+
+def filter_courier_fit(orders, courier):
+    """Вернуть заказы QuerySet orders, подходящие курьеру по району, весу и
+    времени доставки."""
+
+    return orders.filter(region__in=courier.regions.all(),
+                         weight__lte=COURIER_LOAD_CAPACITY[
+                             courier.courier_type],
+                         delivery_mask__overlaps=courier.working_mask)
 
 
 def get_available_orders(courier):
-    """ Вернуть QuerySet со всеми недоставленными, подходящими по критериям
-    курьера, заказами.
-
-    Заметки: QuerySet содержит свои, чужие и неназначенные заказы, нужен доп.
-    фильтр.
-    """
-
-    working_hours = courier.working_hours.values('begin', 'end')
-    working_hours_limit = Q()
-    for interval in working_hours:
-        working_hours_limit = (
-            working_hours_limit |
-            Q(delivery_hours__begin__range=(
-                interval['begin'], interval['end'] - 1)) |
-            Q(delivery_hours__end__range=(
-                interval['begin'] + 1, interval['end']))
-        )
+    """ Вернуть QuerySet с неназначенными заказами, подходящими по критериям
+    курьера.
+
+    Заметки: выборка выполняется только по таблице неназначенных заказов
+    OpenOrder, объем которой не зависит от истории доставок.
+    """
+
+    return filter_courier_fit(OpenOrder.objects.all(), courier)
+
+
+def set_orders_open(order_ids, is_open):
+    """Добавить заказы в таблицу неназначенных заказов, если is_open
+    истинно, иначе удалить их из нее.
+
+    Заметки: вызывается внутри транзакции, меняющей назначение заказов.
+    """
 
-    return Order.objects.filter(invoice_orders__complete_time__isnull=True,
-                                region__in=courier.regions.all(),
-                                weight__lte=COURIER_LOAD_CAPACITY[
-                                    courier.courier_type],
-                                ).filter(working_hours_limit)
+    if is_open:
+        OpenOrder.objects.bulk_create(
+            [OpenOrder.from_order(order)
+             for order in Order.objects.filter(order_id__in=order_ids)],
+            ignore_conflicts=True)
+    else:
+        OpenOrder.objects.filter(order_id__in=order_ids).delete()
 
 
 def get_active_invoice_orders(courier):
@@ -99,44 +224,264 @@ def get_assign_not_available_orders(courier):
 
     # Получим доступные на текущий момент недоставленные заказы курьера
     invoice_orders = get_active_invoice_orders(courier)
-    orders = get_available_orders(courier).filter(
-        invoice_orders__in=invoice_orders)
-    if not orders.exists():
+    order_ids, weights = load_candidates(filter_courier_fit(
+        Order.objects.filter(invoice_orders__in=invoice_orders), courier))
+    if not order_ids:
         return False
     # Если общий вес доступных заказов превышает грузоподъемность по текущему
     # типу, то надо выбрать из них комбинацию с максимальным весом
-    weight = orders.aggregate(sum_weight=Sum('weight'))['sum_weight']
     max_weight = COURIER_LOAD_CAPACITY[courier.courier_type]
-    if (weight > max_weight):
-        orders = get_orders_for_delivery(
-            orders, COURIER_LOAD_CAPACITY[courier.courier_type])
-    unavailable_orders = invoice_orders.exclude(order__in=orders)
+    if sum(weights) > max_weight * 100:
+        order_ids = get_orders_for_delivery(order_ids, weights, max_weight)
+    unavailable_orders = invoice_orders.exclude(order__in=order_ids)
     return unavailable_orders
 
 
 def delete_unavailable_orders(courier):
     """Исключить из развоза заказы, которые курьер не сможет доставить."""
 
-    unavailable_orders = get_assign_not_available_orders(courier)
-    if unavailable_orders:
-        unavailable_orders.delete()
+    with transaction.atomic():
+        Courier.objects.select_for_update().filter(pk=courier.pk).exists()
+        unavailable_orders = get_assign_not_available_orders(courier)
+        if unavailable_orders:
+            order_ids = [x.order_id for x in unavailable_orders]
+            invoice_ids = {x.invoice_id for x in unavailable_orders}
+            unavailable_orders.delete()
+            set_orders_open(order_ids, True)
+            credit_completed_invoices(invoice_ids)
+            bump_courier_versions([courier.courier_id])
+
+
+def lock_open_orders(order_ids):
+    """Заблокировать до конца транзакции строки неназначенных заказов и
+    вернуть множество идентификаторов заблокированных заказов.
+
+    Заметки: заказы, заблокированные другими транзакциями или уже
+    назначенные, пропускаются (SELECT ... FOR UPDATE SKIP LOCKED).
+    """
+
+    return set(OpenOrder.objects.filter(order_id__in=order_ids)
+               .select_for_update(skip_locked=True)
+               .values_list('order_id', flat=True))
 
 
 def assign_orders(courier):
     """Назначить подходящие заказы курьеру с максимально возможным весом не
     превышающим его грузоподьемность.
+
+    Заметки: выбранные заказы блокируются до конца транзакции. Если часть из
+    них забрали параллельные назначения, заказы подбираются заново без них
+    (не более ASSIGN_ATTEMPTS раз, затем назначаются заблокированные).
+    Поэтому параллельные назначения получают непересекающиеся наборы заказов
+    и не ждут друг друга. Все попытки подбора укладываются в общий бюджет
+    времени PACKING_TIME_BUDGET.
+    """
+
+    max_weight = COURIER_LOAD_CAPACITY[courier.courier_type]
+    with transaction.atomic():
+        order_ids, weights = load_candidates(get_available_orders(courier))
+        deadline = time.monotonic() + settings.PACKING_TIME_BUDGET
+        for _ in range(ASSIGN_ATTEMPTS):
+            if not order_ids:
+                return []
+            delivery_order_ids = get_orders_for_delivery(
+                order_ids, weights, max_weight, get_courier_profile(courier),
+                deadline)
+            locked = lock_open_orders(delivery_order_ids)
+            if len(locked) == len(delivery_order_ids):
+                break
+            lost = set(delivery_order_ids) - locked
+            keep = [i for i, order_id in enumerate(order_ids)
+                    if order_id not in lost]
+            order_ids = [order_ids[i] for i in keep]
+            weights = [weights[i] for i in keep]
+        else:
+            delivery_order_ids = sorted(locked)
+            if not delivery_order_ids:
+                return []
+        expected_reward = PAY_RATE * PAY_COEFFICIENTS[courier.courier_type]
+        invoice = Invoice.objects.create(courier=courier,
+                                         expected_reward=expected_reward)
+        invoice.orders.set(delivery_order_ids)
+        set_orders_open(delivery_order_ids, False)
+        bump_courier_versions([courier.courier_id])
+    return invoice
+
+
+def assign_orders_batch(couriers, fetched=True, deadline=None,
+                        skip_locked=False):
+    """Назначить заказы группе курьеров из общего пула кандидатов и вернуть
+    словарь развозов по идентификаторам курьеров.
+
+    Если fetched ложно, развозы назначаются без запроса курьеров и считаются
+    не полученными ими до первого запроса (см. fetch_invoice). Подбор
+    заказов для всей группы ограничен моментом deadline (по time.monotonic),
+    по умолчанию -- PACKING_TIME_BUDGET секунд от вызова. Если skip_locked
+    истинно, курьеры, заблокированные другими транзакциями, пропускаются
+    вместо ожидания блокировки.
+
+    Заметки: курьерам с незавершенным развозом возвращается текущий развоз.
+    Заказы подбираются не совместно для всей группы, а жадно по одному
+    курьеру: каждый следующий курьер получает лучшую комбинацию из заказов,
+    оставшихся после предыдущих. Свободные курьеры обрабатываются в порядке
+    возрастания числа подходящих им заказов, чтобы курьерам с узким выбором
+    достались их заказы. Курьеры без подходящих заказов в словарь не
+    попадают.
     """
 
-    available_orders = get_available_orders(courier).filter(
-        invoices__isnull=True)
-    if not available_orders:
-        return []
-    delivery_orders = get_orders_for_delivery(
-        available_orders, COURIER_LOAD_CAPACITY[courier.courier_type])
-    expected_reward = PAY_RATE * PAY_COEFFICIENTS[courier.courier_type]
-    invoice = Invoice.objects.create(courier=courier,
-                                     expected_reward=expected_reward)
-    invoice.orders.set(delivery_orders)
+    couriers = list(couriers)
+    if deadline is None:
+        deadline = time.monotonic() + settings.PACKING_TIME_BUDGET
+    with transaction.atomic():
+        # Блокируем курьеров в порядке идентификаторов, чтобы параллельные
+        # запросы с пересекающимися списками не получили взаимную блокировку
+        locked = set(Courier.objects.select_for_update(
+            skip_locked=skip_locked).filter(
+            courier_id__in=[courier.courier_id for courier in couriers],
+        ).order_by('courier_id').values_list('courier_id', flat=True))
+        couriers = [courier for courier in couriers
+                    if courier.courier_id in locked]
+        invoices = {
+            invoice.courier_id: invoice for invoice in
+            Invoice.objects.filter(
+                has_invoice_orders(complete_time__isnull=True),
+                courier__in=couriers)}
+        if fetched:
+            for invoice in invoices.values():
+                fetch_invoice(invoice)
+        idle_couriers = [courier for courier in couriers
+                         if courier.courier_id not in invoices]
+        if not idle_couriers:
+            return invoices
+
+        # Загружаем общий пул кандидатов одним запросом
+        regions = {region.code for courier in idle_couriers
+                   for region in courier.regions.all()}
+        max_weight = max(COURIER_LOAD_CAPACITY[courier.courier_type]
+                         for courier in idle_couriers)
+        pool = list(OpenOrder.objects.filter(
+            region__in=regions, weight__lte=max_weight,
+        ).order_by('order_id').values_list(
+            'order_id', weight_in_hundredths(), 'region_id', 'delivery_mask',
+        ).iterator(chunk_size=CANDIDATE_CHUNK_SIZE))
+
+        eligible = {}
+        for courier in idle_couriers:
+            capacity = COURIER_LOAD_CAPACITY[courier.courier_type] * 100
+            courier_regions = {region.code for region in courier.regions.all()}
+            eligible[courier.courier_id] = [
+                (order_id, weight) for order_id, weight, region, delivery_mask
+                in pool
+                if region in courier_regions and weight <= capacity
+                and delivery_mask & courier.working_mask]
+
+        taken = set()
+        packs = []
+        for courier in sorted(
+                idle_couriers,
+                key=lambda x: (len(eligible[x.courier_id]),
+                               COURIER_LOAD_CAPACITY[x.courier_type])):
+            candidates = [candidate for candidate
+                          in eligible[courier.courier_id]
+                          if candidate[0] not in taken]
+            if not candidates:
+                continue
+            order_ids, weights = zip(*candidates)
+            delivery_order_ids = get_orders_for_delivery(
+                order_ids, weights,
+                COURIER_LOAD_CAPACITY[courier.courier_type],
+                deadline=deadline)
+            # Заказы, забранные параллельными назначениями, исключаются из
+            # развоза и из дальнейшего подбора
+            taken.update(delivery_order_ids)
+            locked = lock_open_orders(delivery_order_ids)
+            delivery_order_ids = [order_id for order_id in delivery_order_ids
+                                  if order_id in locked]
+            if delivery_order_ids:
+                packs.append((courier, delivery_order_ids))
+
+        new_invoices = Invoice.objects.bulk_create([
+            Invoice(courier=courier,
+                    expected_reward=PAY_RATE * PAY_COEFFICIENTS[
+                        courier.courier_type],
+                    fetched=fetched)
+            for courier, _ in packs])
+        InvoiceOrder.objects.bulk_create([
+            InvoiceOrder(invoice=invoice, order_id=order_id)
+            for invoice, (_, delivery_order_ids) in zip(new_invoices, packs)
+            for order_id in delivery_order_ids])
+        set_orders_open([order_id for _, delivery_order_ids in packs
+                         for order_id in delivery_order_ids], False)
+        bump_courier_versions([invoice.courier_id for invoice in new_invoices])
+        invoices.update(
+            (invoice.courier_id, invoice) for invoice in new_invoices)
+    return invoices
+
+
+def has_invoice_orders(**kwargs):
+    """Вернуть условие существования строк развоза, удовлетворяющих
+    фильтру kwargs."""
+
+    return Exists(InvoiceOrder.objects.filter(invoice=OuterRef('pk'),
+                                              **kwargs))
+
+
+def get_active_invoices(courier):
+    """Вернуть QuerySet развозов курьера с недоставленными заказами."""
+
+    return Invoice.objects.filter(
+        has_invoice_orders(complete_time__isnull=True), courier=courier)
+
+
+def assign_new_orders(orders):
+    """Назначить заказы свободным курьерам, районы и часы работы которых
+    подходят новым заказам orders, и вернуть словарь созданных развозов по
+    идентификаторам курьеров.
+
+    Заметки: курьерам подбираются заказы из всего пула неназначенных
+    заказов, как при пакетном назначении, за общий бюджет времени
+    PACKING_TIME_BUDGET; курьеры, заблокированные другими транзакциями,
+    пропускаются. Время назначения развоза устанавливается при первом
+    запросе курьера. Назначение выполняется после сохранения заказов и не
+    обязательно для него: ошибки записываются в журнал, а заказы остаются
+    неназначенными до опроса курьеров.
+    """
+
+    regions = {order.region_id for order in orders}
+    delivery_mask = 0
+    for order in orders:
+        delivery_mask |= order.delivery_mask
+    if not delivery_mask:
+        return {}
+    active_invoices = Invoice.objects.filter(
+        has_invoice_orders(complete_time__isnull=True))
+    couriers = Courier.objects.filter(
+        regions__in=regions, working_mask__overlaps=delivery_mask,
+    ).exclude(invoices__in=active_invoices).distinct().prefetch_related(
+        'regions')
+    deadline = time.monotonic() + settings.PACKING_TIME_BUDGET
+    try:
+        return assign_orders_batch(couriers, fetched=False, deadline=deadline,
+                                   skip_locked=True)
+    except Exception:
+        logger.exception('Не удалось назначить новые заказы курьерам')
+        return {}
+
+
+def fetch_invoice(invoice):
+    """Отметить развоз полученным курьером и вернуть его.
+
+    Развоз, назначенный при создании заказов, получает время назначения
+    при первом запросе курьера, чтобы ожидание запроса не входило во время
+    доставки первого заказа и рейтинг.
+
+    Заметки: вызывается внутри транзакции, заблокировавшей курьера.
+    """
+
+    if not invoice.fetched:
+        invoice.assign_time = timezone.now()
+        invoice.fetched = True
+        invoice.save(update_fields=['assign_time', 'fetched'])
     return invoice
 
 
@@ -147,54 +492,373 @@ def get_active_invoice(courier):
     Заметки: возврат неисполненных заказов обеспечивает идемпотентность вызова.
     """
 
-    active_invoice = Invoice.objects.filter(
-        courier=courier, invoice_orders__complete_time__isnull=True)
-    if active_invoice:
-        return active_invoice[0]
-    return assign_orders(courier)
+    with transaction.atomic():
+        # Блокировка курьера не дает параллельным запросам одного курьера
+        # создать два развоза
+        courier = Courier.objects.select_for_update().get(
+            courier_id=courier.courier_id)
+        active_invoice = get_active_invoices(courier)
+        if active_invoice:
+            return fetch_invoice(active_invoice[0])
+        return assign_orders(courier)
+
+
+def upsert_region_stats_sql(stats):
+    """Вернуть условие вставки в агрегаты времени доставки, прибавляющее
+    сумму и число доставок к существующей строке."""
+
+    return f"""
+        ON CONFLICT (courier_id, region_id) DO UPDATE SET
+            delivery_time_sum = {stats}.delivery_time_sum
+                + EXCLUDED.delivery_time_sum,
+            delivery_count = {stats}.delivery_count + EXCLUDED.delivery_count
+    """
+
+
+def add_region_stats(deltas):
+    """Прибавить к агрегатам времени доставки курьеров по районам
+    изменения deltas.
+
+    deltas -- словарь {(идентификатор курьера, код района): (сумма времен
+    доставки, число доставок)}, значения могут быть отрицательными.
+
+    Заметки: вызывается внутри транзакции, меняющей время доставки заказов.
+    """
+
+    if not deltas:
+        return
+    stats = CourierRegionStat._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.executemany(f"""
+            INSERT INTO {stats}
+                (courier_id, region_id, delivery_time_sum, delivery_count)
+            VALUES (%s, %s, %s, %s)
+            {upsert_region_stats_sql(stats)}
+        """, [key + value for key, value in sorted(deltas.items())])
+
+
+def get_delivery_stats(invoice_orders):
+    """Вернуть QuerySet сумм и числа времен доставки строк развозов
+    invoice_orders по курьерам и районам."""
+
+    return invoice_orders.filter(delivery_time__isnull=False).values(
+        'invoice__courier_id', 'order__region_id').annotate(
+        delivery_time_sum=Sum('delivery_time'),
+        delivery_count=Count('id')).values_list(
+        'invoice__courier_id', 'order__region_id', 'delivery_time_sum',
+        'delivery_count')
+
+
+def rebuild_region_stats():
+    """Пересчитать агрегаты времени доставки по всей истории доставок и
+    вернуть число строк агрегатов."""
+
+    with transaction.atomic():
+        # Завершения заказов ждут окончания пересчета
+        with connection.cursor() as cursor:
+            cursor.execute(f'LOCK TABLE {CourierRegionStat._meta.db_table} '
+                           f'IN EXCLUSIVE MODE')
+        CourierRegionStat.objects.all().delete()
+        stats = CourierRegionStat.objects.bulk_create(
+            CourierRegionStat(courier_id=courier_id, region_id=region_id,
+                              delivery_time_sum=delivery_time_sum,
+                              delivery_count=delivery_count)
+            for courier_id, region_id, delivery_time_sum, delivery_count
+            in get_delivery_stats(InvoiceOrder.objects.all()))
+        bump_courier_versions(
+            Courier.objects.values_list('courier_id', flat=True))
+    return len(stats)
+
+
+def check_region_stats():
+    """Сравнить агрегаты времени доставки с историей доставок и вернуть
+    список расхождений (идентификатор курьера, код района, ожидаемые сумма
+    и число, сохраненные сумма и число)."""
+
+    expected = {(courier_id, region_id): (delivery_time_sum, delivery_count)
+                for courier_id, region_id, delivery_time_sum, delivery_count
+                in get_delivery_stats(InvoiceOrder.objects.all())}
+    actual = {(courier_id, region_id): (delivery_time_sum, delivery_count)
+              for courier_id, region_id, delivery_time_sum, delivery_count
+              in CourierRegionStat.objects.filter(
+                  delivery_count__gt=0).values_list(
+                  'courier_id', 'region_id', 'delivery_time_sum',
+                  'delivery_count')}
+    return [key + expected.get(key, (0, 0)) + actual.get(key, (0, 0))
+            for key in sorted(expected.keys() | actual.keys())
+            if expected.get(key) != actual.get(key)]
+
+
+def lock_invoice_couriers(invoice_ids):
+    """Заблокировать курьеров развозов invoice_ids в порядке
+    идентификаторов и вернуть словарь {идентификатор развоза: (время
+    назначения, идентификатор курьера)}.
+
+    Заметки: блокировка курьера упорядочивает завершения заказов его
+    развозов, назначение ему заказов и исключение заказов из развоза.
+    """
+
+    return {
+        invoice_id: (assign_time, courier_id)
+        for courier_id, invoice_id, assign_time in
+        Courier.objects.select_for_update(of=('self',)).filter(
+            invoices__in=invoice_ids).order_by('courier_id').values_list(
+            'courier_id', 'invoices__id', 'invoices__assign_time')}
+
+
+def complete_order_sql():
+    """Вернуть запрос завершения заказа.
+
+    Время доставки считается от последнего завершения в развозе, а если его
+    нет -- от времени назначения. Строка обновляется, только пока заказ не
+    завершен, в том же запросе время доставки добавляется в агрегат курьера
+    по району, а если это последний заказ развоза -- курьеру начисляется
+    вознаграждение за развоз.
+    """
+
+    invoice_orders = InvoiceOrder._meta.db_table
+    orders = Order._meta.db_table
+    stats = CourierRegionStat._meta.db_table
+    invoices = Invoice._meta.db_table
+    couriers = Courier._meta.db_table
+    return f"""
+        WITH completed AS (
+            UPDATE {invoice_orders}
+            SET complete_time = %(complete_time)s,
+                delivery_time = TRUNC(EXTRACT(EPOCH FROM
+                    %(complete_time)s - COALESCE((
+                        SELECT MAX(previous.complete_time)
+                        FROM {invoice_orders} previous
+                        WHERE previous.invoice_id = {invoice_orders}.invoice_id
+                    ), %(assign_time)s)))
+            WHERE id = %(id)s AND complete_time IS NULL
+            RETURNING order_id, delivery_time
+        ), updated_stats AS (
+            INSERT INTO {stats}
+                (courier_id, region_id, delivery_time_sum, delivery_count)
+            SELECT %(courier_id)s, {orders}.region_id, completed.delivery_time,
+                1
+            FROM completed
+            JOIN {orders} ON {orders}.order_id = completed.order_id
+            {upsert_region_stats_sql(stats)}
+        ), credited AS (
+            UPDATE {couriers}
+            SET earnings = earnings + {invoices}.expected_reward
+            FROM completed, {invoices}
+            WHERE {invoices}.id = %(invoice_id)s
+                AND {couriers}.courier_id = {invoices}.courier_id
+                AND NOT EXISTS (
+                    SELECT 1 FROM {invoice_orders} active
+                    WHERE active.invoice_id = %(invoice_id)s
+                        AND active.complete_time IS NULL
+                        AND active.id <> %(id)s)
+        )
+        SELECT delivery_time FROM completed
+    """
 
 
 def complete_order(invoice_order, complete_time):
-    """Проставить время завершения, если заказ активный и вернуть id заказа."""
-
-    if not invoice_order.complete_time:
-        last_delivery_time = InvoiceOrder.objects.filter(
-            invoice_id=invoice_order.invoice_id
-        ).aggregate(time=Max('complete_time'))['time']
-        if not last_delivery_time:
-            last_delivery_time = invoice_order.invoice.assign_time
-        delivery_time = (complete_time - last_delivery_time
-                         ).total_seconds()
+    """Проставить время завершения, если заказ активный и вернуть id заказа.
+
+    Заметки: курьер развоза блокируется, чтобы параллельные завершения
+    заказов одного развоза считали время доставки друг от друга, а
+    вознаграждение за развоз начислялось один раз.
+    """
+
+    if invoice_order.complete_time:
+        return invoice_order.order_id
+    with transaction.atomic():
+        assign_time, courier_id = lock_invoice_couriers(
+            [invoice_order.invoice_id])[invoice_order.invoice_id]
+        with connection.cursor() as cursor:
+            cursor.execute(complete_order_sql(), {
+                'id': invoice_order.id,
+                'invoice_id': invoice_order.invoice_id,
+                'courier_id': courier_id,
+                'complete_time': complete_time,
+                'assign_time': assign_time,
+            })
+            row = cursor.fetchone()
+        if row:
+            bump_courier_versions([courier_id])
+    if row:
         invoice_order.complete_time = complete_time
-        invoice_order.delivery_time = delivery_time
-        invoice_order.save()
+        invoice_order.delivery_time = row[0]
     return invoice_order.order_id
 
 
-def get_courier_rating(courier):
-    """Вычислить и вернуть текущий рейтинг курьера."""
+def complete_orders(completions):
+    """Завершить группу заказов и вернуть словарь ошибок по идентификаторам
+    строк развоза.
+
+    completions -- словарь {идентификатор строки развоза: время
+    завершения}. Завершения каждого развоза применяются в порядке времени,
+    время доставки считается от предыдущего завершения в развозе или от
+    времени назначения. Уже завершенные заказы пропускаются.
+
+    Заметки: курьеры развозов блокируются в порядке идентификаторов,
+    чтобы параллельные пакеты и одиночные завершения не мешали друг другу.
+    """
+
+    errors = {}
+    with transaction.atomic():
+        invoice_ids = set(InvoiceOrder.objects.filter(
+            id__in=completions).values_list('invoice_id', flat=True))
+        last_times = {}
+        couriers = {}
+        for invoice_id, (assign_time, courier_id) in lock_invoice_couriers(
+                invoice_ids).items():
+            last_times[invoice_id] = assign_time
+            couriers[invoice_id] = courier_id
+        completed_times = {}
+        pending = []
+        for invoice_order in InvoiceOrder.objects.filter(
+                invoice_id__in=invoice_ids).only(
+                'id', 'invoice_id', 'order_id', 'complete_time').annotate(
+                region_id=F('order__region_id')):
+            if invoice_order.complete_time:
+                completed_times[invoice_order.invoice_id] = max(
+                    invoice_order.complete_time,
+                    completed_times.get(invoice_order.invoice_id,
+                                        invoice_order.complete_time))
+            elif invoice_order.id in completions:
+                pending.append(invoice_order)
+        last_times.update(completed_times)
+
+        completed = []
+        deltas = {}
+        for invoice_order in sorted(pending, key=lambda x: (
+                x.invoice_id, completions[x.id])):
+            complete_time = completions[invoice_order.id]
+            last_time = last_times[invoice_order.invoice_id]
+            if complete_time < last_time:
+                errors[invoice_order.id] = ('Время завершения раньше '
+                                            'предыдущего завершения в развозе')
+                continue
+            invoice_order.complete_time = complete_time
+            invoice_order.delivery_time = int(
+                (complete_time - last_time).total_seconds())
+            last_times[invoice_order.invoice_id] = complete_time
+            completed.append(invoice_order)
+            key = (couriers[invoice_order.invoice_id], invoice_order.region_id)
+            delivery_time_sum, delivery_count = deltas.get(key, (0, 0))
+            deltas[key] = (delivery_time_sum + invoice_order.delivery_time,
+                           delivery_count + 1)
+        InvoiceOrder.objects.bulk_update(
+            completed, ['complete_time', 'delivery_time'])
+        add_region_stats(deltas)
+        credit_completed_invoices({x.invoice_id for x in completed})
+        bump_courier_versions(
+            {couriers[x.invoice_id] for x in completed})
+    return errors
+
+
+def get_region_stats(courier=None):
+    """Вернуть QuerySet со средним временем доставки заказов курьера по
+    районам, посчитанным по агрегатам.
+
+    Если курьер не передан, возвращаются агрегаты всех курьеров.
+    """
 
-    is_complete_deliveries = Courier.objects.filter(
-        invoices__invoice_orders__complete_time__isnull=False).exists()
-    if not is_complete_deliveries:
+    stats = CourierRegionStat.objects.filter(delivery_count__gt=0).annotate(
+        td=ExpressionWrapper(
+            Cast('delivery_time_sum', FloatField()) / F('delivery_count'),
+            output_field=FloatField()))
+    if courier is None:
+        return stats
+    return stats.filter(courier=courier)
+
+
+def calc_rating(min_average_duration):
+    """Вернуть рейтинг по минимальному среднему времени доставки района."""
+
+    if min_average_duration is None:
         return None
-    min_average_duration = (
-        Order.objects
-             .filter(invoice_orders__delivery_time__isnull=False,
-                     invoices__courier=courier)
-             .values('region_id')
-             .annotate(td=Avg('invoice_orders__delivery_time'))
-             .aggregate(time=Min('td')))['time']
     return round((3600 - min(min_average_duration, 3600)) / 3600 * 5, 2)
 
 
+def get_courier_rating(courier):
+    """Вычислить и вернуть текущий рейтинг курьера."""
+
+    return calc_rating(get_region_stats(courier).aggregate(
+        time=Min('td'))['time'])
+
+
+def get_couriers_ratings(courier_ids):
+    """Вычислить рейтинги группы курьеров одним запросом и вернуть словарь
+    {идентификатор курьера: рейтинг}.
+
+    Курьеры без доставок в словарь не попадают.
+    """
+
+    return {courier_id: calc_rating(min_average_duration)
+            for courier_id, min_average_duration
+            in get_region_stats().filter(
+                courier_id__in=courier_ids).values('courier_id').annotate(
+                time=Min('td')).values_list('courier_id', 'time')}
+
+
+def get_completed_invoices(courier=None):
+    """Вернуть QuerySet развозов курьера, все заказы которых доставлены.
+
+    Если курьер не передан, возвращаются завершенные развозы всех курьеров.
+    """
+
+    invoices = Invoice.objects.filter(
+        has_invoice_orders(delivery_time__isnull=False),
+        ~has_invoice_orders(complete_time__isnull=True))
+    if courier is None:
+        return invoices
+    return invoices.filter(courier=courier)
+
+
 def get_courier_earning(courier):
-    """Вычислить и вернуть текущий заработок курьера."""
+    """Вычислить и вернуть текущий заработок курьера по его завершенным
+    развозам."""
 
-    return (
-        Invoice.objects
-               .filter(courier=courier)
-               .exclude(invoice_orders__complete_time__isnull=True)
-               .distinct()
-               .aggregate(sum=Coalesce(Sum('expected_reward'), 0))['sum']
-    )
+    return get_completed_invoices(courier).aggregate(
+        sum=Coalesce(Sum('expected_reward'), 0))['sum']
+
+
+def credit_completed_invoices(invoice_ids):
+    """Начислить курьерам вознаграждение за развозы invoice_ids, которые
+    стали завершенными.
+
+    Заметки: вызывается внутри транзакции, завершившей или исключившей
+    последний недоставленный заказ развоза, поэтому до нее переданные
+    развозы не были завершены.
+    """
+
+    for courier_id, reward in get_completed_invoices().filter(
+            id__in=invoice_ids).values('courier_id').annotate(
+            reward=Sum('expected_reward')).values_list(
+            'courier_id', 'reward'):
+        Courier.objects.filter(pk=courier_id).update(
+            earnings=F('earnings') + reward)
+
+
+def reconcile_earnings(fix=False):
+    """Сравнить заработок курьеров с расчетом по завершенным развозам и
+    вернуть список расхождений (идентификатор курьера, ожидаемый заработок,
+    сохраненный заработок).
+
+    Если fix истинно, заработок курьеров с расхождениями исправляется.
+    Курьеры блокируются на время сверки, чтобы начисления не менялись.
+    """
+
+    with transaction.atomic():
+        actual = dict(Courier.objects.select_for_update().order_by(
+            'courier_id').values_list('courier_id', 'earnings'))
+        expected = dict(get_completed_invoices().values(
+            'courier_id').annotate(reward=Sum('expected_reward')).values_list(
+            'courier_id', 'reward'))
+        mismatches = [
+            (courier_id, expected.get(courier_id, 0), earnings)
+            for courier_id, earnings in actual.items()
+            if expected.get(courier_id, 0) != earnings]
+        if fix:
+            for courier_id, earnings, _ in mismatches:
+                Courier.objects.filter(pk=courier_id).update(
+                    earnings=earnings)
+            bump_courier_versions([x[0] for x in mismatches])
+    return mismatches
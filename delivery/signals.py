@@ -0,0 +1,106 @@
+from django.db.models.signals import m2m_changed, post_save
+
+from delivery.cache import bump_courier_versions
+from delivery.fields import intervals_mask
+from delivery.models import Courier, OpenOrder, Order
+
+# Модели с интервалами времени: (модель, поле интервалов, поле маски,
+# обратное имя связи со стороны TimeInterval)
+TIME_MASK_FIELDS = [
+    (Order, 'delivery_hours', 'delivery_mask', 'orders'),
+    (Courier, 'working_hours', 'working_mask', 'couriers'),
+]
+
+# Модели, хранящие копию маски: модель-источник --> модели-копии
+TIME_MASK_COPIES = {
+    Order: [OpenOrder],
+}
+
+
+def update_time_masks(model, field_name, mask_name, pks):
+    """Пересчитать маски mask_name объектов model с первичными ключами pks по
+    интервалам из поля field_name и вернуть словарь масок."""
+
+    through = getattr(model, field_name).through
+    source = model._meta.model_name
+    intervals = {pk: [] for pk in pks}
+    rows = through.objects.filter(**{f'{source}_id__in': pks}).values_list(
+        f'{source}_id', 'timeinterval__begin', 'timeinterval__end')
+    for pk, begin, end in rows:
+        intervals[pk].append((begin, end))
+    masks = {pk: intervals_mask(pk_intervals)
+             for pk, pk_intervals in intervals.items()}
+    for pk, mask in masks.items():
+        for target in [model] + TIME_MASK_COPIES.get(model, []):
+            target.objects.filter(pk=pk).update(**{mask_name: mask})
+    return masks
+
+
+def time_intervals_changed_handler(model, field_name, mask_name,
+                                   related_name):
+    """Вернуть обработчик сигнала m2m_changed, поддерживающий маску mask_name
+    в соответствии с интервалами поля field_name."""
+
+    def handler(sender, instance, action, reverse, pk_set, **kwargs):
+        if reverse and action == 'pre_clear':
+            # После очистки связей со стороны интервала список затронутых
+            # объектов уже не получить, запоминаем его заранее.
+            instance._time_mask_pks = set(getattr(
+                instance, related_name).values_list('pk', flat=True))
+            return
+        if action not in ('post_add', 'post_remove', 'post_clear'):
+            return
+        if not reverse:
+            pks = {instance.pk}
+        elif action == 'post_clear':
+            pks = instance.__dict__.pop('_time_mask_pks', set())
+        else:
+            pks = pk_set
+        if not pks:
+            return
+        masks = update_time_masks(model, field_name, mask_name, pks)
+        if not reverse:
+            setattr(instance, mask_name, masks[instance.pk])
+
+    return handler
+
+
+def order_saved(sender, instance, created, raw=False, **kwargs):
+    """Добавить новый заказ в таблицу неназначенных заказов или обновить его
+    строку в ней."""
+
+    if raw:
+        return
+    if created:
+        OpenOrder.from_order(instance).save(force_insert=True)
+    else:
+        OpenOrder.objects.filter(pk=instance.pk).update(
+            region_id=instance.region_id, weight=instance.weight,
+            delivery_mask=instance.delivery_mask)
+
+
+def courier_created(sender, instance, created, raw=False, **kwargs):
+    """Сменить версию данных нового курьера, чтобы не отдавать ответ,
+    закэшированный для удаленного курьера с тем же идентификатором."""
+
+    if created and not raw:
+        bump_courier_versions([instance.pk])
+
+
+def connect_signals():
+    """Подключить обработчики поддержания масок времени, таблицы
+    неназначенных заказов и версий данных курьеров."""
+
+    post_save.connect(order_saved, sender=Order,
+                      dispatch_uid='Order.open_order')
+    post_save.connect(courier_created, sender=Courier,
+                      dispatch_uid='Courier.version')
+
+    for model, field_name, mask_name, related_name in TIME_MASK_FIELDS:
+        m2m_changed.connect(
+            time_intervals_changed_handler(
+                model, field_name, mask_name, related_name),
+            sender=getattr(model, field_name).through,
+            weak=False,
+            dispatch_uid=f'{model.__name__}.{mask_name}',
+        )
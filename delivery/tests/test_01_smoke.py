@@ -62,9 +62,11 @@ class SmokeTests(APITestCase):
         Invoice.objects.create(courier=courier, expected_reward=0).orders.set(
             [order])
         data_assign = {'courier_id': courier.courier_id}
+        data_assign_batch = {'courier_ids': [courier.courier_id]}
         data_complete = {'courier_id': courier.courier_id,
                          'order_id': order.order_id,
                          'complete_time': timezone.now()}
+        data_complete_batch = {'data': [data_complete]}
 
         cls.testcase = list()
         cls.testcase.append(cls.TestEndPoint(
@@ -75,8 +77,12 @@ class SmokeTests(APITestCase):
             'orders-list', ['POST'], test_data=data_orders))
         cls.testcase.append(cls.TestEndPoint(
             'orders-assign', ['POST'], test_data=data_assign))
+        cls.testcase.append(cls.TestEndPoint(
+            'orders-assign-batch', ['POST'], test_data=data_assign_batch))
         cls.testcase.append(cls.TestEndPoint(
             'orders-complete', ['POST'], test_data=data_complete))
+        cls.testcase.append(cls.TestEndPoint(
+            'orders-complete-batch', ['POST'], test_data=data_complete_batch))
 
     @classmethod
     def _get_url(cls, testcase):
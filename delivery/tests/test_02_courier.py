@@ -1,15 +1,29 @@
 import json
 import random
 from datetime import timedelta
-
-from django.db.models import Sum
+from io import StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.models import F, Sum
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APITestCase
 
-from delivery.models import Courier, InvoiceOrder, Order, Region, TimeInterval
+from delivery.cache import get_courier_version
+from delivery.checks import check_courier_cache
+from delivery.models import (Courier, CourierRegionStat, InvoiceOrder, Order,
+                             Region, TimeInterval)
+from delivery.serializers import CourierSerializer
 from delivery.services import (COURIER_LOAD_CAPACITY, PAY_COEFFICIENTS,
-                               assign_orders, complete_order)
+                               assign_orders, check_region_stats,
+                               complete_order, complete_orders,
+                               get_active_invoice, get_courier_earning,
+                               get_courier_rating, reconcile_earnings)
 from delivery.tests.test_fixtures import create_test_case_full
 
 
@@ -24,6 +38,10 @@ class CourierTests(APITestCase):
         super().setUpClass()
         create_test_case_full()
 
+    def setUp(self):
+        # Кэш Django не откатывается вместе с транзакцией теста
+        cache.clear()
+
     def test_valid_data_create_couriers(self):
         """Проверить обработку запроса POST /couriers с валидными данными.
 
@@ -421,3 +439,295 @@ class CourierTests(APITestCase):
                     content['earnings'], 0,
                     'Заработок должен прибавляться только по завершенным '
                     'развозам')
+
+    def test_rating_stats(self):
+        """Проверить агрегаты времени доставки, по которым считается
+        рейтинг.
+
+        Проверки:
+        __________
+        * Одиночное и пакетное завершение заказов обновляют агрегаты так же,
+          как пересчет по истории доставок
+        * Рейтинг по агрегатам совпадает с расчетом по истории доставок
+        * Команда rebuild_rating_stats --check находит расхождения, а
+          команда rebuild_rating_stats их исправляет.
+        """
+        courier = Courier.objects.get(courier_id=102)
+        invoice = get_active_invoice(courier)
+        invoice_orders = list(invoice.invoice_orders.select_related('order'))
+        complete_time = invoice.assign_time
+        for invoice_order in invoice_orders[:2]:
+            complete_time += timedelta(seconds=random.randint(100, 500))
+            complete_order(invoice_order, complete_time)
+        completions = {}
+        for invoice_order in invoice_orders[2:]:
+            complete_time += timedelta(seconds=random.randint(100, 500))
+            completions[invoice_order.id] = complete_time
+        self.assertDictEqual(complete_orders(completions), {})
+        self.assertListEqual(check_region_stats(), [])
+
+        averages = {}
+        for invoice_order in InvoiceOrder.objects.filter(
+                invoice=invoice).select_related('order'):
+            averages.setdefault(invoice_order.order.region_id, []).append(
+                invoice_order.delivery_time)
+        average = min(sum(x) / len(x) for x in averages.values())
+        self.assertEqual(get_courier_rating(courier),
+                         round((3600 - min(average, 3600)) / 3600 * 5, 2))
+
+        CourierRegionStat.objects.filter(courier=courier).update(
+            delivery_count=F('delivery_count') + 1)
+        with self.assertRaises(CommandError):
+            call_command('rebuild_rating_stats', '--check',
+                         stdout=StringIO(), stderr=StringIO())
+        call_command('rebuild_rating_stats', stdout=StringIO())
+        self.assertListEqual(check_region_stats(), [])
+        call_command('rebuild_rating_stats', '--check', stdout=StringIO())
+
+    def test_earnings_counter(self):
+        """Проверить начисление заработка курьера.
+
+        Проверки:
+        __________
+        * Вознаграждение начисляется один раз при завершении последнего
+          заказа развоза, одиночном или пакетном
+        * Сохранение курьера не перезаписывает заработок и маску часов
+          работы
+        * Команда reconcile_earnings находит расхождения с расчетом по
+          завершенным развозам, а с флагом --fix их исправляет.
+        """
+        courier = Courier.objects.get(courier_id=103)
+        invoice = get_active_invoice(courier)
+        invoice_orders = list(invoice.invoice_orders.all())
+        complete_time = invoice.assign_time + timedelta(minutes=1)
+        for invoice_order in invoice_orders[:-1]:
+            complete_order(invoice_order, complete_time)
+        courier.refresh_from_db()
+        self.assertEqual(courier.earnings, 0)
+
+        completions = {invoice_orders[-1].id: complete_time}
+        complete_orders(completions)
+        complete_orders(completions)
+        complete_order(invoice_orders[-1], complete_time)
+        courier.courier_type = 'foot'
+        courier.save()
+        courier.refresh_from_db()
+        self.assertEqual(courier.earnings, invoice.expected_reward)
+        self.assertEqual(courier.earnings, get_courier_earning(courier))
+        response = self.client.get(
+            reverse('couriers-detail', args=[courier.courier_id]))
+        self.assertEqual(json.loads(response.content)['earnings'],
+                         invoice.expected_reward)
+        self.assertListEqual(reconcile_earnings(), [])
+
+        stale = Courier.objects.get(pk=courier.pk)
+        TimeInterval.objects.get_or_create(name='23:00-23:30')
+        courier.working_hours.add('23:00-23:30')
+        stale.courier_type = 'bike'
+        stale.save()
+        self.assertNotEqual(stale.working_mask, courier.working_mask)
+        self.assertEqual(
+            Courier.objects.get(pk=courier.pk).working_mask,
+            courier.working_mask,
+            'Проверьте, что сохранение курьера не перезаписывает маску, '
+            'пересчитанную по часам работы')
+
+        Courier.objects.filter(pk=courier.pk).update(earnings=1)
+        with self.assertRaises(CommandError):
+            call_command('reconcile_earnings', stdout=StringIO(),
+                         stderr=StringIO())
+        call_command('reconcile_earnings', '--fix', stdout=StringIO(),
+                     stderr=StringIO())
+        call_command('reconcile_earnings', stdout=StringIO())
+
+    @mock.patch.object(settings, 'COURIER_CACHE_TIMEOUT', 300)
+    def test_courier_response_cache(self):
+        """Проверить кэширование ответа GET /couriers/$courier_id.
+
+        Проверки:
+        __________
+        * Ответ содержит ETag, повторный ответ отдается из кэша без запросов
+          к БД
+        * При совпадении If-None-Match возвращается статус 304 без запросов
+          к БД
+        * If-None-Match: * возвращает статус 304 только для существующего
+          курьера, для отсутствующего -- статус 404
+        * Изменение курьера, назначение и завершение заказа меняют ETag, и
+          ответ содержит актуальные данные
+        * Версии курьеров хранятся COURIER_CACHE_TIMEOUT секунд
+        * Проверка delivery.E001 запрещает кэш ответов на кэше в памяти
+          процесса.
+        """
+        with mock.patch.object(cache, 'add', wraps=cache.add) as cache_add:
+            get_courier_version(999)
+        self.assertEqual(cache_add.call_args[0][2], 300)
+        self.assertListEqual(
+            [x.id for x in check_courier_cache(None)], ['delivery.E001'])
+        with mock.patch.object(settings, 'COURIER_CACHE_TIMEOUT', 0):
+            self.assertListEqual(check_courier_cache(None), [])
+
+        courier = Courier.objects.get(courier_id=101)
+        url = reverse('couriers-detail', args=[courier.courier_id])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+        with self.assertNumQueries(0):
+            cached = self.client.get(url)
+            not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            any_version = self.client.get(url, HTTP_IF_NONE_MATCH='*')
+        self.assertDictEqual(cached.data, response.data)
+        self.assertEqual(not_modified.status_code,
+                         status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(not_modified['ETag'], etag)
+        self.assertEqual(any_version.status_code,
+                         status.HTTP_304_NOT_MODIFIED)
+        missing = self.client.get(reverse('couriers-detail', args=[999]),
+                                  HTTP_IF_NONE_MATCH='*')
+        self.assertEqual(missing.status_code, status.HTTP_404_NOT_FOUND,
+                         'Проверьте, что If-None-Match: * не скрывает '
+                         'отсутствие курьера')
+
+        self.client.patch(url, {'courier_type': 'car'}, format='json')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['courier_type'], 'car')
+        self.assertNotEqual(response['ETag'], etag)
+
+        etags = [response['ETag']]
+        invoice = assign_orders(Courier.objects.get(pk=courier.pk))
+        etags.append(self.client.get(url)['ETag'])
+        complete_order(invoice.invoice_orders.first(),
+                       invoice.assign_time + timedelta(minutes=10))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etags[-1])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('rating', response.data)
+        etags.append(response['ETag'])
+        self.assertEqual(len(set(etags)), 3)
+
+    def test_couriers_stats(self):
+        """Проверить обработку запроса GET /couriers/stats.
+
+        Проверки:
+        __________
+        * Данные каждого курьера совпадают с ответом GET
+          /couriers/$courier_id, курьеры без доставок не получают рейтинг
+        * Курьеры выбираются по списку идентификаторов и по району
+        * Число запросов к БД не зависит от числа курьеров
+        * Без идентификаторов и района и при невалидных параметрах
+          возвращается статус 400.
+        """
+        courier = Courier.objects.get(courier_id=102)
+        invoice = get_active_invoice(courier)
+        complete_order(invoice.invoice_orders.first(),
+                       invoice.assign_time + timedelta(minutes=10))
+        other_courier = Courier.objects.create(courier_id=104,
+                                               courier_type='foot')
+        other_courier.regions.add(110)
+        other_courier.working_hours.add('09:00-11:00')
+
+        url = reverse('couriers-stats')
+        with self.assertNumQueries(4):
+            response = self.client.get(url, {'ids': '100,102,104'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        couriers = response.data['couriers']
+        self.assertListEqual([x['courier_id'] for x in couriers],
+                             [100, 102, 104])
+        for item in couriers:
+            detail = self.client.get(
+                reverse('couriers-detail', args=[item['courier_id']]))
+            self.assertDictEqual(dict(item), dict(detail.data))
+        self.assertNotIn('rating', couriers[0])
+        self.assertIn('rating', couriers[1])
+
+        with self.assertNumQueries(4):
+            response = self.client.get(f'{url}?ids=100&ids=101&region=101')
+        self.assertListEqual(
+            [x['courier_id'] for x in response.data['couriers']], [100, 101])
+        with self.assertNumQueries(4):
+            response = self.client.get(url, {'region': 101})
+        self.assertListEqual(
+            [x['courier_id'] for x in response.data['couriers']],
+            [100, 101, 102, 103])
+        response = self.client.get(url, {'region': 110})
+        self.assertListEqual(
+            [x['courier_id'] for x in response.data['couriers']], [104])
+
+        for params in ({}, {'ids': 'a,b'}, {'region': 0}):
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code,
+                             status.HTTP_400_BAD_REQUEST)
+            self.assertIn('validation errors', response.data)
+
+    def test_bulk_create_couriers(self):
+        """Проверить пакетное создание курьеров запросом POST /couriers.
+
+        Проверки:
+        __________
+        * Число запросов к БД не зависит от числа курьеров
+        * Районы, интервалы и маска минут работы сохраняются так же, как при
+          создании курьера через ORM
+        * Ошибки валидации совпадают с ошибками сериализатора одного
+          курьера, и при ошибках ни один курьер не создается.
+        """
+        url = reverse('couriers-list')
+
+        def couriers_data(first_id, count):
+            return {'data': [
+                {'courier_id': courier_id, 'courier_type': 'bike',
+                 'regions': [110, 110],
+                 'working_hours': ['09:00-11:00', '23:00-01:00']}
+                for courier_id in range(first_id, first_id + count)]}
+
+        self.client.post(url, couriers_data(500, 1), format='json')
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(url, couriers_data(600, 2), format='json')
+        with self.assertNumQueries(len(queries)):
+            response = self.client.post(url, couriers_data(700, 6),
+                                        format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(response.data['couriers']), 6)
+
+        expected = Courier.objects.create(courier_id=800,
+                                          courier_type='bike')
+        expected.regions.add(110)
+        expected.working_hours.add('09:00-11:00', '23:00-01:00')
+        for courier in Courier.objects.filter(courier_id__in=[500, 705]):
+            self.assertEqual(courier.working_mask,
+                             Courier.objects.get(pk=800).working_mask)
+            self.assertSetEqual(
+                set(courier.regions.values_list('code', flat=True)),
+                {110})
+            self.assertSetEqual(
+                set(courier.working_hours.values_list('name', flat=True)),
+                {'09:00-11:00', '23:00-01:00'})
+
+        data = [
+            {'courier_id': 500, 'courier_type': 'bike', 'regions': [100],
+             'working_hours': ['09:00-11:00']},
+            {'courier_id': 900, 'courier_type': 'bike', 'regions': [999],
+             'working_hours': ['09:00-11:00']},
+            {'courier_id': 901, 'courier_type': 'bike', 'regions': [True],
+             'working_hours': ['10:00-11:00']},
+            {'courier_id': 902, 'courier_type': 'bike', 'regions': [100],
+             'working_hours': ['09:00-11:00']},
+        ]
+        count_couriers = Courier.objects.count()
+        with mock.patch(
+                'delivery.views.IS_NEW_REGIONS_AND_TIME_INTERVALS_AVAILABLE',
+                False):
+            response = self.client.post(url, {'data': data}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        request = mock.Mock(method='POST')
+        errors = []
+        for item in data:
+            serializer = CourierSerializer(data=item,
+                                           context={'request': request})
+            if not serializer.is_valid():
+                errors.append({'courier_id': item['courier_id'],
+                               'errors': serializer.errors})
+        self.assertEqual(len(errors), 3)
+        self.assertEqual(
+            json.loads(json.dumps(
+                response.data['validation errors']['couriers'])),
+            json.loads(json.dumps(errors)))
+        self.assertEqual(Courier.objects.count(), count_couriers)
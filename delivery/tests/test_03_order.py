@@ -1,14 +1,25 @@
 import json
+import os
+import tempfile
 from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
 from dateutil.parser import parse
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import OperationalError
 from django.db.models import F, Q, Sum
 from django.urls import reverse
 from django.utils import timezone
 from rest_framework import status
 from rest_framework.test import APITestCase
 
-from delivery.models import Courier, InvoiceOrder, Order, TimeInterval
+from delivery import services
+from delivery.models import (Courier, Invoice, InvoiceOrder, OpenOrder, Order,
+                             Region, TimeInterval)
 from delivery.services import complete_order, get_active_invoice
 from delivery.tests.test_fixtures import create_test_case_full
 
@@ -253,7 +264,8 @@ class OrdersTests(APITestCase):
             'Ответ при назначении заказа должен содержать 2 поля')
         self.assertListEqual(
             content_100.get('orders'),
-            list(courier_100_orders.values(id=F('order_id'))),
+            list(courier_100_orders.order_by('order_id').values(
+                id=F('order_id'))),
             'Поле c заказами должно содержать список назначенных заказов')
         time_delta_order_assign = (
             timezone.now() -
@@ -342,6 +354,259 @@ class OrdersTests(APITestCase):
         # Проверяем корректность ответа
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_valid_data_assign_orders_batch(self):
+        """Проверить обработку запроса POST /orders/assign-batch с валидными
+        данными.
+
+        Проверки:
+        __________
+        * При валидной структуре json на входе получаем статус ответа 200
+        * Корректность структуры ответа
+        * Курьеры с узким выбором заказов получают свои заказы, а общий вес
+          назначенных заказов больше, чем при последовательных вызовах
+          POST /orders/assign в порядке списка
+        * Обработчик идемпотентен.
+        """
+        url = reverse('orders-assign-batch')
+        working_hours = '09:00-11:00'
+        Region.objects.bulk_create([Region(code=120), Region(code=121)])
+        car = Courier.objects.create(courier_id=120, courier_type='car')
+        car.regions.add(120, 121)
+        car.working_hours.add(working_hours)
+        bike = Courier.objects.create(courier_id=121, courier_type='bike')
+        bike.regions.add(120)
+        bike.working_hours.add(working_hours)
+        for order_id, weight, region in ((200, 15, 120), (201, 35, 121),
+                                         (202, 10, 121)):
+            Order.objects.create(
+                order_id=order_id, weight=weight,
+                region_id=region).delivery_hours.add(working_hours)
+
+        # При последовательных вызовах автомобильный курьер забрал бы заказы
+        # 200 и 201 (50 кг), а велокурьеру не досталось бы ничего.
+        data = {'courier_ids': [car.courier_id, bike.courier_id]}
+        response = self.client.post(url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        content = json.loads(response.content)
+        self.assertListEqual(
+            [item['courier_id'] for item in content['couriers']],
+            data['courier_ids'],
+            'Ответ должен содержать развозы курьеров в порядке запроса')
+        orders = {item['courier_id']: sorted(x['id'] for x in item['orders'])
+                  for item in content['couriers']}
+        self.assertDictEqual(
+            orders, {120: [201, 202], 121: [200]},
+            'Проверьте, что заказы распределяются между курьерами с '
+            'максимальным общим весом')
+        for item in content['couriers']:
+            self.assertTrue('assign_time' in item)
+        total_weight = Order.objects.filter(
+            invoices__courier__in=[car, bike]).aggregate(
+            sum=Sum('weight'))['sum']
+        self.assertEqual(total_weight, 60)
+
+        # Проверяем идемпотентность.
+        response = self.client.post(url, data, format='json')
+        self.assertEqual(content, json.loads(response.content),
+                         'Проверьте, что обработчик идемпотентен')
+
+    def test_not_valid_data_assign_orders_batch(self):
+        """Проверить обработку запроса POST /orders/assign-batch с
+        невалидными данными.
+
+        Проверки:
+        __________
+        * Если не передан список курьеров возвращается ошибка 400
+        * Логическое значение не принимается за идентификатор курьера
+        * Если курьер не найден возвращается ошибка 400.
+        """
+        Courier.objects.create(courier_id=1, courier_type='foot')
+        url = reverse('orders-assign-batch')
+        for wrong_data in ({}, {'courier_ids': 100},
+                           {'courier_ids': ['abc']}, {'courier_ids': [True]},
+                           {'courier_ids': [100, 999]}):
+            response = self.client.post(url, wrong_data, format='json')
+            self.assertEqual(response.status_code,
+                             status.HTTP_400_BAD_REQUEST)
+
+    def test_time_masks(self):
+        """Проверить поддержание масок минут и подбор заказов по ним.
+
+        Проверки:
+        __________
+        * Маски заказа и курьера пересчитываются при добавлении, удалении и
+          очистке интервалов, в том числе со стороны интервала
+        * Курьеру доступен заказ, интервал доставки которого полностью
+          содержит интервал работы курьера
+        * Интервалы, переходящие через полночь, пересекаются с интервалами
+          начала суток
+        * Смежные интервалы не пересекаются.
+        """
+        intervals = {name: TimeInterval.objects.get_or_create(name=name)[0]
+                     for name in ('08:00-20:00', '09:00-11:00', '11:00-12:00',
+                                  '23:00-01:00', '00:30-02:00')}
+        Region.objects.create(code=130)
+        courier = Courier.objects.create(courier_id=130, courier_type='foot')
+        courier.regions.add(130)
+        courier.working_hours.add('09:00-11:00')
+        self.assertEqual(courier.working_mask, ((1 << 660) - 1) >> 540 << 540)
+        courier.refresh_from_db()
+        self.assertEqual(courier.working_mask, ((1 << 660) - 1) >> 540 << 540,
+                         'Проверьте, что маска сохраняется в БД')
+
+        orders = {}
+        for order_id, interval in ((300, '08:00-20:00'), (301, '11:00-12:00'),
+                                   (302, '23:00-01:00')):
+            orders[order_id] = Order.objects.create(
+                order_id=order_id, weight=1, region_id=130)
+            orders[order_id].delivery_hours.add(interval)
+
+        def available():
+            courier.refresh_from_db()
+            return sorted(services.get_available_orders(courier).values_list(
+                'order_id', flat=True))
+
+        self.assertListEqual(
+            available(), [300],
+            'Проверьте, что заказ с интервалом, содержащим интервал работы '
+            'курьера, доступен, а смежный интервал не пересекается')
+        courier.working_hours.add('00:30-02:00')
+        self.assertListEqual(available(), [300, 302])
+        courier.working_hours.remove('09:00-11:00')
+        self.assertListEqual(available(), [302])
+        intervals['23:00-01:00'].orders.clear()
+        self.assertListEqual(available(), [])
+        orders[302].refresh_from_db()
+        self.assertEqual(orders[302].delivery_mask, 0,
+                         'Проверьте, что маска пересчитывается при очистке '
+                         'связей со стороны интервала')
+        intervals['00:30-02:00'].orders.add(orders[301])
+        self.assertListEqual(available(), [301])
+        courier.working_hours.clear()
+        self.assertListEqual(available(), [])
+
+    def test_open_orders(self):
+        """Проверить поддержание таблицы неназначенных заказов.
+
+        Проверки:
+        __________
+        * Новый заказ попадает в таблицу
+        * Заказы, включенные в развоз, удаляются из таблицы
+        * Завершенный заказ в таблицу не возвращается
+        * Заказ, исключенный из развоза, возвращается в таблицу с актуальной
+          маской минут доставки.
+        """
+        Region.objects.create(code=140)
+        intervals = [TimeInterval.objects.get_or_create(name=name)[0]
+                     for name in ('09:00-11:00', '12:00-13:00')]
+        courier = Courier.objects.create(courier_id=140, courier_type='foot')
+        courier.regions.add(140)
+        courier.working_hours.add(*intervals)
+        for order_id, interval in zip((400, 401, 402), intervals * 2):
+            Order.objects.create(order_id=order_id, weight=3,
+                                 region_id=140).delivery_hours.add(interval)
+
+        def open_orders():
+            open_orders = dict(OpenOrder.objects.filter(
+                region_id=140).values_list('order_id', 'delivery_mask'))
+            self.assertDictEqual(open_orders, dict(
+                Order.objects.filter(order_id__in=open_orders)
+                .values_list('order_id', 'delivery_mask')))
+            return sorted(open_orders)
+
+        self.assertListEqual(open_orders(), [400, 401, 402])
+        services.assign_orders(courier)
+        self.assertListEqual(open_orders(), [])
+        complete_order(InvoiceOrder.objects.get(order_id=400),
+                       timezone.now())
+        self.assertListEqual(open_orders(), [])
+        courier.working_hours.remove(intervals[1])
+        services.delete_unavailable_orders(courier)
+        self.assertListEqual(open_orders(), [401])
+
+    @mock.patch.object(settings, 'EAGER_ASSIGNMENT', True)
+    def test_eager_assignment(self):
+        """Проверить назначение новых заказов при их создании.
+
+        Проверки:
+        __________
+        * Новые заказы сразу назначаются свободным курьерам, районы и часы
+          работы которых им подходят
+        * Курьеры с активным развозом и курьеры других районов заказы не
+          получают
+        * Запрос POST /orders/assign возвращает готовый развоз без подбора
+          заказов
+        * Время назначения такого развоза -- время первого запроса курьера,
+          повторный запрос его не меняет
+        * Подбор для всех курьеров ограничен общим бюджетом времени, а
+          заблокированные курьеры пропускаются
+        * Ошибка назначения не отменяет создание заказов.
+        """
+        Region.objects.bulk_create([Region(code=160), Region(code=161)])
+        interval, _ = TimeInterval.objects.get_or_create(name='09:00-11:00')
+        couriers = {}
+        for courier_id, region in ((160, 160), (161, 160), (162, 161)):
+            couriers[courier_id] = Courier.objects.create(
+                courier_id=courier_id, courier_type='car')
+            couriers[courier_id].regions.add(region)
+            couriers[courier_id].working_hours.add(interval)
+        Order.objects.create(order_id=600, weight=1,
+                             region_id=160).delivery_hours.add(interval)
+        busy_invoice = services.assign_orders(couriers[161])
+
+        data = {'data': [{'order_id': 601, 'weight': 30, 'region': 160,
+                          'delivery_hours': ['10:00-12:00']},
+                         {'order_id': 602, 'weight': 15, 'region': 160,
+                          'delivery_hours': ['10:00-12:00']}]}
+        response = self.client.post(reverse('orders-list'), data,
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertListEqual(
+            sorted(Order.objects.filter(
+                invoices__courier=couriers[160]).values_list(
+                'order_id', flat=True)), [601, 602],
+            'Проверьте, что новые заказы назначены свободному курьеру')
+        self.assertListEqual(
+            list(Order.objects.filter(
+                invoices__courier=couriers[161]).values_list(
+                'order_id', flat=True)), [600])
+        self.assertEqual(busy_invoice.invoice_orders.count(), 1)
+        self.assertFalse(couriers[162].invoices.exists())
+        eager_invoice = couriers[160].invoices.get()
+        self.assertFalse(eager_invoice.fetched)
+        self.assertTrue(busy_invoice.fetched)
+
+        with mock.patch('delivery.services.assign_orders') as assign:
+            response = self.client.post(reverse('orders-assign'),
+                                        {'courier_id': 160}, format='json')
+            assign.assert_not_called()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        content = json.loads(response.content)
+        self.assertListEqual(sorted(x['id'] for x in content['orders']),
+                             [601, 602])
+        fetched_invoice = couriers[160].invoices.get()
+        self.assertTrue(fetched_invoice.fetched)
+        self.assertGreater(fetched_invoice.assign_time,
+                           eager_invoice.assign_time)
+        self.assertEqual(parse(content['assign_time']),
+                         fetched_invoice.assign_time)
+        response = self.client.post(reverse('orders-assign'),
+                                    {'courier_id': 160}, format='json')
+        self.assertEqual(json.loads(response.content)['assign_time'],
+                         content['assign_time'])
+
+        data = {'data': [{'order_id': 603, 'weight': 1, 'region': 161,
+                          'delivery_hours': ['10:00-12:00']}]}
+        with mock.patch('delivery.services.assign_orders_batch',
+                        side_effect=OperationalError) as batch, \
+                self.assertLogs('delivery.services', 'ERROR'):
+            response = self.client.post(reverse('orders-list'), data,
+                                        format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertTrue(OpenOrder.objects.filter(order_id=603).exists())
+        self.assertIn('deadline', batch.call_args[1])
+        self.assertTrue(batch.call_args[1]['skip_locked'])
+
     def test_valid_data_complete_order(self):
         """Проверить обработку запроса POST /orders/complete с валидными
         данными.
@@ -445,3 +710,175 @@ class OrdersTests(APITestCase):
                 }
         response = self.client.post(url, data, format='json')
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_complete_orders_batch(self):
+        """Проверить обработку запроса POST /orders/complete-batch.
+
+        Проверки:
+        __________
+        * Результат возвращается для каждого переданного заказа в порядке
+          запроса
+        * Завершения одного развоза применяются в порядке времени, время
+          доставки считается от предыдущего завершения
+        * Чужие, неизвестные заказы, заказы без времени и с временем раньше
+          предыдущего завершения получают ошибку, не мешая остальным
+        * Логическое значение не принимается за идентификатор
+        * Обработчик идемпотентен
+        * При неверной структуре запроса возвращается ошибка 400.
+        """
+        url = reverse('orders-complete-batch')
+        courier = Courier.objects.first()
+        other_courier = Courier.objects.last()
+        invoice = get_active_invoice(courier)
+        other_invoice = get_active_invoice(other_courier)
+        first, second, third = invoice.orders.values_list(
+            'order_id', flat=True)[:3]
+        time_1 = invoice.assign_time + timedelta(minutes=5)
+        time_2 = time_1 + timedelta(minutes=7)
+        data = {'data': [
+            {'courier_id': courier.courier_id, 'order_id': second,
+             'complete_time': time_2.isoformat()},
+            {'courier_id': courier.courier_id, 'order_id': first,
+             'complete_time': time_1.isoformat()},
+            {'courier_id': courier.courier_id,
+             'order_id': other_invoice.orders.first().order_id,
+             'complete_time': time_1.isoformat()},
+            {'courier_id': courier.courier_id, 'order_id': 9999,
+             'complete_time': time_1.isoformat()},
+            {'courier_id': courier.courier_id, 'order_id': third,
+             'complete_time': 'вчера'},
+        ]}
+        response = self.client.post(url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = json.loads(response.content)['orders']
+        self.assertListEqual([x['order_id'] for x in results],
+                             [x['order_id'] for x in data['data']])
+        self.assertListEqual(['error' in x for x in results],
+                             [False, False, True, True, True])
+        delivery_times = dict(InvoiceOrder.objects.filter(
+            order_id__in=[first, second]).values_list(
+            'order_id', 'delivery_time'))
+        self.assertDictEqual(delivery_times, {first: 300, second: 420})
+
+        # Повторный запрос не меняет результат, а завершение раньше
+        # предыдущего завершения развоза отклоняется
+        response = self.client.post(url, data, format='json')
+        self.assertListEqual(json.loads(response.content)['orders'], results)
+        response = self.client.post(url, {'data': [
+            {'courier_id': courier.courier_id, 'order_id': third,
+             'complete_time': time_1.isoformat()}]}, format='json')
+        self.assertIn('error', json.loads(response.content)['orders'][0])
+        self.assertIsNone(InvoiceOrder.objects.get(
+            order_id=third).complete_time)
+
+        # Логическое значение не принимается за идентификатор курьера 1
+        other_order_id = other_invoice.orders.first().order_id
+        Courier.objects.create(courier_id=1, courier_type='car')
+        Invoice.objects.filter(pk=other_invoice.pk).update(courier_id=1)
+        response = self.client.post(url, {'data': [
+            {'courier_id': True, 'order_id': other_order_id,
+             'complete_time': time_1.isoformat()}]}, format='json')
+        self.assertIn('error', json.loads(response.content)['orders'][0])
+        self.assertIsNone(InvoiceOrder.objects.get(
+            order_id=other_order_id).complete_time)
+
+        response = self.client.post(url, {'data': 'заказы'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_export_deliveries(self):
+        """Проверить выгрузку истории доставок.
+
+        Проверки:
+        __________
+        * Эндпоинт доступен только администраторам
+        * Выгрузка в NDJSON и CSV содержит все строки развозов с данными
+          развоза, курьера и заказа и отдается потоком блоками
+        * Фильтры по периоду выдачи развозов и району
+        * Команда export_deliveries выгружает те же данные в файл
+        * При невалидных параметрах возвращается статус 400, а команда
+          завершается с ошибкой.
+        """
+        for courier_id in (100, 102):
+            invoice = get_active_invoice(
+                Courier.objects.get(courier_id=courier_id))
+        invoice_order = invoice.invoice_orders.select_related(
+            'order').first()
+        complete_order(invoice_order,
+                       invoice.assign_time + timedelta(minutes=10))
+        url = reverse('deliveries-export')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.client.force_authenticate(
+            User.objects.create_user(username='manager'))
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.client.force_authenticate(User.objects.create_user(
+            username='accountant', is_staff=True))
+
+        with mock.patch.object(settings, 'EXPORT_CHUNK_SIZE', 2):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertTrue(response.streaming)
+        blocks = [x.decode() for x in response.streaming_content]
+        self.assertGreater(len(blocks), 1)
+        rows = [json.loads(x) for x in ''.join(blocks).splitlines()]
+        self.assertEqual(len(rows), InvoiceOrder.objects.count())
+        row = next(x for x in rows if x['order_id'] == invoice_order.order_id)
+        encoder = DjangoJSONEncoder()
+        self.assertDictEqual(row, {
+            'invoice_id': invoice.id,
+            'assign_time': encoder.default(invoice.assign_time),
+            'courier_id': 102,
+            'courier_type': 'car',
+            'expected_reward': invoice.expected_reward,
+            'order_id': invoice_order.order_id,
+            'region': invoice_order.order.region_id,
+            'weight': str(invoice_order.order.weight),
+            'complete_time': encoder.default(
+                invoice.assign_time + timedelta(minutes=10)),
+            'delivery_time': 600,
+        })
+
+        region = invoice_order.order.region_id
+        response = self.client.get(url, {'output': 'csv', 'region': region})
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], ','.join([
+            'invoice_id', 'assign_time', 'courier_id', 'courier_type',
+            'expected_reward', 'order_id', 'region', 'weight',
+            'complete_time', 'delivery_time']))
+        self.assertEqual(len(lines) - 1, InvoiceOrder.objects.filter(
+            order__region_id=region).count())
+        self.assertTrue(all(x.split(',')[6] == str(region)
+                            for x in lines[1:]))
+
+        today = timezone.localdate()
+        response = self.client.get(url, {
+            'date_from': today.isoformat(), 'date_to': today.isoformat()})
+        self.assertEqual(len(b''.join(response.streaming_content).decode(
+            ).splitlines()), len(rows))
+        response = self.client.get(url, {
+            'date_to': (today - timedelta(days=1)).isoformat()})
+        self.assertEqual(b''.join(response.streaming_content), b'')
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'deliveries.csv')
+            call_command('export_deliveries', '--format', 'csv',
+                         '--region', str(region), '--chunk-size', '3',
+                         '--output', path, stderr=StringIO())
+            with open(path, newline='', encoding='utf-8') as file:
+                self.assertListEqual(file.read().splitlines(), lines)
+        stdout = StringIO()
+        call_command('export_deliveries', stdout=stdout)
+        self.assertListEqual(
+            [json.loads(x) for x in stdout.getvalue().splitlines()], rows)
+
+        for params in ({'output': 'xml'}, {'region': 0},
+                       {'date_from': '2021-03-02', 'date_to': '2021-03-01'}):
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code,
+                             status.HTTP_400_BAD_REQUEST)
+        with self.assertRaises(CommandError):
+            call_command('export_deliveries', '--date-from', '01.03.2021',
+                         stdout=StringIO())
@@ -0,0 +1,622 @@
+import random
+import time
+import tracemalloc
+from concurrent.futures.process import BrokenProcessPool
+from unittest import mock
+
+from django.conf import settings
+from django.test import SimpleTestCase, TestCase
+
+from delivery.models import Courier, Invoice, Order, TimeInterval
+from delivery.packing import (PACKING_STRATEGIES, IncrementalPacking,
+                              PackingCache, bitset_knapsack, checkpoint_rows,
+                              checkpoint_step, dp_strategy, get_executor,
+                              greedy_pack, parallel_knapsack, row_size,
+                              select_strategy, shutdown_executor, solve)
+from delivery.services import (ASSIGN_ATTEMPTS, COURIER_LOAD_CAPACITY,
+                               assign_orders, assign_orders_batch,
+                               get_courier_profile, get_orders_for_delivery,
+                               load_candidates, packing_cache,
+                               packing_states)
+from delivery.tests.test_fixtures import HEAVY_WEIGHTS, create_test_case_full
+
+
+def legacy_knapsack(max_weight, order_weight, num_orders):
+    """Вернуть таблицу возможных комбинаций заказов по весу (эталонная
+    табличная реализация)."""
+
+    memorize = [[0 for _ in range(max_weight + 1)] for _ in
+                range(num_orders + 1)]
+    for i in range(num_orders + 1):
+        for w in range(max_weight + 1):
+            if i == 0 or w == 0:
+                memorize[i][w] = 0
+            elif order_weight[i - 1] <= w:
+                memorize[i][w] = max(
+                    order_weight[i - 1] + memorize[i - 1][
+                        w - order_weight[i - 1]],
+                    memorize[i - 1][w])
+            else:
+                memorize[i][w] = memorize[i - 1][w]
+    return memorize
+
+
+def legacy_pack(max_weight, weights):
+    """Вернуть индексы заказов, выбранных эталонной реализацией."""
+
+    num_orders = len(weights)
+    memorize = legacy_knapsack(max_weight, weights, num_orders)
+    pack = []
+    w, i = max_weight, num_orders
+    result = memorize[num_orders][max_weight]
+    while i > 0 and result > 0:
+        if result != memorize[i - 1][w]:
+            pack.append(i - 1)
+            result -= weights[i - 1]
+            w -= weights[i - 1]
+        i -= 1
+    return pack
+
+
+class PackingTests(SimpleTestCase):
+    """Класс PackingTests предназначен для теста движков подбора заказов."""
+
+    @classmethod
+    def tearDownClass(cls):
+        shutdown_executor()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.random = random.Random(2021)
+        packing_cache.clear()
+
+    def _random_pools(self):
+        """Вернуть набор тестовых пулов весов в сотых долях килограмма."""
+
+        pools = [[], [1], [5000], [1501, 1500], [int(w * 100) for w in
+                                                 HEAVY_WEIGHTS]]
+        for _ in range(30):
+            size = self.random.randint(1, 40)
+            pools.append([self.random.randint(1, 1500) for _ in range(size)])
+        for _ in range(10):
+            size = self.random.randint(1, 60)
+            pools.append([self.random.choice([1, 2, 50, 100, 750, 1001])
+                          for _ in range(size)])
+        return pools
+
+    def test_bitset_knapsack_parity(self):
+        """Проверить, что битовый движок выбирает те же заказы, что и
+        табличная реализация.
+
+        Проверки:
+        __________
+        * Совпадают индексы и порядок выбранных заказов для всех типов
+          курьеров.
+        """
+
+        for pool in self._random_pools():
+            for capacity in COURIER_LOAD_CAPACITY.values():
+                max_weight = capacity * 100
+                self.assertListEqual(
+                    bitset_knapsack(max_weight, pool),
+                    legacy_pack(max_weight, pool),
+                    f'Комбинации расходятся для пула {pool} и '
+                    f'грузоподъемности {capacity}')
+
+    def test_get_orders_for_delivery(self):
+        """Проверить, что get_orders_for_delivery возвращает заказы
+        оптимальной комбинации.
+
+        Проверки:
+        __________
+        * Вес выбранных заказов совпадает с весом эталонной комбинации.
+        """
+
+        weights = [1] * 50 + [int(w * 100) for w in HEAVY_WEIGHTS]
+        order_ids = list(range(len(weights)))
+        for capacity in COURIER_LOAD_CAPACITY.values():
+            expected = sum(weights[i] for i in legacy_pack(capacity * 100,
+                                                           weights))
+            pack = get_orders_for_delivery(order_ids, weights, capacity)
+            self.assertEqual(
+                sum(weights[order_id] for order_id in pack), expected,
+                'Проверьте, что выбранные заказы имеют максимальный вес')
+            self.assertEqual(len(set(pack)), len(pack))
+
+    def test_solve_fast_paths(self):
+        """Проверить быстрые пути подбора заказов.
+
+        Проверки:
+        __________
+        * Если все заказы помещаются, выбираются все заказы
+        * Сокращение на общий делитель не меняет выбор заказов
+        * Жадная укладка, заполняющая рюкзак полностью, возвращается сразу.
+        """
+
+        self.assertListEqual(solve(1000, [300, 200, 500]), [2, 1, 0])
+        self.assertListEqual(solve(1000, []), [])
+
+        for pool in self._random_pools():
+            scaled = [weight * 25 for weight in pool]
+            for capacity in COURIER_LOAD_CAPACITY.values():
+                max_weight = capacity * 100
+                pack = solve(max_weight, scaled)
+                self.assertEqual(
+                    sum(scaled[i] for i in pack),
+                    sum(scaled[i] for i in legacy_pack(max_weight, scaled)),
+                    'Проверьте, что быстрые пути не ухудшают комбинацию')
+                self.assertEqual(len(set(pack)), len(pack))
+
+        weights = [600, 400, 300, 300]
+        with mock.patch('delivery.packing.bitset_knapsack') as knapsack:
+            pack = solve(1000, weights)
+        knapsack.assert_not_called()
+        self.assertEqual(sum(weights[i] for i in pack), 1000)
+
+    def test_solve_time_budget(self):
+        """Проверить подбор заказов с ограниченным бюджетом времени.
+
+        Проверки:
+        __________
+        * По исчерпании бюджета возвращается допустимая комбинация не хуже
+          жадной укладки
+        * Время подбора ограничено бюджетом, а не размером пула.
+        """
+
+        max_weight = COURIER_LOAD_CAPACITY['car'] * 100
+        weights = [self.random.randint(1, 5000) * 2 + 1
+                   for _ in range(20000)]
+        greedy, greedy_load = greedy_pack(max_weight, weights)
+
+        started = time.monotonic()
+        pack = solve(max_weight, weights, time_budget=0.05)
+        elapsed = time.monotonic() - started
+        print(f'~ solve with 0.05s budget: {elapsed:.3f}s')
+
+        load = sum(weights[i] for i in pack)
+        self.assertEqual(len(set(pack)), len(pack))
+        self.assertLessEqual(load, max_weight)
+        self.assertGreaterEqual(load, greedy_load)
+        self.assertLess(elapsed, 1, 'Проверьте, что подбор заказов '
+                                    'укладывается в бюджет времени')
+
+    def test_bounded_memory_reconstruction(self):
+        """Проверить восстановление комбинации с ограниченным бюджетом памяти.
+
+        Проверки:
+        __________
+        * При превышении бюджета хранится каждая ceil(sqrt(n))-я строка
+        * Хранимые строки таблицы укладываются в бюджет памяти
+        * Выбор заказов совпадает с режимом хранения всей таблицы
+        * Пиковое потребление памяти не превышает бюджет
+        * Если бюджет меньше контрольных строк, таблица не строится, а
+          стратегия dp переходит к методу ветвей и границ.
+        """
+
+        max_weight = COURIER_LOAD_CAPACITY['car'] * 100
+        weights = [self.random.choice([1, 3, 7, 250, 999])
+                   for _ in range(2000)]
+        memory_budget = 72 * 1024
+        self.assertGreater(len(weights) * row_size(max_weight), memory_budget)
+        self.assertEqual(checkpoint_step(len(weights), max_weight), 1)
+        step = checkpoint_step(len(weights), max_weight, memory_budget)
+        self.assertEqual(
+            step, 45,
+            'Проверьте, что при превышении бюджета хранится каждая '
+            'ceil(sqrt(n))-я строка таблицы')
+        self.assertLessEqual(
+            checkpoint_rows(len(weights), step) * row_size(max_weight),
+            memory_budget,
+            'Проверьте, что хранимые строки укладываются в бюджет памяти')
+
+        peaks = {}
+        packs = {}
+        for mode, budget in (('full', None), ('bounded', memory_budget)):
+            tracemalloc.start()
+            packs[mode] = bitset_knapsack(max_weight, weights, budget)
+            peaks[mode] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f'~ knapsack {mode:8} peak memory: {peaks[mode]} bytes')
+
+        self.assertListEqual(
+            packs['bounded'], packs['full'],
+            'Проверьте, что режим ограниченной памяти выбирает те же заказы')
+        self.assertLessEqual(
+            peaks['bounded'], memory_budget,
+            'Проверьте, что пиковое потребление памяти не превышает бюджет')
+
+        small_budget = 32 * 1024
+        self.assertIsNone(
+            checkpoint_step(len(weights), max_weight, small_budget),
+            'Проверьте, что шаг не выбирается, если контрольные строки не '
+            'укладываются в бюджет')
+        with self.assertRaises(MemoryError):
+            bitset_knapsack(max_weight, weights, small_budget)
+        pack = dp_strategy(max_weight, weights, memory_budget=small_budget)
+        self.assertEqual(len(set(pack)), len(pack))
+        self.assertEqual(
+            sum(weights[i] for i in pack),
+            sum(weights[i] for i in packs['full']),
+            'Проверьте, что при нехватке памяти стратегия dp находит '
+            'оптимальную комбинацию методом ветвей и границ')
+
+    def test_packing_strategies(self):
+        """Проверить стратегии подбора заказов.
+
+        Проверки:
+        __________
+        * Точные стратегии находят комбинацию с максимальным весом
+        * Приближенная стратегия находит комбинацию не хуже (1 - epsilon) от
+          оптимума
+        * Комбинации не превышают грузоподъемность и не повторяют заказы.
+        """
+
+        epsilon = 0.1
+        pools = [pool for pool in self._random_pools() if len(pool) <= 24]
+        for pool in pools:
+            for capacity in COURIER_LOAD_CAPACITY.values():
+                max_weight = capacity * 100
+                optimum = sum(pool[i] for i in legacy_pack(max_weight, pool))
+                for name, strategy in PACKING_STRATEGIES.items():
+                    pack = strategy(max_weight, pool, epsilon=epsilon)
+                    load = sum(pool[i] for i in pack)
+                    self.assertEqual(len(set(pack)), len(pack))
+                    self.assertLessEqual(load, max_weight)
+                    if name == 'fptas':
+                        self.assertGreaterEqual(
+                            load, (1 - epsilon) * optimum,
+                            f'Стратегия {name} не дает гарантии точности')
+                    else:
+                        self.assertEqual(
+                            load, optimum,
+                            f'Стратегия {name} не находит оптимум')
+
+    def test_select_strategy(self):
+        """Проверить выбор стратегии подбора заказов.
+
+        Проверки:
+        __________
+        * Для грузоподъемностей курьеров выбирается динамическое
+          программирование при любом числе заказов
+        * Встреча посередине, FPTAS и метод ветвей и границ выбираются только
+          для грузоподъемностей, при которых таблица достижимых весов
+          обрабатывается дольше них
+        * Явно заданная стратегия имеет приоритет над автоматическим выбором
+        * Неизвестная стратегия вызывает ошибку.
+        """
+
+        for capacity in COURIER_LOAD_CAPACITY.values():
+            for num_orders in (10, 24, 2000, 25000):
+                self.assertEqual(select_strategy(num_orders, capacity * 100),
+                                 'dp')
+        max_weight = COURIER_LOAD_CAPACITY['car'] * 100
+        self.assertEqual(select_strategy(3000, max_weight, 1000),
+                         'parallel_dp')
+        self.assertEqual(select_strategy(20, 10 ** 6), 'meet_in_the_middle')
+        self.assertEqual(select_strategy(3000, 10 ** 5), 'dp')
+        self.assertEqual(select_strategy(50, 10 ** 8), 'fptas')
+        self.assertEqual(select_strategy(25000, 10 ** 6), 'branch_and_bound')
+
+        # Жадная укладка заполняет рюкзак не полностью: 600 из 1000
+        weights = [600, 500, 500]
+        for name in PACKING_STRATEGIES:
+            with mock.patch.dict(PACKING_STRATEGIES,
+                                 {name: mock.Mock(return_value=[1, 2])}):
+                self.assertListEqual(solve(1000, weights, strategy=name),
+                                     [1, 2])
+                PACKING_STRATEGIES[name].assert_called_once()
+        with self.assertRaises(ValueError):
+            solve(1000, weights, strategy='unknown')
+
+    def test_incremental_packing(self):
+        """Проверить инкрементальное состояние подбора заказов.
+
+        Проверки:
+        __________
+        * После каждого изменения набора кандидатов находится оптимальная
+          комбинация
+        * Новый заказ добавляет одну строку таблицы
+        * Удаление заказа пересчитывает только последующие строки
+        * Удаление назначенной комбинации из большого набора пересчитывает
+          число строк порядка размера комбинации, а не набора
+        * По исчерпании бюджета времени состояние сохраняет добавленные
+          строки.
+        """
+
+        max_weight = COURIER_LOAD_CAPACITY['bike'] * 100
+        state = IncrementalPacking(max_weight)
+        candidates = {}
+        next_id = 0
+        for _ in range(50):
+            for _ in range(self.random.randint(0, 5)):
+                candidates[next_id] = self.random.randint(1, 900)
+                next_id += 1
+            for order_id in self.random.sample(
+                    sorted(candidates), min(len(candidates), 2)):
+                del candidates[order_id]
+            self.assertTrue(state.sync(candidates.items()))
+            pack = state.solve()
+            weights = list(candidates.values())
+            self.assertEqual(
+                sum(candidates[order_id] for order_id in pack),
+                sum(weights[i] for i in legacy_pack(max_weight, weights)),
+                'Проверьте, что состояние находит оптимальную комбинацию')
+
+        state = IncrementalPacking(max_weight)
+        candidates = {order_id: 100 + order_id for order_id in range(10)}
+        state.sync(candidates.items())
+        self.assertEqual(state.rows_computed, 10)
+        candidates[10] = 5
+        state.sync(candidates.items())
+        self.assertEqual(state.rows_computed, 11)
+        del candidates[10]
+        state.sync(candidates.items())
+        self.assertEqual(state.rows_computed, 11)
+        del candidates[7]
+        state.sync(candidates.items())
+        self.assertEqual(state.rows_computed, 13,
+                         'Проверьте, что пересчитываются только строки '
+                         'после выбывшего заказа')
+
+        state = IncrementalPacking(max_weight)
+        candidates = {order_id: self.random.randint(1, 500)
+                      for order_id in range(2000)}
+        state.sync(candidates.items())
+        for _ in range(5):
+            pack = state.solve()
+            for order_id in pack:
+                del candidates[order_id]
+            rows_computed = state.rows_computed
+            self.assertTrue(state.sync(candidates.items()))
+            self.assertLessEqual(state.rows_computed - rows_computed,
+                                 4 * len(pack),
+                                 'Проверьте, что назначенная комбинация '
+                                 'подбирается из последних заказов')
+
+        state = IncrementalPacking(max_weight)
+        self.assertFalse(state.sync(candidates.items(), deadline=0))
+        self.assertEqual(len(state.items), 0)
+
+    def test_parallel_knapsack(self):
+        """Проверить параллельный подбор заказов в пуле процессов.
+
+        Проверки:
+        __________
+        * Параллельный подбор находит комбинацию с максимальным весом
+        * Пул процессов переиспользуется между вызовами
+        * При недоступности пула подбор выполняется в текущем процессе.
+        """
+
+        max_weight = COURIER_LOAD_CAPACITY['car'] * 100
+        try:
+            executor = get_executor(2)
+            for _ in range(3):
+                weights = [self.random.randint(1, 4000)
+                           for _ in range(self.random.randint(1, 300))]
+                pack = parallel_knapsack(max_weight, weights, executor, 3)
+                self.assertEqual(len(set(pack)), len(pack))
+                self.assertEqual(
+                    sum(weights[i] for i in pack),
+                    sum(weights[i] for i in bitset_knapsack(max_weight,
+                                                            weights)),
+                    'Проверьте, что параллельный подбор находит оптимум')
+            self.assertIs(get_executor(2), executor)
+        finally:
+            shutdown_executor()
+
+        weights = [600, 500, 500]
+        with mock.patch('delivery.packing.get_executor',
+                        side_effect=BrokenProcessPool):
+            self.assertListEqual(
+                solve(1000, weights, strategy='parallel_dp'), [2, 1])
+
+
+class PackingCacheTests(TestCase):
+    """Класс PackingCacheTests предназначен для теста кэша результатов
+    подбора заказов."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Произвести настройки перед проведением всех тестов."""
+
+        super().setUpClass()
+        create_test_case_full()
+
+    def setUp(self):
+        packing_cache.clear()
+
+    def test_cache_eviction(self):
+        """Проверить вытеснение записей из кэша.
+
+        Проверки:
+        __________
+        * Записи вытесняются по размеру в порядке давности использования
+        * Записи вытесняются по возрасту
+        * Считаются попадания и промахи.
+        """
+
+        cache = PackingCache(maxsize=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+        with mock.patch('delivery.packing.time.monotonic',
+                        return_value=time.monotonic() + 61):
+            self.assertIsNone(cache.get('a'))
+        self.assertEqual(tuple(cache.cache_info()), (2, 2, 2, 1))
+
+        disabled = PackingCache(maxsize=0)
+        disabled.set('a', 1)
+        self.assertIsNone(disabled.get('a'))
+
+    def test_load_candidates(self):
+        """Проверить загрузку кандидатов параллельными массивами.
+
+        Проверки:
+        __________
+        * Заказ, попавший в выборку через несколько интервалов доставки,
+          загружается один раз
+        * Идентификаторы упорядочены, веса переведены в сотые доли
+          килограмма
+        * Экземпляры модели заказа не создаются.
+        """
+
+        interval, _ = TimeInterval.objects.get_or_create(name='00:00-00:01')
+        interval.orders.add(*Order.objects.filter(region_id=100)[:3])
+        orders = Order.objects.filter(region_id=100,
+                                      delivery_hours__isnull=False)
+        expected = sorted(set(orders.values_list('order_id', 'weight')))
+        self.assertGreater(orders.count(), len(expected),
+                           'Выборка должна содержать повторы заказов')
+        with mock.patch.object(Order, '__init__') as init:
+            order_ids, weights = load_candidates(orders)
+            init.assert_not_called()
+        self.assertListEqual(list(order_ids),
+                             [order_id for order_id, _ in expected])
+        self.assertListEqual(list(weights),
+                             [int(weight * 100) for _, weight in expected])
+
+    def test_cached_get_orders_for_delivery(self):
+        """Проверить кэширование результатов get_orders_for_delivery.
+
+        Проверки:
+        __________
+        * Повторный подбор для того же набора кандидатов берется из кэша
+        * Порядок кандидатов не влияет на ключ кэша
+        * Результат из кэша не выдается, если его заказ назначен после
+          сохранения записи.
+        """
+
+        order_ids, weights = load_candidates(
+            Order.objects.filter(region_id=100))
+        capacity = COURIER_LOAD_CAPACITY['bike']
+        with mock.patch('delivery.services.solve', wraps=solve) as solver:
+            first = get_orders_for_delivery(order_ids, weights, capacity)
+            second = get_orders_for_delivery(order_ids[::-1], weights[::-1],
+                                             capacity)
+            self.assertListEqual(first, second)
+            self.assertEqual(solver.call_count, 1)
+            self.assertEqual(packing_cache.cache_info().hits, 1)
+
+            courier = Courier.objects.get(courier_id=101)
+            Invoice.objects.create(courier=courier,
+                                   expected_reward=0).orders.set(first[:1])
+            third = get_orders_for_delivery(order_ids, weights, capacity)
+            self.assertEqual(solver.call_count, 2,
+                             'Проверьте, что устаревшая запись кэша '
+                             'пересчитывается')
+            self.assertListEqual(first, third)
+
+    def test_incremental_get_orders_for_delivery(self):
+        """Проверить подбор заказов по профилю курьера.
+
+        Проверки:
+        __________
+        * Повторный подбор для профиля обновляет состояние на число новых
+          заказов
+        * Подбор по профилю находит комбинацию с максимальным весом.
+        """
+
+        courier = Courier.objects.get(courier_id=100)
+        profile = get_courier_profile(courier)
+        capacity = COURIER_LOAD_CAPACITY[courier.courier_type]
+        order_ids, weights = load_candidates(
+            Order.objects.filter(region_id=100))
+        weight_by_id = dict(zip(order_ids, weights))
+
+        def pack_weight(pack):
+            return sum(weight_by_id[order_id] for order_id in pack)
+
+        packing_states.clear()
+        first = get_orders_for_delivery(order_ids[:-1], weights[:-1],
+                                        capacity, profile)
+        state = packing_states.get((profile, capacity))
+        self.assertEqual(state.rows_computed, len(order_ids) - 1)
+        second = get_orders_for_delivery(order_ids, weights, capacity,
+                                         profile)
+        self.assertEqual(state.rows_computed, len(order_ids))
+        self.assertEqual(pack_weight(first), pack_weight(
+            get_orders_for_delivery(order_ids[:-1], weights[:-1], capacity)))
+        self.assertEqual(pack_weight(second), pack_weight(
+            get_orders_for_delivery(order_ids, weights, capacity)))
+
+    def test_incremental_memory_budget(self):
+        """Проверить ограничение памяти состояний инкрементального подбора.
+
+        Проверки:
+        __________
+        * Состояния вытесняются по общему бюджету памяти, в том числе после
+          роста уже сохраненного состояния
+        * Отключение кэша результатов не отключает инкрементальный подбор.
+        """
+
+        states = PackingCache(None, memory_budget=6 * row_size(800),
+                              sizeof=IncrementalPacking.memory_size)
+        first, second = IncrementalPacking(800), IncrementalPacking(800)
+        first.sync([(1, 100), (2, 200)])
+        second.sync([(3, 300), (4, 400)])
+        states.set('first', first)
+        states.set('second', second)
+        self.assertIs(states.get('first'), first)
+        first.sync([(1, 100), (2, 200), (5, 500)])
+        states.trim()
+        self.assertIsNone(states.get('second'))
+        self.assertIs(states.get('first'), first)
+
+        courier = Courier.objects.get(courier_id=100)
+        profile = get_courier_profile(courier)
+        capacity = COURIER_LOAD_CAPACITY[courier.courier_type]
+        order_ids, weights = load_candidates(
+            Order.objects.filter(region_id=100))
+        packing_states.clear()
+        with mock.patch.object(packing_cache, 'maxsize', 0):
+            get_orders_for_delivery(order_ids, weights, capacity, profile)
+        self.assertIsNotNone(packing_states.get((profile, capacity)))
+
+    def test_assign_orders_deadline(self):
+        """Проверить бюджет времени повторных попыток назначения развоза.
+
+        Проверки:
+        __________
+        * Инкрементальный подбор, подбор без него и повторные попытки
+          получают один и тот же момент исчерпания бюджета времени
+        * Подбор для всех курьеров группы получает один и тот же момент
+          исчерпания бюджета времени.
+        """
+
+        courier = Courier.objects.get(courier_id=100)
+        with mock.patch('delivery.services.lock_open_orders',
+                        return_value=set()), \
+                mock.patch('delivery.services.'
+                           'get_incremental_orders_for_delivery',
+                           return_value=None) as incremental, \
+                mock.patch('delivery.services.solve',
+                           wraps=solve) as solver:
+            start = time.monotonic()
+            self.assertListEqual(assign_orders(courier), [])
+        self.assertEqual(incremental.call_count, ASSIGN_ATTEMPTS)
+        deadlines = {call[0][4] for call in incremental.call_args_list}
+        deadlines.update(call[1]['deadline'] for call in solver.call_args_list)
+        self.assertEqual(len(deadlines), 1,
+                         'Проверьте, что попытки подбора используют общий '
+                         'бюджет времени')
+        self.assertGreaterEqual(deadlines.pop(),
+                                start + settings.PACKING_TIME_BUDGET)
+        self.assertEqual(solver.call_count, ASSIGN_ATTEMPTS)
+
+        couriers = Courier.objects.prefetch_related('regions')
+        with mock.patch('delivery.services.lock_open_orders',
+                        return_value=set()), \
+                mock.patch('delivery.services.get_orders_for_delivery',
+                           wraps=get_orders_for_delivery) as packer:
+            start = time.monotonic()
+            self.assertDictEqual(assign_orders_batch(couriers), {})
+        self.assertGreater(packer.call_count, 1)
+        deadlines = {call[1]['deadline'] for call in packer.call_args_list}
+        self.assertEqual(len(deadlines), 1,
+                         'Проверьте, что подбор для группы курьеров '
+                         'использует общий бюджет времени')
+        self.assertGreaterEqual(deadlines.pop(),
+                                start + settings.PACKING_TIME_BUDGET)
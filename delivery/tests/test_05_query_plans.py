@@ -0,0 +1,206 @@
+import json
+import os
+import random
+from datetime import timedelta
+from unittest import skipUnless
+
+from django.db import connection
+from django.test import TestCase
+from django.utils import timezone
+
+from delivery import services
+from delivery.models import (Courier, Invoice, InvoiceOrder, OpenOrder,
+                             Order)
+from delivery.tests.test_fixtures import (COURIER_REGIONS, OTHER_REGIONS,
+                                          WORKING_HOURS, create_test_case_full)
+
+# Файл с эталонными планами горячих запросов
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'query_plans.json')
+
+# Допустимый рост оценки стоимости плана относительно эталона
+COST_TOLERANCE = 1.5
+
+# Переменная окружения, при установке которой эталон перезаписывается
+UPDATE_BASELINE_ENV = 'UPDATE_QUERY_PLANS'
+
+SEED_COURIERS = 50
+SEED_ORDERS = 5000
+SEED_ORDERS_PER_INVOICE = 5
+
+
+def seed_database():
+    """Заполнить БД детерминированным набором курьеров, заказов и развозов.
+
+    Часть развозов завершена полностью, часть -- частично, остальные заказы
+    не назначены.
+    """
+
+    create_test_case_full()
+    rnd = random.Random(2021)
+    regions = COURIER_REGIONS + OTHER_REGIONS
+    couriers = Courier.objects.bulk_create([
+        Courier(courier_id=1000 + i,
+                courier_type=rnd.choice(Courier.CourierType.values))
+        for i in range(SEED_COURIERS)])
+    for courier in couriers:
+        courier.regions.add(*rnd.sample(regions, 2))
+        courier.working_hours.add(rnd.choice(WORKING_HOURS))
+
+    orders = Order.objects.bulk_create([
+        Order(order_id=10000 + i, weight=rnd.randint(1, 5000) / 100,
+              region_id=rnd.choice(regions),
+              delivery_mask=rnd.getrandbits(24 * 60))
+        for i in range(SEED_ORDERS)])
+    now = timezone.now()
+    invoices = Invoice.objects.bulk_create([
+        Invoice(courier=rnd.choice(couriers), expected_reward=1000)
+        for _ in range(SEED_ORDERS // SEED_ORDERS_PER_INVOICE // 2)])
+    invoice_orders = []
+    for invoice, start in zip(invoices, range(0, SEED_ORDERS,
+                                              SEED_ORDERS_PER_INVOICE)):
+        completed = rnd.randint(0, SEED_ORDERS_PER_INVOICE)
+        for position, order in enumerate(
+                orders[start:start + SEED_ORDERS_PER_INVOICE]):
+            invoice_order = InvoiceOrder(invoice=invoice, order=order)
+            if position < completed:
+                invoice_order.delivery_time = rnd.randint(60, 7200)
+                invoice_order.complete_time = now + timedelta(
+                    seconds=invoice_order.delivery_time)
+            invoice_orders.append(invoice_order)
+    InvoiceOrder.objects.bulk_create(invoice_orders)
+    assigned = {invoice_order.order_id for invoice_order in invoice_orders}
+    OpenOrder.objects.bulk_create(
+        OpenOrder.from_order(order) for order in orders
+        if order.order_id not in assigned)
+    services.rebuild_region_stats()
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+
+
+def plan_nodes(plan):
+    """Вернуть список всех узлов плана запроса."""
+
+    nodes = [plan]
+    for child in plan.get('Plans', []):
+        nodes.extend(plan_nodes(child))
+    return nodes
+
+
+def explain(queryset):
+    """Вернуть корневой узел плана запроса."""
+
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]['Plan']
+
+
+@skipUnless(connection.vendor == 'postgresql',
+            'Планы запросов проверяются только для PostgreSQL')
+class QueryPlansTests(TestCase):
+    """Класс QueryPlansTests предназначен для проверки планов горячих
+    запросов.
+
+    Планы строятся с запретом последовательного сканирования, поэтому
+    запрос, для которого не нашлось индекса, получает штрафную стоимость.
+    При установленной переменной окружения UPDATE_QUERY_PLANS эталон
+    перезаписывается текущими планами.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        """Произвести настройки перед проведением всех тестов."""
+
+        super().setUpClass()
+        seed_database()
+        cls.courier = Courier.objects.get(courier_id=1000)
+        cls.update_baseline = bool(os.environ.get(UPDATE_BASELINE_ENV))
+        cls.baseline = {}
+        if os.path.exists(BASELINE_PATH):
+            with open(BASELINE_PATH) as file:
+                cls.baseline = json.load(file)
+        cls.plans = {}
+
+    @classmethod
+    def tearDownClass(cls):
+        """Сохранить эталон, если требуется его обновление."""
+
+        if cls.update_baseline:
+            baseline = dict(cls.baseline, **cls.plans)
+            with open(BASELINE_PATH, 'w') as file:
+                json.dump(baseline, file, indent=2, sort_keys=True)
+                file.write('\n')
+        super().tearDownClass()
+
+    def setUp(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SET enable_seqscan = off')
+
+    def tearDown(self):
+        with connection.cursor() as cursor:
+            cursor.execute('RESET enable_seqscan')
+
+    def check_plan(self, name, queryset):
+        """Сравнить план запроса с эталоном.
+
+        Проверки:
+        __________
+        * В плане нет последовательного сканирования
+        * Оценка стоимости не превышает эталон более чем в COST_TOLERANCE
+          раз.
+
+        Имена индексов не сравниваются: планировщик может выбрать любой из
+        равноценных индексов таблицы, а последовательное сканирование при
+        отсутствии подходящего индекса выдает план и без этого.
+        """
+
+        plan = explain(queryset)
+        nodes = plan_nodes(plan)
+        self.plans[name] = {'cost': plan['Total Cost']}
+        seq_scans = [node['Relation Name'] for node in nodes
+                     if node['Node Type'] == 'Seq Scan']
+        self.assertListEqual(
+            seq_scans, [],
+            f'Запрос {name} выполняет последовательное сканирование')
+        if self.update_baseline:
+            return
+        self.assertIn(name, self.baseline,
+                      f'Нет эталона для запроса {name}, запустите тесты с '
+                      f'переменной окружения {UPDATE_BASELINE_ENV}=1')
+        expected = self.baseline[name]
+        self.assertLessEqual(
+            plan['Total Cost'], expected['cost'] * COST_TOLERANCE,
+            f'Оценка стоимости запроса {name} выросла с {expected["cost"]} '
+            f'до {plan["Total Cost"]}')
+
+    def test_available_orders_plan(self):
+        """Проверить план выборки доступных курьеру заказов."""
+
+        self.check_plan('available_orders',
+                        services.get_available_orders(self.courier))
+        self.check_plan('assigned_orders', services.filter_courier_fit(
+            Order.objects.filter(
+                invoice_orders__in=services.get_active_invoice_orders(
+                    self.courier)),
+            self.courier))
+
+    def test_active_invoice_plan(self):
+        """Проверить план поиска активного развоза курьера."""
+
+        self.check_plan('active_invoice',
+                        services.get_active_invoices(self.courier))
+
+    def test_courier_rating_plan(self):
+        """Проверить план расчета среднего времени доставки по районам."""
+
+        self.check_plan('courier_rating',
+                        services.get_region_stats(self.courier))
+
+    def test_courier_earning_plan(self):
+        """Проверить план выборки завершенных развозов курьера."""
+
+        self.check_plan('courier_earning',
+                        services.get_completed_invoices(self.courier))
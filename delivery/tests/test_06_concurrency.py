@@ -0,0 +1,171 @@
+import threading
+import time
+from datetime import timedelta
+from unittest import skipUnless
+
+from django.db import connection, connections
+from django.db.models import Count, Sum
+from django.test import TransactionTestCase
+
+from delivery import services
+from delivery.models import (Courier, InvoiceOrder, OpenOrder, Order, Region,
+                             TimeInterval)
+
+WORKER_COUNTS = [1, 2, 4, 8]
+ASSIGNS_PER_WORKER = 5
+ORDERS_PER_ASSIGN = 10
+
+
+def run_in_threads(func, args_list):
+    """Выполнить func в отдельном потоке для каждого набора аргументов,
+    одновременно стартовав все потоки, и вернуть список ошибок."""
+
+    barrier = threading.Barrier(len(args_list))
+    errors = []
+
+    def worker(*args):
+        try:
+            barrier.wait()
+            func(*args)
+        except Exception as error:
+            errors.append(error)
+        finally:
+            connections.close_all()
+
+    threads = [threading.Thread(target=worker, args=args)
+               for args in args_list]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return errors
+
+
+@skipUnless(connection.vendor == 'postgresql',
+            'Блокировки SKIP LOCKED проверяются только для PostgreSQL')
+class ConcurrentAssignTests(TransactionTestCase):
+    """Класс ConcurrentAssignTests предназначен для нагрузочной проверки
+    параллельного назначения заказов."""
+
+    def setUp(self):
+        Region.objects.create(code=150)
+        self.interval = TimeInterval.objects.create(name='09:00-18:00')
+        self.next_courier_id = 1500
+        self.next_order_id = 15000
+
+    def create_couriers(self, count):
+        """Создать автомобильных курьеров района 150."""
+
+        couriers = []
+        for _ in range(count):
+            courier = Courier.objects.create(courier_id=self.next_courier_id,
+                                             courier_type='car')
+            courier.regions.add(150)
+            courier.working_hours.add(self.interval)
+            couriers.append(courier)
+            self.next_courier_id += 1
+        return couriers
+
+    def create_orders(self, count):
+        """Создать заказы района 150 по 5 кг, по ORDERS_PER_ASSIGN заказов
+        на один развоз автомобильного курьера."""
+
+        for _ in range(count):
+            Order.objects.create(order_id=self.next_order_id, weight=5,
+                                 region_id=150).delivery_hours.add(
+                self.interval)
+            self.next_order_id += 1
+
+    def assert_no_double_assignment(self):
+        """Проверить, что ни один заказ не попал в два развоза и не остался
+        в таблице неназначенных заказов, а каждый неназначенный заказ есть в
+        ней."""
+
+        duplicates = list(InvoiceOrder.objects.values('order_id').annotate(
+            count=Count('id')).filter(count__gt=1))
+        self.assertListEqual(duplicates, [],
+                             'Заказ назначен нескольким курьерам')
+        self.assertFalse(OpenOrder.objects.filter(
+            order__invoice_orders__isnull=False).exists())
+        self.assertFalse(Order.objects.filter(
+            open_order__isnull=True, invoice_orders__isnull=True).exists(),
+            'Заказ не назначен и не доступен для назначения')
+
+    def test_parallel_assign(self):
+        """Проверить параллельное назначение заказов.
+
+        Проверки:
+        __________
+        * Параллельные назначения получают непересекающиеся наборы заказов,
+          не превышающие грузоподъемность, и ни один заказ не теряется
+        * Параллельные запросы одного курьера получают один развоз
+        * Пропускная способность назначения измеряется для разного числа
+          потоков.
+        """
+
+        for workers in WORKER_COUNTS:
+            couriers = self.create_couriers(workers * ASSIGNS_PER_WORKER)
+            self.create_orders(len(couriers) * ORDERS_PER_ASSIGN)
+
+            def assign_all(couriers):
+                for courier in couriers:
+                    services.get_active_invoice(courier)
+
+            started = time.perf_counter()
+            errors = run_in_threads(assign_all, [
+                (couriers[i::workers],) for i in range(workers)])
+            elapsed = time.perf_counter() - started
+            self.assertListEqual(errors, [])
+            self.assert_no_double_assignment()
+            self.assertEqual(
+                Order.objects.count(),
+                InvoiceOrder.objects.count() + OpenOrder.objects.count(),
+                'Каждый заказ должен быть либо назначен, либо свободен')
+            self.assertTrue(all(
+                weight <= services.COURIER_LOAD_CAPACITY['car']
+                for weight in Order.objects.filter(
+                    invoices__courier__in=couriers).values(
+                    'invoices').annotate(weight=Sum('weight')).values_list(
+                    'weight', flat=True)))
+            print(f'~ assign workers: {workers}  '
+                  f'{len(couriers) / elapsed:8.1f} assigns/s')
+
+        courier = self.create_couriers(1)[0]
+        self.create_orders(ORDERS_PER_ASSIGN)
+        errors = run_in_threads(services.get_active_invoice,
+                                [(courier,)] * 4)
+        self.assertListEqual(errors, [])
+        self.assertEqual(courier.invoices.count(), 1,
+                         'Параллельные запросы курьера создали несколько '
+                         'развозов')
+        self.assert_no_double_assignment()
+
+    def test_parallel_complete(self):
+        """Проверить параллельное завершение заказов одного развоза.
+
+        Проверки:
+        __________
+        * Заказы, завершенные одновременно с одним временем, получают время
+          доставки друг от друга: ненулевое время только у одного заказа,
+          а сумма равна времени от назначения до завершения
+        * Все заказы развоза переходят в состояние доставленных
+        * Вознаграждение за развоз начисляется курьеру один раз.
+        """
+
+        courier = self.create_couriers(1)[0]
+        self.create_orders(ORDERS_PER_ASSIGN)
+        invoice = services.get_active_invoice(courier)
+        invoice_orders = list(invoice.invoice_orders.all())
+        complete_time = invoice.assign_time + timedelta(minutes=30)
+        errors = run_in_threads(services.complete_order, [
+            (invoice_order, complete_time)
+            for invoice_order in invoice_orders])
+        self.assertListEqual(errors, [])
+        delivery_times = list(invoice.invoice_orders.values_list(
+            'delivery_time', flat=True))
+        self.assertEqual(sum(delivery_times), 30 * 60)
+        self.assertEqual(len([x for x in delivery_times if x]), 1)
+        self.assertFalse(invoice.invoice_orders.filter(
+            complete_time__isnull=True).exists())
+        courier.refresh_from_db()
+        self.assertEqual(courier.earnings, invoice.expected_reward)
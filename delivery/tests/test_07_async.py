@@ -0,0 +1,141 @@
+import asyncio
+import base64
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db.models import Count
+from django.test import AsyncClient, TransactionTestCase
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from delivery import async_services, services
+from delivery.models import Courier, Invoice, InvoiceOrder
+from delivery.tests.test_fixtures import create_test_case_full
+
+
+class AsyncEndpointsTests(TransactionTestCase):
+    """Класс AsyncEndpointsTests предназначен для теста асинхронных
+    обработчиков, которые используются при запуске через ASGI.
+
+    Работа с БД асинхронных обработчиков выполняется в потоках пула со своими
+    соединениями, поэтому тесты не оборачиваются в общую транзакцию.
+    """
+
+    def setUp(self):
+        cache.clear()
+        create_test_case_full()
+        self.async_client = AsyncClient()
+        self.sync_client = APIClient()
+
+    async def test_async_assign(self):
+        """Проверить назначение заказов через ASGI.
+
+        Проверки:
+        __________
+        * Ответ асинхронного обработчика совпадает с ответом синхронного
+        * Одновременные запросы одного курьера получают один развоз
+        * Одновременные запросы разных курьеров не получают общих заказов
+        * Неизвестный курьер и неверный метод дают ошибки как в DRF.
+        """
+        url = reverse('orders-assign')
+        responses = await asyncio.gather(*[
+            self.async_client.post(url, {'courier_id': 100},
+                                   content_type='application/json')
+            for _ in range(4)])
+        for response in responses:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertDictEqual(response.json(), responses[0].json())
+        self.assertTrue(responses[0].json()['orders'])
+        self.assertEqual(
+            await async_services.database_sync_to_async(
+                Invoice.objects.filter(courier_id=100).count)(), 1)
+        sync_response = await async_services.database_sync_to_async(
+            self.sync_client.post)(url, {'courier_id': 100}, format='json')
+        self.assertDictEqual(sync_response.json(), responses[0].json())
+
+        await asyncio.gather(*[
+            self.async_client.post(url, {'courier_id': courier_id},
+                                   content_type='application/json')
+            for courier_id in (101, 102, 103)])
+        duplicates = await async_services.database_sync_to_async(
+            lambda: list(InvoiceOrder.objects.values('order_id').annotate(
+                count=Count('id')).filter(count__gt=1)))()
+        self.assertListEqual(duplicates, [])
+
+        response = await self.async_client.post(
+            url, {'courier_id': 999}, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = await self.async_client.get(url)
+        self.assertEqual(response.status_code,
+                         status.HTTP_405_METHOD_NOT_ALLOWED)
+
+    async def test_async_courier_detail(self):
+        """Проверить получение и изменение курьера и завершение заказа через
+        ASGI.
+
+        Проверки:
+        __________
+        * Завершение заказа учитывается в рейтинге и заработке курьера
+        * Данные курьера совпадают с ответом синхронного обработчика
+        * Изменение курьера делегируется CourierViewSet
+        * Для неизвестного курьера возвращается статус 404.
+        """
+        courier = await async_services.database_sync_to_async(
+            Courier.objects.get)(courier_id=102)
+        invoice = await async_services.database_sync_to_async(
+            services.get_active_invoice)(courier)
+        order_id = await async_services.database_sync_to_async(
+            lambda: invoice.invoice_orders.values_list(
+                'order_id', flat=True).first())()
+        response = await self.async_client.post(
+            reverse('orders-complete'),
+            {'courier_id': 102, 'order_id': order_id,
+             'complete_time': timezone.now().isoformat()},
+            content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertDictEqual(response.json(), {'order_id': order_id})
+
+        url = reverse('couriers-detail', args=[102])
+        response = await self.async_client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('rating', response.json())
+        self.assertEqual(
+            response.json()['rating'],
+            await async_services.database_sync_to_async(
+                services.get_courier_rating)(courier))
+        sync_response = await async_services.database_sync_to_async(
+            self.sync_client.get)(url)
+        self.assertDictEqual(response.json(), sync_response.json())
+
+        response = await self.async_client.patch(
+            url, {'courier_type': 'foot'}, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['courier_type'], 'foot')
+
+        response = await self.async_client.get(
+            reverse('couriers-detail', args=[999]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        sync_response = await async_services.database_sync_to_async(
+            self.sync_client.get)(reverse('couriers-detail', args=[999]))
+        self.assertDictEqual(response.json(), sync_response.json())
+
+    async def test_async_export_unavailable(self):
+        """Проверить выгрузку истории доставок через ASGI.
+
+        Проверки:
+        __________
+        * Запрос администратора получает статус 501 вместо потока, который
+          оборвался бы при чтении БД в цикле событий.
+        """
+        await async_services.database_sync_to_async(
+            User.objects.create_user)('accountant', password='secret',
+                                      is_staff=True)
+        credentials = base64.b64encode(b'accountant:secret').decode()
+        response = await self.async_client.get(
+            reverse('deliveries-export'),
+            authorization=f'Basic {credentials}')
+        self.assertEqual(response.status_code,
+                         status.HTTP_501_NOT_IMPLEMENTED)
+        self.assertFalse(response.streaming)
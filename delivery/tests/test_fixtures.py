@@ -1,47 +1,47 @@
 from delivery.models import Courier, Order, Region, TimeInterval
 
+WORKING_HOURS = ['11:35-14:05', '09:00-11:00']
+COURIER_REGIONS = [100, 101, 102]
+OTHER_REGIONS = [110, 111]
+DELIVERY_HOURS_IN = ['10:00-11:36', '12:00-13:00', '14:04-15:00',
+                     '08:00-09:01', '09:00-11:00', '10:59-11:35']
+DELIVERY_HOURS_OUT = ['06:00-07:00', '11:20-11:35', '14:05-16:35',
+                      '18:00-22:00']
+HEAVY_WEIGHTS = [2, 3, 7.5, 9, 9, 11, 29]
 
-def create_test_case_full():
-    working_hours = ['11:35-14:05', '09:00-11:00']
-    courier_regions = [100, 101, 102]
-    other_regions = [110, 111]
-    delivery_hours_in = ['10:00-11:36', '12:00-13:00', '14:04-15:00',
-                         '08:00-09:01', '09:00-11:00', '10:59-11:35']
-    delivery_hours_out = ['06:00-07:00', '11:20-11:35', '14:05-16:35',
-                          '18:00-22:00']
-    heavy_weights = [2, 3, 7.5, 9, 9, 11, 29]
 
-    for name in (working_hours + delivery_hours_in + delivery_hours_out):
+def create_test_case_full():
+    for name in (WORKING_HOURS + DELIVERY_HOURS_IN + DELIVERY_HOURS_OUT):
         TimeInterval.objects.get_or_create(name=name)
-    for code in (courier_regions + other_regions):
+    for code in (COURIER_REGIONS + OTHER_REGIONS):
         Region.objects.get_or_create(code=code)
 
     courier = Courier.objects.create(courier_id=100, courier_type='bike')
-    courier.regions.add(*courier_regions)
-    courier.working_hours.add(*working_hours)
+    courier.regions.add(*COURIER_REGIONS)
+    courier.working_hours.add(*WORKING_HOURS)
     other_courier = Courier.objects.create(courier_id=101, courier_type='bike')
-    other_courier.regions.add(*courier_regions)
-    other_courier.working_hours.add(*working_hours)
+    other_courier.regions.add(*COURIER_REGIONS)
+    other_courier.working_hours.add(*WORKING_HOURS)
     other_courier_2 = Courier.objects.create(courier_id=102,
                                              courier_type='car')
-    other_courier_2.regions.add(*courier_regions)
-    other_courier_2.working_hours.add(*working_hours)
+    other_courier_2.regions.add(*COURIER_REGIONS)
+    other_courier_2.working_hours.add(*WORKING_HOURS)
     other_courier_3 = Courier.objects.create(courier_id=103,
                                              courier_type='car')
-    other_courier_3.regions.add(*courier_regions)
-    other_courier_3.working_hours.add(*working_hours)
+    other_courier_3.regions.add(*COURIER_REGIONS)
+    other_courier_3.working_hours.add(*WORKING_HOURS)
 
     order_id = 100
 
-    for region in courier_regions + other_regions:
-        for interval in delivery_hours_in + delivery_hours_out:
+    for region in COURIER_REGIONS + OTHER_REGIONS:
+        for interval in DELIVERY_HOURS_IN + DELIVERY_HOURS_OUT:
             Order.objects.create(
                 order_id=order_id, weight=0.01,
                 region_id=region).delivery_hours.add(interval)
             order_id += 1
 
-    for weight in heavy_weights:
+    for weight in HEAVY_WEIGHTS:
         Order.objects.create(
             order_id=order_id, weight=weight,
-            region_id=courier_regions[0]).delivery_hours.add(working_hours[0])
+            region_id=COURIER_REGIONS[0]).delivery_hours.add(WORKING_HOURS[0])
         order_id += 1
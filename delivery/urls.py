@@ -1,12 +1,14 @@
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
-from delivery.views import CourierViewSet, OrderViewSet
+from delivery.views import CourierViewSet, DeliveryExportView, OrderViewSet
 
 router = DefaultRouter()
 router.register('couriers', CourierViewSet, basename='couriers')
 router.register('orders', OrderViewSet, basename='orders')
 
 urlpatterns = [
+    path('deliveries/export/', DeliveryExportView.as_view(),
+         name='deliveries-export'),
     path('', include(router.urls))
 ]
@@ -1,14 +1,32 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.http import StreamingHttpResponse
 from rest_framework import mixins, status
+from rest_framework.authentication import (BasicAuthentication,
+                                           SessionAuthentication)
 from rest_framework.decorators import action
+from rest_framework.permissions import IsAdminUser
 from rest_framework.response import Response
+from rest_framework.views import APIView
 from rest_framework.viewsets import GenericViewSet
 
 from candy_delivery.settings import IS_NEW_REGIONS_AND_TIME_INTERVALS_AVAILABLE
+from delivery import services
+from delivery.cache import (courier_response_key, etag_matches,
+                            get_courier_version)
+from delivery.export import EXPORT_CONTENT_TYPES, stream_delivery_history
 from delivery.models import Courier, Order
 from delivery.serializers import (CourierRelationsSerializer,
-                                  CourierSerializer, OrderRelationsSerializer,
+                                  CourierSerializer,
+                                  CourierStatsQuerySerializer,
+                                  DeliveryExportQuerySerializer,
+                                  OrderRelationsSerializer,
                                   OrderSerializer, serialize_assign_order,
-                                  serialize_complete_order)
+                                  serialize_assign_orders_batch,
+                                  serialize_complete_order,
+                                  serialize_complete_orders_batch)
 from delivery.utils import response_200_or_400
 
 
@@ -24,12 +42,19 @@ class CourierViewSet(mixins.CreateModelMixin,
 
     def _add_new_regions_and_intervals(self, data):
         # Если допускаются еще незарегистрированные регионы и интервалы времени
-        # перед созданием курьера добавим их в базу
+        # перед созданием курьера добавим их в базу одним запросом на все
+        # элементы
         if IS_NEW_REGIONS_AND_TIME_INTERVALS_AVAILABLE:
+            relations = {'regions': [], 'working_hours': []}
             for item in data:
                 serializer_relations = CourierRelationsSerializer(data=item)
                 if serializer_relations.is_valid():
-                    serializer_relations.save()
+                    for key, values in relations.items():
+                        values.extend(
+                            serializer_relations.validated_data.get(key, []))
+            CourierRelationsSerializer().create(
+                {key: list(dict.fromkeys(values))
+                 for key, values in relations.items()})
 
     def create(self, request, *args, **kwargs):
         self._add_new_regions_and_intervals(request.data.get('data'))
@@ -41,11 +66,63 @@ class CourierViewSet(mixins.CreateModelMixin,
         return Response({'couriers': serializer.data},
                         status=status.HTTP_201_CREATED)
 
+    def retrieve(self, request, *args, **kwargs):
+        # Ответ кэшируется под текущей версией данных курьера, версия
+        # передается клиенту в ETag
+        timeout = settings.COURIER_CACHE_TIMEOUT
+        if not timeout or not str(kwargs.get('pk')).isdigit():
+            return super().retrieve(request, *args, **kwargs)
+        courier_id = int(kwargs['pk'])
+        version = get_courier_version(courier_id)
+        etag = f'"{version}"'
+        if etag_matches(request, etag, exists=False):
+            return Response(status=status.HTTP_304_NOT_MODIFIED,
+                            headers={'ETag': etag})
+        key = courier_response_key(courier_id, version)
+        data = cache.get(key)
+        if data is None:
+            data = super().retrieve(request, *args, **kwargs).data
+            cache.set(key, data, timeout)
+        # Курьер существует: If-None-Match: * совпадает с его версией
+        if etag_matches(request, etag):
+            return Response(status=status.HTTP_304_NOT_MODIFIED,
+                            headers={'ETag': etag})
+        return Response(data, headers={'ETag': etag})
+
     def update(self, request, *args, **kwargs):
         self._add_new_regions_and_intervals([request.data])
 
         return super().update(request, *args, **kwargs)
 
+    @action(detail=False, methods=['get'])
+    def stats(self, request):
+        # Идентификаторы принимаются списком через запятую или повторением
+        # параметра
+        query = {'ids': [x for value in request.query_params.getlist('ids')
+                         for x in value.split(',') if x]}
+        if 'region' in request.query_params:
+            query['region'] = request.query_params['region']
+        query_serializer = CourierStatsQuerySerializer(data=query)
+        query_serializer.is_valid(raise_exception=True)
+        ids = query_serializer.validated_data.get('ids')
+        region = query_serializer.validated_data.get('region')
+
+        # Связанные поля подгружаются пакетно, рейтинги считаются одним
+        # запросом с группировкой по курьерам
+        couriers = self.get_queryset().prefetch_related(
+            'regions', 'working_hours').order_by('courier_id')
+        if ids:
+            couriers = couriers.filter(courier_id__in=ids)
+        if region is not None:
+            couriers = couriers.filter(regions=region)
+        couriers = list(couriers)
+        ratings = services.get_couriers_ratings(
+            [x.courier_id for x in couriers])
+        serializer = self.get_serializer(
+            couriers, many=True,
+            context={**self.get_serializer_context(), 'ratings': ratings})
+        return Response({'couriers': serializer.data})
+
 
 class OrderViewSet(mixins.CreateModelMixin, GenericViewSet):
     """Класс OrderViewSet предназначен для обработки допустимых событий
@@ -64,7 +141,15 @@ class OrderViewSet(mixins.CreateModelMixin, GenericViewSet):
         serializer = self.get_serializer(
             data=request.data.get('data'), many=True)
         serializer.is_valid(raise_exception=True)
-        serializer.save()
+        # Заказ, его интервалы доставки и строка неназначенного заказа
+        # сохраняются вместе
+        with transaction.atomic():
+            orders = serializer.save()
+        # Подбор развозов для свободных курьеров выполняется после фиксации
+        # заказов, чтобы опрос /orders/assign только возвращал готовый развоз.
+        # Ошибка подбора не отменяет создание заказов.
+        if settings.EAGER_ASSIGNMENT:
+            services.assign_new_orders(orders)
         return Response({'orders': serializer.data},
                         status=status.HTTP_201_CREATED)
 
@@ -73,7 +158,48 @@ class OrderViewSet(mixins.CreateModelMixin, GenericViewSet):
         context = serialize_assign_order(request.data)
         return response_200_or_400(context)
 
+    @action(detail=False, methods=['post'], url_path='assign-batch')
+    def assign_batch(self, request):
+        context = serialize_assign_orders_batch(request.data)
+        return response_200_or_400(context)
+
     @action(detail=False, methods=['post'])
     def complete(self, request):
         context = serialize_complete_order(request.data)
         return response_200_or_400(context)
+
+    @action(detail=False, methods=['post'], url_path='complete-batch')
+    def complete_batch(self, request):
+        context = serialize_complete_orders_batch(request.data)
+        return response_200_or_400(context)
+
+
+class DeliveryExportView(APIView):
+    """Класс DeliveryExportView предназначен для потоковой выгрузки истории
+    доставок на эндпоинте deliveries/export/.
+
+    Выгрузка доступна только сотрудникам с правами администратора.
+    """
+
+    authentication_classes = [BasicAuthentication, SessionAuthentication]
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        # Django 3.1 отдает потоковый ответ ASGI в цикле событий, где чтение
+        # курсора БД недоступно, поэтому под ASGI выгрузка не выполняется
+        if isinstance(request._request, ASGIRequest):
+            return Response(
+                {'error': 'Выгрузка недоступна при запуске через ASGI, '
+                          'используйте команду export_deliveries'},
+                status=status.HTTP_501_NOT_IMPLEMENTED)
+        serializer = DeliveryExportQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        filters = dict(serializer.validated_data)
+        export_format = filters.pop('output')
+        response = StreamingHttpResponse(
+            stream_delivery_history(export_format, settings.EXPORT_CHUNK_SIZE,
+                                    **filters),
+            content_type=EXPORT_CONTENT_TYPES[export_format])
+        response['Content-Disposition'] = (
+            f'attachment; filename="deliveries.{export_format}"')
+        return response